@@ -0,0 +1,114 @@
+"""
+Measure the cold-start time of each pin subcommand.
+
+Every command is run through the entry point of the pin script, in a fresh
+interpreter against an empty, temporary config and data directory, first without
+and then with a running daemon. The fastest of several runs is reported next to
+the startup time of a bare interpreter.
+
+Usage:
+    python benchmarks/startup.py [--runs N] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# The module of the pin script's entry point, which forwards commands to a running daemon
+ENTRY_POINT = [sys.executable, "-m", "pinboard.daemon"]
+# Seconds to wait for a started daemon to listen on its socket
+DAEMON_START_TIMEOUT = 30
+
+COMMANDS = {
+    "python": [sys.executable, "-c", "pass"],
+    "pin --help": ["--help"],
+    "pin ls": ["ls"],
+    "pin history": ["history"],
+    "pin add": ["add", "{file}"],
+    "pin rm": ["rm", "{file}"],
+    "pin cp --help": ["cp", "--help"],
+    "pin sh --help": ["sh", "--help"],
+    "pin succeed --help": ["succeed", "--help"],
+}
+
+def time_command(argv, env, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        durations.append(time.perf_counter() - start)
+    return {"min": min(durations), "median": statistics.median(durations)}
+
+def start_daemon(env):
+    """Start a daemon and wait until it listens. Returns its process."""
+    socket_file = subprocess.run([sys.executable, "-c", "from pinboard.daemon import SOCKET_FILE; print(SOCKET_FILE)"],
+                                 env=env, stdout=subprocess.PIPE, check=True, text=True).stdout.strip()
+    process = subprocess.Popen([*ENTRY_POINT, "daemon"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while not os.path.exists(socket_file):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError("The pin daemon did not start.")
+        time.sleep(0.05)
+    return process
+
+def stop_daemon(process, env):
+    subprocess.run([*ENTRY_POINT, "daemon", "--stop"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        process.wait(DAEMON_START_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def measure_startup(runs, report=None):
+    """
+    Time every command against an empty home, without and with a running daemon,
+    passing each name and result to report as it is measured.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, XDG_CONFIG_HOME=os.path.join(home, "config"), XDG_DATA_HOME=os.path.join(home, "data"))
+        file_path = os.path.join(home, "pinned.txt")
+        with open(file_path, "w") as f:
+            f.write("pinned\n")
+
+        def measure(suffix):
+            for name, command in COMMANDS.items():
+                if command[0] == sys.executable:
+                    if suffix:
+                        continue
+                    argv = command
+                else:
+                    argv = [*ENTRY_POINT, *command]
+                results[name + suffix] = time_command([arg.format(file=file_path) for arg in argv], env, runs)
+                if report is not None:
+                    report(name + suffix, results[name + suffix])
+
+        measure("")
+        daemon = start_daemon(env)
+        try:
+            measure(" (daemon)")
+        finally:
+            stop_daemon(daemon, env)
+    return results
+
+def report(name, result):
+    print(f"{name:<32} min {result['min'] * 1000:7.1f} ms   median {result['median'] * 1000:7.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Number of runs per command")
+    parser.add_argument("--json", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    results = measure_startup(args.runs, report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
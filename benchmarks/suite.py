@@ -0,0 +1,255 @@
+"""
+Benchmark the hot paths of pinboard against a synthetic repository.
+
+A deterministic repository with a deep directory tree and a few large files is
+generated in a temporary directory, together with a synthetic LLM response that
+contains hundreds of <artifactEdit> blocks. Every benchmark is run several times
+against an empty, temporary config and data directory, with a stub Anthropic
+client in place of the API, and the fastest and median runs are reported. The
+response is also recorded in the response cache and replayed from it offline.
+
+Results can be written as JSON and compared against a previous run, in which case
+the script exits with status 1 if any benchmark's median regressed by more than
+the threshold.
+
+Usage:
+    python benchmarks/suite.py [--size small|medium|large] [--runs N] [--json results.json]
+                               [--baseline baseline.json] [--threshold 1.25] [--startup]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+SIZES = {
+    "small": {"files": 1_000, "depth": 4, "large_files": 2},
+    "medium": {"files": 10_000, "depth": 6, "large_files": 5},
+    "large": {"files": 100_000, "depth": 8, "large_files": 10},
+}
+LINES_PER_FILE = 40
+LINES_PER_LARGE_FILE = 50_000
+EDITS_PER_RESPONSE = 300
+EDITS_PER_LARGE_FILE = 200
+# Benchmarks faster than this are compared with some slack, since they are dominated by noise
+MIN_COMPARED_SECONDS = 0.005
+
+def generate_line(rng: random.Random, i: int) -> str:
+    name = rng.choice(["value", "result", "items", "config", "index", "buffer"])
+    return f"    {name}_{i} = compute_{rng.randrange(1000)}({name}, {rng.randrange(100)})"
+
+def generate_repo(root: str, files: int, depth: int, large_files: int, seed: int = 0):
+    """Write a repository with the given number of files, spread over a tree of the given depth."""
+    rng = random.Random(seed)
+    directories = [root]
+    for i in range(max(files // 20, 1)):
+        parent = rng.choice([d for d in directories[-50:] if d.count(os.sep) - root.count(os.sep) < depth] or [root])
+        directories.append(os.path.join(parent, f"module_{i}"))
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    for i in range(files):
+        path = os.path.join(rng.choice(directories), f"file_{i}.py")
+        lines = LINES_PER_LARGE_FILE if i < large_files else LINES_PER_FILE
+        with open(path, "w") as f:
+            f.write(f"def function_{i}():\n")
+            f.write("\n".join(generate_line(rng, j) for j in range(lines - 1)))
+            f.write("\n")
+        paths.append(path)
+    return paths
+
+def generate_response(paths, large_files: int, seed: int = 0) -> str:
+    """
+    Generate a response with EDITS_PER_RESPONSE single-line edits that keep every file's
+    line count, so the response can be applied over and over to the same repository.
+    """
+    rng = random.Random(seed)
+    blocks = ["Here are the changes:\n"]
+    for path in paths[:large_files]:
+        for line in sorted(rng.sample(range(2, LINES_PER_LARGE_FILE + 1), EDITS_PER_LARGE_FILE)):
+            blocks.append(f'<artifactEdit identifier="{path}" from="{line}" to="{line}">{generate_line(rng, line)}</artifactEdit>\n')
+    remaining = max(EDITS_PER_RESPONSE - large_files * EDITS_PER_LARGE_FILE, 0)
+    for path in rng.sample(paths[large_files:], min(remaining, len(paths) - large_files)):
+        line = rng.randrange(2, LINES_PER_FILE + 1)
+        blocks.append(f'<artifactEdit identifier="{path}" from="{line}" to="{line}">{generate_line(rng, line)}</artifactEdit>\n')
+    return "".join(blocks)
+
+class StubMessages:
+    def __init__(self, reply: str):
+        self.reply = reply
+
+    def create(self, **request):
+        return types.SimpleNamespace(content=[types.SimpleNamespace(text=self.reply)],
+                                     usage=types.SimpleNamespace(input_tokens=0, output_tokens=0))
+
+class StubClient:
+    """Stands in for the Anthropic client and answers every request with the same reply."""
+
+    def __init__(self, reply: str):
+        self.messages = StubMessages(reply)
+
+def measure(function, runs: int, setup=None):
+    durations = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {"min": min(durations), "median": statistics.median(durations)}
+
+def run_benchmarks(root: str, size: str, runs: int):
+    # pinboard resolves its data and config directories on import
+    from pinboard import cache, file, llm, pin, utils
+    from pinboard.clip import copy_pinboard
+    from pinboard.pin import add_pins, get_pinned_items, get_unique_files, invalidate_index
+
+    # No clipboard is needed to measure how the pinboard is rendered
+    sys.modules["pyclip"] = types.SimpleNamespace(copy=lambda text: None, paste=lambda: b"")
+
+    paths = generate_repo(root, **SIZES[size])
+    large_files = SIZES[size]["large_files"]
+    response = generate_response(paths, large_files)
+    large_content = utils.get_file_content(paths[0])
+    large_edits = utils.parse_llm_response(response).get(paths[0], [])
+    add_pins([root])
+
+    def cold_index():
+        invalidate_index()
+        pin._index = None
+        file._verdicts = None
+        for path in (pin.INDEX_FILE, file.VERDICTS_FILE):
+            if os.path.exists(path):
+                os.remove(path)
+        utils.invalidate_file_contents()
+
+    def silently(function):
+        def run():
+            with open(os.devnull, "w") as devnull:
+                stdout = sys.stdout
+                sys.stdout = devnull
+                try:
+                    function()
+                finally:
+                    sys.stdout = stdout
+        return run
+
+    def chat(reply):
+        def run():
+            llm._client = StubClient(reply)
+            llm.chat("Rename compute in function_1 and update the callers")
+        return silently(run)
+
+    recorded = []
+
+    def record_reply():
+        invalidate_index()
+        # Recorded once the edits of 'chat with edits' are in place, since applying them again
+        # leaves the files, and with them the request, unchanged
+        if not recorded:
+            os.environ[cache.CACHE_ENV] = "refresh"
+            try:
+                chat(response)()
+            finally:
+                del os.environ[cache.CACHE_ENV]
+            recorded.append(True)
+
+    def replay():
+        os.environ[cache.CACHE_ENV] = "replay"
+        try:
+            llm._client = None
+            llm.chat("Rename compute in function_1 and update the callers")
+        finally:
+            del os.environ[cache.CACHE_ENV]
+
+    benchmarks = {
+        "get_unique_files (cold)": (lambda: get_unique_files(get_pinned_items()), cold_index),
+        "get_unique_files (warm)": (lambda: get_unique_files(get_pinned_items()), invalidate_index),
+        "copy_pinboard": (copy_pinboard, invalidate_index),
+        "chat prompt": (chat("No changes are needed."), invalidate_index),
+        "chat with edits": (chat(response), invalidate_index),
+        "chat with edits (replayed)": (silently(replay), record_reply),
+        "parse_llm_response": (lambda: utils.parse_llm_response(response), None),
+        "apply_edits (large file)": (lambda: utils.apply_edits(large_content, large_edits), None),
+    }
+
+    results = {}
+    for name, (function, setup) in benchmarks.items():
+        results[name] = measure(function, runs, setup)
+        report(name, results[name])
+    return results
+
+def load_startup():
+    # Loaded from next to this file, whatever the working directory and sys.path
+    spec = importlib.util.spec_from_file_location("startup", os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup.py"))
+    startup = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(startup)
+    return startup
+
+def run_startup(runs: int):
+    results = load_startup().measure_startup(runs, lambda name, result: report(f"startup: {name}", result))
+    return {f"startup: {name}": result for name, result in results.items()}
+
+def report(name: str, result):
+    print(f"{name:<32} min {result['min'] * 1000:9.1f} ms   median {result['median'] * 1000:9.1f} ms")
+
+def compare(results, baseline, threshold: float):
+    """Return the benchmarks whose median exceeds the baseline median by more than the threshold."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        allowed = max(baseline[name]["median"], MIN_COMPARED_SECONDS) * threshold
+        if result["median"] > allowed:
+            regressions.append(f"{name}: median {result['median'] * 1000:.1f} ms, baseline {baseline[name]['median'] * 1000:.1f} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=SIZES, default="small", help="Size of the synthetic repository")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs per benchmark")
+    parser.add_argument("--json", help="Write the results to this file as JSON")
+    parser.add_argument("--baseline", help="Compare the results against a JSON file written by a previous run")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Maximum allowed ratio of a median to its baseline median")
+    parser.add_argument("--startup", action="store_true", help="Also measure the cold start of every subcommand")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        os.environ.update(HOME=home, XDG_CONFIG_HOME=os.path.join(home, "config"), XDG_DATA_HOME=os.path.join(home, "data"))
+        root = os.path.join(home, "repo")
+        os.makedirs(root)
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            results = run_benchmarks(root, args.size, args.runs)
+        finally:
+            os.chdir(cwd)
+    if args.startup:
+        results.update(run_startup(args.runs))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"size": args.size, "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("size") != args.size:
+            print(f"The baseline was measured with --size {baseline.get('size')}, not {args.size}.")
+            sys.exit(2)
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:g}x:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.threshold:g}x.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import asyncio
+import difflib
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+from .context import pack_files, prune_cache, estimate_tokens
+from .gather import read_files
+from .history import operation_group
+from .llm import (EditApplier, LLMUnavailableError, build_chat_request, build_requested_prompt, build_term_prompt, describe_error, get_all_pinned_files,
+                  get_explicitly_pinned_files, get_request_deadline, get_retry_policy, get_usage_fields, is_retryable, MAX_ARTIFACT_REQUESTS)
+from .cache import get_cache_mode, lookup_response, store_response
+from .outline import render_pinned_file, save_outlines
+from .pin import get_pinned_items, get_outline_files, get_symbol_files
+from .trace import record, span
+from .utils import ArtifactEditParser, parse_artifact_requests
+from .format import print_error, print_info
+
+DEFAULT_BATCH_CONCURRENCY = 4
+
+class BatchJob:
+    """One message of a job file, along with its request and outcome."""
+
+    def __init__(self, job_id: str, message: str, paths: Optional[List[str]] = None):
+        self.id = job_id
+        self.message = message
+        # Pinned files and folders the job is restricted to, None for all pinned files
+        self.paths = paths
+        self.files: List[str] = []
+        self.dropped: List[str] = []
+        self.request: Dict[str, Any] = {}
+        self.response = ""
+        self.usage: Dict[str, Optional[int]] = {}
+        self.duration = 0.0
+        self.retries = 0
+        # Responses that were served from the response cache
+        self.cached = 0
+        self.error: Optional[str] = None
+        self.status = "pending"
+        self.parser: Optional[ArtifactEditParser] = None
+        self.applier: Optional[EditApplier] = None
+
+    def select_files(self, pinned_files: List[str]) -> List[str]:
+        if self.paths is None:
+            return pinned_files
+        prefixes = tuple(path + os.sep for path in self.paths)
+        return [file_path for file_path in pinned_files if file_path in self.paths or file_path.startswith(prefixes)]
+
+def load_jobs(jobs_file: str) -> List[BatchJob]:
+    """
+    Read a JSONL job file. Every line holds an object with a 'message', and optionally an
+    'id' and the 'files' (pinned files or folders) the job is restricted to.
+    """
+    jobs: List[BatchJob] = []
+    with open(jobs_file, "r") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Line {number} of {jobs_file} is not valid JSON: {e}")
+            if not isinstance(entry, dict) or not isinstance(entry.get("message"), str):
+                raise ValueError(f"Line {number} of {jobs_file} has no 'message'.")
+            paths = entry.get("files")
+            if paths is not None:
+                if isinstance(paths, str):
+                    paths = [paths]
+                paths = [os.path.abspath(path) for path in paths]
+            job_id = re.sub(r"[^A-Za-z0-9._-]", "_", str(entry.get("id", number)))
+            if any(job.id == job_id for job in jobs):
+                raise ValueError(f"Line {number} of {jobs_file} repeats the job id '{job_id}'.")
+            jobs.append(BatchJob(job_id, entry["message"], paths))
+    return jobs
+
+def prepare_requests(jobs: List[BatchJob], clipboard_content: Optional[str] = None):
+    """
+    Build the request of every job from one snapshot of the pinned files, which are
+    rendered once. Jobs that end up with the same files share a byte-identical
+    workspace prefix and thus the prompt cache.
+    """
+    pinned_items = get_pinned_items()
+    symbol_files, outline_files = get_symbol_files(pinned_items), get_outline_files(pinned_items)
+    pinned_files = get_all_pinned_files()
+    prune_cache(pinned_files)
+    explicit_files = get_explicitly_pinned_files()
+    contents = dict(read_files(pinned_files, read=lambda file_path: render_pinned_file(file_path, symbol_files, outline_files)))
+    save_outlines()
+    tokens = {file_path: estimate_tokens(content) for file_path, content in contents.items()}
+
+    term_prompt = build_term_prompt()
+    if clipboard_content:
+        term_prompt += f"Clipboard content:\n{clipboard_content}\n\n"
+
+    workspace_prompts: Dict[tuple, str] = {}
+    for job in jobs:
+        job.files, job.dropped = pack_files(job.select_files(pinned_files), explicit_files, job.message, tokens=tokens)
+        key = tuple(job.files)
+        if key not in workspace_prompts:
+            workspace_prompts[key] = "Workspace overview. Current pinned items:\n\n" + "".join(
+                f"<artifact identifier=\"{file}\">\n{contents[file]}\n</artifact>\n\n" for file in job.files)
+        job.request = build_chat_request(workspace_prompts[key], term_prompt + f"User: {job.message}")
+        job.parser = ArtifactEditParser()
+
+class Dispatcher:
+    """
+    Send requests concurrently on an asyncio client, at most concurrency at a time.
+
+    Failed requests are retried according to the process's retry policy, like those
+    of 'pin sh'. A rate limit pauses all requests, not just the one that ran into it.
+    Any client with an async messages.create can be passed instead of the SDK's.
+    """
+
+    def __init__(self, concurrency: int, client=None):
+        if client is None:
+            # Imported lazily, the SDK takes longer to import than all other modules combined
+            from anthropic import AsyncAnthropic
+            # Retries are made here, so that they can be coordinated between requests
+            client = AsyncAnthropic(max_retries=0)
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.resume_at = 0.0
+
+    async def send(self, job: BatchJob, request: Dict[str, Any]) -> str:
+        hit = lookup_response(request)
+        if hit is not None:
+            job.cached += 1
+            return hit[0]
+        if get_cache_mode() == "replay":
+            raise LLMUnavailableError("No response was recorded for this request, and none are requested while replaying.")
+
+        policy = get_retry_policy()
+        deadline = time.monotonic() + get_request_deadline()
+        attempt = 1
+        while True:
+            delay = self.resume_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            policy.check()
+            start = time.perf_counter()
+            try:
+                response = await self.client.messages.create(**request, timeout=deadline - time.monotonic())
+                break
+            except Exception as e:
+                delay = policy.get_delay(e, attempt, deadline)
+                if delay is None:
+                    if is_retryable(e):
+                        raise policy.failed(e) from e
+                    raise
+                if getattr(e, "status_code", None) == 429:
+                    self.resume_at = max(self.resume_at, time.monotonic() + delay)
+                record("llm.retry", delay, attempt=attempt, error=describe_error(e))
+                job.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+        policy.succeeded()
+        usage = get_usage_fields(response.usage)
+        record("llm.request", time.perf_counter() - start, model=request["model"], streamed=False, batch=True, **usage)
+        for field, value in usage.items():
+            job.usage[field] = (job.usage.get(field) or 0) + (value or 0)
+        content = response.content[0].text if response.content else ""
+        store_response(request, content, usage)
+        return content
+
+    async def run(self, job: BatchJob):
+        async with self.semaphore:
+            start = time.perf_counter()
+            request = job.request
+            try:
+                for _ in range(MAX_ARTIFACT_REQUESTS):
+                    content = await self.send(job, request)
+                    requested = [file_path for file_path in dict.fromkeys(parse_artifact_requests(content))
+                                 if job.parser.is_editable(file_path) and os.path.isfile(file_path)]
+                    if "<artifactEdit" in content or not requested:
+                        break
+                    follow_up = [{"role": "assistant", "content": content}, {"role": "user", "content": build_requested_prompt(requested)}]
+                    request = dict(request, messages=request["messages"] + follow_up)
+                else:
+                    content = await self.send(job, request)
+                job.response = content
+            except Exception as e:
+                job.error = str(e) or type(e).__name__
+                job.status = "failed"
+            job.duration = time.perf_counter() - start
+
+async def dispatch(jobs: List[BatchJob], concurrency: int, client=None):
+    # Created within the event loop, which the semaphore binds to on older Pythons
+    dispatcher = Dispatcher(concurrency, client)
+    try:
+        await asyncio.gather(*(dispatcher.run(job) for job in jobs))
+    finally:
+        # A client that was passed in is closed by its owner
+        if client is None:
+            await dispatcher.client.close()
+
+def stage_edits(job: BatchJob):
+    """Apply the edits of a job's response in memory, without touching any file."""
+    if job.status == "failed":
+        return
+    job.parser.feed(job.response)
+    job.applier = EditApplier("batch", stage=False)
+    for file_path, edits in job.parser.edited_files.items():
+        job.applier.apply(file_path, edits)
+    job.status = "edited" if job.applier.edited_files else "answered"
+
+def render_job_diff(job: BatchJob) -> str:
+    diff = []
+    for file_path in sorted(job.applier.edited_files):
+        before = job.applier.original_contents.get(file_path)
+        after = job.applier.updated_contents.get(file_path)
+        diff.extend(difflib.unified_diff(
+            (before or "").splitlines(keepends=True), (after or "").splitlines(keepends=True),
+            fromfile=file_path if before is not None else "/dev/null",
+            tofile=file_path if after is not None else "/dev/null"))
+    return "".join(line if line.endswith("\n") else line + "\n\\ No newline at end of file\n" for line in diff)
+
+def write_results(jobs: List[BatchJob], output_dir: str):
+    """Write the outcome of every job as <id>.json, and its proposed edits as <id>.diff."""
+    os.makedirs(output_dir, exist_ok=True)
+    for job in jobs:
+        result = {
+            "id": job.id,
+            "message": job.message,
+            "status": job.status,
+            "files": job.files,
+            "dropped": job.dropped,
+            "response": job.response,
+            "changes": job.applier.edited_files if job.applier is not None else {},
+            "rejected": job.applier.rejected if job.applier is not None else {},
+            "usage": job.usage,
+            "duration": round(job.duration, 3),
+            "retries": job.retries,
+            "cached": job.cached,
+            "error": job.error,
+        }
+        with open(os.path.join(output_dir, f"{job.id}.json"), "w") as f:
+            json.dump(result, f, indent=2)
+        diff_file = os.path.join(output_dir, f"{job.id}.diff")
+        if job.applier is not None and job.applier.edited_files:
+            with open(diff_file, "w") as f:
+                f.write(render_job_diff(job))
+        elif os.path.exists(diff_file):
+            os.remove(diff_file)
+
+def apply_jobs(jobs: List[BatchJob]):
+    """
+    Commit the edits of every job in job order, as one group of operations. All edits
+    were made against the same snapshot, so a job that edits a file an earlier job
+    already changed is skipped.
+    """
+    changed: Dict[str, str] = {}
+    with operation_group():
+        for job in jobs:
+            if job.status != "edited":
+                continue
+            conflicts = sorted(file_path for file_path in job.applier.edited_files if file_path in changed)
+            if conflicts:
+                print_error(f"Skipped the edits of job {job.id}, which conflict with job {changed[conflicts[0]]} in: {', '.join(conflicts)}")
+                job.status = "conflict"
+                continue
+            job.applier.promote()
+            if not job.applier.edited_files:
+                job.status, job.error = "failed", "The edits could not be applied."
+                continue
+            job.status = "applied"
+            changed.update((file_path, job.id) for file_path in job.applier.edited_files)
+
+def run_batch(jobs: List[BatchJob], output_dir: str, concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+              apply: bool = False, clipboard_content: Optional[str] = None, client=None):
+    """
+    Run every job against one snapshot of the pinned files. Results are written to the
+    output folder, and edits are only applied to the files with apply. Requests are sent
+    with client if given, otherwise to the API at ANTHROPIC_BASE_URL, if set.
+    """
+    with span("batch.run", jobs=len(jobs), concurrency=concurrency):
+        prepare_requests(jobs, clipboard_content)
+        print_info(f"Sending {len(jobs)} job(s), {min(concurrency, len(jobs))} at a time...")
+        asyncio.run(dispatch(jobs, concurrency, client))
+        for job in jobs:
+            stage_edits(job)
+        if apply:
+            apply_jobs(jobs)
+        write_results(jobs, output_dir)
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Tuple
+from .config import get_setting, set_config
+from .pin import DATA_DIR, ensure_data_dir
+
+RESPONSE_CACHE_FILE = os.path.join(DATA_DIR, "responses.db")
+# Overrides the response cache setting with one of CACHE_MODES, e.g. to replay recorded responses offline
+CACHE_ENV = "PINBOARD_CACHE"
+CACHE_MODES = ("off", "on", "refresh", "replay")
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    content TEXT NOT NULL,
+    usage TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+"""
+
+_connection: Optional[sqlite3.Connection] = None
+# Mode chosen with --no-cache or --refresh for the current command
+_override: Optional[str] = None
+
+def get_cache_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        ensure_data_dir()
+        # Daemon commands run one at a time, but each in the thread of its connection
+        _connection = sqlite3.connect(RESPONSE_CACHE_FILE, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.executescript(SCHEMA)
+    return _connection
+
+def set_cache_override(no_cache: bool = False, refresh: bool = False):
+    """Apply the cache flags of a command. Called by every command that queries the LLM, so that no override outlives it in the daemon."""
+    global _override
+    _override = "off" if no_cache else "refresh" if refresh else None
+
+def get_cache_mode() -> str:
+    """
+    Return how responses are cached: not at all ('off'), looked up and stored ('on'),
+    only stored ('refresh'), or only looked up, without ever querying the LLM ('replay').
+    """
+    if _override is not None:
+        return _override
+    # The environment is checked on every call, since the daemon swaps it per command
+    mode = os.environ.get(CACHE_ENV, "")
+    if mode in CACHE_MODES:
+        return mode
+    return "on" if get_setting("response_cache", False) else "off"
+
+def set_cache_enabled(enabled: bool):
+    set_config("response_cache", enabled)
+
+def get_max_cache_bytes() -> int:
+    return get_setting("response_cache_max_bytes", DEFAULT_MAX_CACHE_BYTES)
+
+def get_request_key(request: Dict[str, Any]) -> str:
+    """Hash the parts of a request that determine its response: the model, system prompt and messages."""
+    payload = json.dumps([request["model"], request.get("system"), request["messages"]], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def lookup_response(request: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Return the cached content and usage of the response to a request, if responses are looked up."""
+    if get_cache_mode() not in ("on", "replay"):
+        return None
+    connection = get_cache_connection()
+    key = get_request_key(request)
+    row = connection.execute("SELECT content, usage FROM responses WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    with connection:
+        connection.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+    return row[0], json.loads(row[1])
+
+def store_response(request: Dict[str, Any], content: str, usage: Dict[str, Any]):
+    if get_cache_mode() not in ("on", "refresh"):
+        return
+    connection = get_cache_connection()
+    now = time.time()
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO responses (key, model, content, usage, size, created, used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (get_request_key(request), request["model"], content, json.dumps(usage), len(content.encode("utf-8")), now, now))
+        evict(connection)
+
+def evict(connection: sqlite3.Connection) -> int:
+    """Drop the least recently used responses until the cache fits the configured size cap."""
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    max_bytes = get_max_cache_bytes()
+    if total <= max_bytes:
+        return 0
+    evicted = []
+    for key, size in connection.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+        if total <= max_bytes:
+            break
+        evicted.append((key,))
+        total -= size
+    connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+    return len(evicted)
+
+def get_cache_stats() -> Tuple[int, int]:
+    """Return the number of cached responses and their total size in bytes."""
+    if not os.path.exists(RESPONSE_CACHE_FILE):
+        return 0, 0
+    count, total = get_cache_connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+    return count, total
+
+def clear_cache() -> int:
+    if not os.path.exists(RESPONSE_CACHE_FILE):
+        return 0
+    with get_cache_connection() as connection:
+        return connection.execute("DELETE FROM responses").rowcount
@@ -1,36 +1,54 @@
-from pinboard.shell import run_command
-from .config import get_succeed_operations, clear_succeed_operations
-import re
+from pinboard.shell import run_command, CommandResult
 import typer
 import os
 import json
 import shlex
+import time
 from typing import List, Dict, Optional
 from rich import print
 from rich.panel import Panel
 from rich.table import Table
-from rich.console import Console
 from rich import box
-from .pin import add_pins, clear_pins, get_pinned_items, remove_pins
-from .clip import copy_pinboard
-from .config import set_llm_config, get_last_operation, get_file_version, clear_last_operation
-from .utils import get_clipboard_content
-from .format import print_success, print_error, print_info, print_file_change
-from .file import update_file, remove_file
-from .llm import chat as llm_chat, succeed_chat
+from .pin import add_pins, clear_pins, get_pinned_folder, get_pinned_items, get_excluded_files, is_outline_item, remove_pins, invalidate_index
+from .file import format_size, get_max_file_bytes, get_max_total_bytes
+from .cache import CACHE_ENV, clear_cache, get_cache_mode, get_cache_stats, get_max_cache_bytes, set_cache_enabled, set_cache_override
+from .symbols import get_symbol_span, is_symbol_item, split_symbol_item
+from .config import set_llm_config, set_config
+from .history import operation_group, list_operations, undo as undo_operations, redo as redo_operations
+from .trace import flush as flush_trace, load_spans, set_command, set_profiling, summarize, PROFILE_ENV
+from .format import console, print_success, print_error, print_info, print_file_change, collapse_artifact_edits, ResponseStream
+
+# Modules that pull in heavy dependencies (anthropic, pyclip) are imported inside
+# the commands that need them, so that startup stays fast for everything else
 
 app = typer.Typer()
-console = Console()
+
+@app.callback()
+def main(ctx: typer.Context, profile: bool = typer.Option(False, "--profile", help=f"Record timings of this command for 'pin stats' (or set {PROFILE_ENV}=1)")):
+    """
+    Manage pinned files and edit them with an LLM.
+    """
+    if profile:
+        set_profiling(True)
+    set_command(ctx.invoked_subcommand)
 
 @app.command()
-def add(items: List[str] = typer.Argument(..., help="File or folder paths to add to the pinboard, or tmux sessions with @tmux suffix")):
+def add(items: List[str] = typer.Argument(..., help="File or folder paths to add to the pinboard, symbols as path::name, outlined folders with @outline suffix, or tmux sessions with @tmux suffix")):
     """
     Add file or folder paths to the pinboard, or tmux sessions with @tmux suffix.
 
     This command allows you to pin specific files, entire folders, or tmux sessions for quick access and manipulation.
     For tmux sessions, append '@tmux' to the session name (e.g., 'mysession@tmux').
 
-    If a folder is added, all valid files within that folder (and its subfolders) will be included in the pinboard.
+    To pin a single function or class of a Python file, append its qualified name (e.g., 'app.py::Server.start').
+    Only the lines of pinned symbols are sent to the LLM, with their line numbers in the whole file.
+
+    To pin a folder as an outline, append '@outline' (e.g., 'src/@outline'). Its files are sent as their
+    signatures and docstrings only, unless they are pinned otherwise, and the LLM can ask for their full content.
+    Files that cannot be outlined, such as non-Python files, are only listed with their path and size.
+
+    If a folder is added, all valid files within that folder (and its subfolders) will be included in the pinboard,
+    except for files ignored by .gitignore, .git/info/exclude or .pinboardignore files.
     """
     valid_items = []
     invalid_items = []
@@ -39,6 +57,16 @@ def add(items: List[str] = typer.Argument(..., help="File or folder paths to add
         if item.endswith("@tmux"):
             # For tmux sessions, we can't easily check if they exist, so we'll assume they're valid
             valid_items.append(item)
+        elif is_outline_item(item):
+            if os.path.isdir(get_pinned_folder(item)):
+                valid_items.append(item)
+            else:
+                invalid_items.append(item)
+        elif is_symbol_item(item):
+            if get_symbol_span(*split_symbol_item(item)) is not None:
+                valid_items.append(item)
+            else:
+                invalid_items.append(item)
         elif os.path.exists(item):
             valid_items.append(item)
         else:
@@ -82,6 +110,7 @@ def cp():
     including file contents and tmux session outputs, and copies it to the system clipboard.
     This is useful for quickly sharing the current state of your pinboard or for use with language models.
     """
+    from .clip import copy_pinboard
     copy_pinboard()
     print_success("Pinboard contents copied to clipboard.")
 
@@ -100,12 +129,76 @@ def llm(model: str):
     print_success(f"LLM set to {model}.")
 
 @app.command()
-def ls():
+def budget(tokens: int = typer.Argument(..., help="Maximum number of tokens of pinned file content to send, or 0 for no limit")):
+    """
+    Configure the token budget for pinned file contents sent to the LLM.
+
+    When the pinned files exceed the budget, explicitly pinned files are kept first and the files
+    from pinned folders are ranked by their relevance to the message. Files that do not fit are left out.
+    """
+    set_config("context_budget", tokens)
+    if tokens > 0:
+        print_success(f"Context budget set to {tokens} tokens.")
+    else:
+        print_success("Context budget disabled.")
+
+@app.command()
+def limit(
+    file_size: Optional[float] = typer.Option(None, "--file", help="Largest file to pin in MB, or 0 for no limit"),
+    total_size: Optional[float] = typer.Option(None, "--total", help="Total size of pinned file contents in MB, or 0 for no limit")
+):
+    """
+    Configure the size limits for pinned files, or show them if no limit is given.
+
+    Files above the per-file limit, and files that look binary or are not UTF-8 text, are left out
+    of the pinboard. Once the total limit is reached, further files from pinned folders are left out.
+    """
+    for key, size in (("max_file_bytes", file_size), ("max_total_bytes", total_size)):
+        if size is not None:
+            set_config(key, int(size * 1024 * 1024))
+    limits = [(name, format_size(size) if size else "none")
+              for name, size in (("File size", get_max_file_bytes()), ("Total size", get_max_total_bytes()))]
+    print_info("\n".join(f"{name} limit: {size}" for name, size in limits))
+
+@app.command()
+def cache(action: Optional[str] = typer.Argument(None, help="'on' or 'off' to enable or disable the response cache, or 'clear' to empty it")):
+    """
+    Show, enable, disable or clear the cache of LLM responses.
+
+    When enabled, responses are stored in the data directory by a hash of the model, system prompt
+    and messages, so that sending the same pinned state and message again is answered from the cache.
+    The least recently used responses are evicted once the cache grows past its size cap. Use
+    --no-cache or --refresh with 'pin sh' and 'pin succeed' to bypass the cache for one run.
+
+    Set PINBOARD_CACHE=replay to only answer from the cache without ever querying the LLM, e.g. to
+    replay a recorded session offline, or to on, off or refresh to override the setting.
+    """
+    if action == "on":
+        set_cache_enabled(True)
+    elif action == "off":
+        set_cache_enabled(False)
+    elif action == "clear":
+        print_success(f"Cleared {clear_cache()} cached response(s).")
+        return
+    elif action is not None:
+        print_error("Please use 'on', 'off' or 'clear'.")
+        raise typer.Exit(code=1)
+
+    count, total = get_cache_stats()
+    mode = get_cache_mode()
+    state = "enabled" if mode == "on" else "disabled" if mode == "off" else f"in {mode} mode"
+    source = f" (set by {CACHE_ENV})" if os.environ.get(CACHE_ENV) == mode else ""
+    print_info(f"The response cache is {state}{source}, holding {count} response(s) in {format_size(total)} "
+               f"of at most {format_size(get_max_cache_bytes())}.")
+
+@app.command()
+def ls(excluded: bool = typer.Option(False, "--excluded", "-x", help="Also list the pinned files that are left out and why")):
     """
     List all pinned files, folders, and tmux sessions.
 
     This command displays a formatted table showing all items currently pinned in the pinboard.
-    It categorizes items as files, directories, or tmux sessions for easy overview.
+    It categorizes items as files, directories, or tmux sessions for easy overview. The files of
+    pinned folders that are left out, e.g. binary or oversized files, are only listed with --excluded.
     """
     pinned_items = get_pinned_items()
     if pinned_items:
@@ -122,15 +215,39 @@ def ls():
         for item in pinned_items:
             if item.endswith("@tmux"):
                 table.add_row("Tmux Session", item[:-5])
+            elif is_symbol_item(item):
+                table.add_row("Symbol", item)
+            elif is_outline_item(item):
+                table.add_row("Outline", get_pinned_folder(item))
             elif os.path.isdir(item):
                 table.add_row("Directory", item)
             else:
                 table.add_row("File", item)
 
         console.print(table)
+        # Classifying the files of pinned folders reads them, so it is only done when asked for
+        if excluded:
+            print_excluded_files(get_excluded_files(pinned_items))
     else:
         print_info("The pinboard is currently empty.")
 
+def print_excluded_files(excluded_files: Dict[str, str]):
+    if not excluded_files:
+        print_info("No pinned files are left out.")
+        return
+    table = Table(
+        border_style="yellow",
+        box=box.ROUNDED,
+        expand=False,
+        show_header=True,
+        header_style="bold"
+    )
+    table.add_column(f"Excluded file ({len(excluded_files)} total)")
+    table.add_column("Reason")
+    for file_path, reason in sorted(excluded_files.items()):
+        table.add_row(os.path.relpath(file_path), reason)
+    console.print(table)
+
 def execute_pin_command(command: str):
     """Execute a pin command without the 'pin' prefix."""
     args = shlex.split(command)
@@ -151,10 +268,33 @@ def execute_pin_command(command: str):
             llm(remaining_args[0])
         else:
             print_error("Please provide a model name for the llm command.")
+    elif cmd == "budget":
+        if remaining_args and remaining_args[0].isdigit():
+            budget(int(remaining_args[0]))
+        else:
+            print_error("Please provide a number of tokens for the budget command.")
     elif cmd == "ls":
-        ls()
+        ls(any(arg in ("--excluded", "-x") for arg in remaining_args))
+    elif cmd == "limit":
+        options = dict(zip(remaining_args[::2], remaining_args[1::2]))
+        try:
+            limit(float(options["--file"]) if "--file" in options else None,
+                  float(options["--total"]) if "--total" in options else None)
+        except ValueError:
+            print_error("Please provide sizes in MB for the limit command.")
+    elif cmd == "cache":
+        cache(remaining_args[0] if remaining_args else None)
     elif cmd == "undo":
-        undo()
+        if remaining_args[:1] == ["--to"] and len(remaining_args) == 2 and remaining_args[1].isdigit():
+            undo(int(remaining_args[1]))
+        else:
+            undo(None)
+    elif cmd == "redo":
+        redo()
+    elif cmd == "history":
+        history(20)
+    elif cmd == "stats":
+        stats(DEFAULT_STATS_RUNS)
     else:
         print_error(f"Unknown command: {cmd}")
 
@@ -162,7 +302,15 @@ def execute_pin_command(command: str):
 def sh(
     message: str = typer.Argument(None, help="Message to send to the LLM for one-time processing"),
     with_clipboard: bool = typer.Option(False, "--with-clipboard", "-clip", help="Include clipboard content in the chat context"),
-    verbose: bool = typer.Option(False, "--verbose", "-v", help="Show full response from the language model")
+    verbose: bool = typer.Option(False, "--verbose", "-v", help="Show full response from the language model"),
+    stream: bool = typer.Option(False, "--stream", "-s", help="Stream the response from the language model as it is generated"),
+    apply_early: bool = typer.Option(False, "--apply-early", help="When streaming, stage each file edit as soon as it has been received"),
+    batch: Optional[str] = typer.Option(None, "--batch", help="Send the messages of a JSONL job file concurrently against one snapshot of the pinned files"),
+    concurrency: int = typer.Option(4, "--concurrency", "-j", help="Maximum number of batch jobs in flight at once"),
+    output: Optional[str] = typer.Option(None, "--output", "-o", help="Folder for the results and proposed edits of batch jobs (default: <job file>.results)"),
+    apply: bool = typer.Option(False, "--apply", help="Apply the edits of batch jobs to the files instead of only writing them to the results"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="Neither look up nor store responses in the response cache"),
+    refresh: bool = typer.Option(False, "--refresh", help="Query the LLM even if a response is cached, and cache the new response")
 ):
     """
     Start an interactive shell or send a one-time message to the LLM about pinned files.
@@ -175,10 +323,27 @@ def sh(
     In the interactive mode, you can use pinboard commands (add, rm, cp, llm, ls) directly.
     The AI assistant can make changes to your files based on your requests.
 
+    With --batch, every line of a JSONL file is a job like {"id": "docs", "message": "...", "files": ["src/"]},
+    where 'id' and 'files' (the pinned files or folders to send) are optional. Jobs run concurrently, and each
+    one's response and proposed edits are written to the output folder as <id>.json and <id>.diff. Files
+    are only changed with --apply, in job order, skipping jobs whose edits conflict with an earlier one.
+
     Args:
         message: The message to send to the LLM (optional, for one-time processing)
         with_clipboard: Include the current clipboard content in the chat context
+        stream: Render the response live as it is generated
+        apply_early: When streaming, stage each edited file as soon as its edit has been received
+        batch: Path of a JSONL job file to run instead of a single message
     """
+    from .utils import get_clipboard_content
+    from .watch import sync_pinned_state
+    set_cache_override(no_cache, refresh)
+    if batch is not None:
+        if message is not None:
+            print_error("Please provide either a message or a job file with --batch, not both.")
+            raise typer.Exit(code=1)
+        run_batch_file(batch, output, concurrency, apply, with_clipboard)
+        return
     clipboard_content = get_clipboard_content() if with_clipboard else None
     chat_history = []
     if message is None:
@@ -191,24 +356,83 @@ def sh(
             if message.lower() == 'exit':
                 break
             
-            if message.split()[0] in ["add", "rm", "cp", "llm", "ls", "undo"]:
+            # Only files that changed since the last turn are listed and read again
+            sync_pinned_state()
+            if message.split()[0] in ["add", "rm", "cp", "llm", "budget", "limit", "cache", "ls", "undo", "redo", "history", "stats"]:
                 execute_pin_command(message)
             else:
-                response = process_chat_message(message, clipboard_content, chat_history, interactive=True, verbose=verbose)
-                chat_history.append({"role": "user", "content": message})
-                chat_history.append({"role": "assistant", "content": response})
+                response = process_chat_message(message, clipboard_content, chat_history, interactive=True, verbose=verbose, stream=stream, apply_early=apply_early)
+                # A turn that could not be answered is left out of the conversation
+                if response is not None:
+                    chat_history.append({"role": "user", "content": message})
+                    chat_history.append({"role": "assistant", "content": response})
             
             print()
-    else:
-        process_chat_message(message, clipboard_content, chat_history, interactive=False, verbose=verbose)
-
-def process_chat_message(message: str, clipboard_content: str = None, chat_history: List[Dict[str, str]] = None, interactive: bool = False, verbose: bool = False):
-    if not interactive:
-        print_info("Querying language model for a response...")
-    response, _ = llm_chat(message, clipboard_content, chat_history)
+            # Every turn is recorded as a run of its own
+            flush_trace()
+    elif process_chat_message(message, clipboard_content, chat_history, interactive=False, verbose=verbose, stream=stream, apply_early=apply_early) is None:
+        raise typer.Exit(code=1)
+
+def run_batch_file(jobs_file: str, output: Optional[str], concurrency: int, apply: bool, with_clipboard: bool):
+    from .batch import load_jobs, run_batch
+    from .utils import get_clipboard_content
+    try:
+        jobs = load_jobs(jobs_file)
+    except (OSError, ValueError) as e:
+        print_error(f"Could not read the job file: {e}")
+        raise typer.Exit(code=1)
+    if not jobs:
+        print_info("The job file contains no jobs.")
+        return
+    if concurrency < 1:
+        print_error("The concurrency has to be at least 1.")
+        raise typer.Exit(code=1)
+
+    output_dir = output or f"{os.path.splitext(jobs_file)[0]}.results"
+    run_batch(jobs, output_dir, concurrency, apply, get_clipboard_content() if with_clipboard else None)
+
+    table = Table(title="Batch Jobs", box=box.ROUNDED)
+    table.add_column("Job", style="cyan")
+    table.add_column("Status")
+    table.add_column("Changes", justify="right")
+    table.add_column("Tokens", justify="right")
+    table.add_column("Time", justify="right")
+    status_styles = {"failed": "red", "conflict": "yellow", "applied": "green", "edited": "green"}
+    for job in jobs:
+        style = status_styles.get(job.status)
+        status = f"[{style}]{job.status}[/{style}]" if style else job.status
+        changes = len(job.applier.edited_files) if job.applier is not None else 0
+        tokens = f"{job.usage.get('input_tokens') or 0} in, {job.usage.get('output_tokens') or 0} out"
+        retries = f" ({job.retries} {'retry' if job.retries == 1 else 'retries'})" if job.retries else ""
+        cached = " (cached)" if job.cached else ""
+        table.add_row(job.id, status + retries + cached, str(changes), tokens, format_duration(job.duration))
+    print(table)
+    for job in jobs:
+        if job.error:
+            print_error(f"Job {job.id} failed: {job.error}")
+    print_info(f"Results written to {output_dir}")
+    if any(job.status in ("failed", "conflict") for job in jobs):
+        raise typer.Exit(code=1)
+
+def process_chat_message(message: str, clipboard_content: str = None, chat_history: List[Dict[str, str]] = None, interactive: bool = False, verbose: bool = False,
+                         stream: bool = False, apply_early: bool = False):
+    """Send a message to the LLM and show its response. Returns None if the LLM could not be reached."""
+    from .llm import chat as llm_chat, LLMUnavailableError
+    try:
+        if stream:
+            with ResponseStream() as response_stream:
+                response, _ = llm_chat(message, clipboard_content, chat_history, on_text=response_stream, apply_early=apply_early)
+            return response
+
+        if not interactive:
+            print_info("Querying language model for a response...")
+        response, _ = llm_chat(message, clipboard_content, chat_history)
+    except LLMUnavailableError as e:
+        print_error(str(e))
+        return None
     
     if "<artifact" not in response or verbose:
-        response = re.sub(r'<artifactEdit[^>]*>.*?</artifactEdit>', "...", response, flags=re.DOTALL)
+        response = collapse_artifact_edits(response)
         print(Panel(response, title="Response", title_align="left", expand=False, border_style="green"))
         
     return response
@@ -218,7 +442,14 @@ def succeed(
     command: str = typer.Argument(..., help="Shell command to execute (supports composite commands)"),
     tail: int = typer.Option(20, "--tail", "-t", help="Number of lines to capture from command output"),
     verbose: bool = typer.Option(False, "--verbose", "-v", help="Show full response from the language model"),
-    max_tries: int = typer.Option(None, "--max-tries", "-m", help="Maximum number of edit attempts before giving up")
+    max_tries: int = typer.Option(None, "--max-tries", "-m", help="Maximum number of edit attempts before giving up"),
+    stream: bool = typer.Option(False, "--stream", "-s", help="Stream the response from the language model as it is generated"),
+    tee: bool = typer.Option(False, "--tee", help="Show the command output live while it runs"),
+    timeout: float = typer.Option(None, "--timeout", help="Terminate the command after this many seconds"),
+    idle_timeout: float = typer.Option(None, "--idle-timeout", help="Terminate the command after this many seconds without output"),
+    parallel: int = typer.Option(1, "--parallel", "-p", help="Number of candidate fixes to request and test concurrently in isolated copies of the working directory"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="Neither look up nor store responses in the response cache"),
+    refresh: bool = typer.Option(False, "--refresh", help="Query the LLM even if a response is cached, and cache the new response")
 ):
     """
     Execute a shell command and use the LLM to fix any errors until the command succeeds.
@@ -234,93 +465,252 @@ def succeed(
         tail: Number of lines to capture from command output (default: 20).
         verbose: Show full response from the language model.
         max_tries: Maximum number of edit attempts before giving up (default: None, meaning unlimited).
+        stream: Render each response live and stage its edits as soon as they have been received.
+        tee: Show the command output live while it runs.
+        timeout: Terminate the command and its child processes after this many seconds.
+        idle_timeout: Terminate the command and its child processes after this many seconds without output.
+        parallel: Request this many candidate fixes at once and run the command against each of them in an
+            isolated copy of the tracked and pinned files of the working directory. The first candidate that
+            passes is applied to the real files. If none passes, no candidate is applied and the run stops.
     """
-    print_info(f"Executing command: {command}")
-    exit_code, output = run_command(command, tail)
-    iteration = 1
+    from .llm import LLMUnavailableError, SucceedConversation, succeed_chat
 
-    while exit_code != 0:
-        if max_tries is not None and iteration > max_tries:
-            print_error(f"Reached maximum number of tries ({max_tries}). Aborting.")
-            break
+    set_cache_override(no_cache, refresh)
+    conversation = SucceedConversation(command)
 
-        print_error(f"Command failed with exit code {exit_code}. Iteration {iteration}.")
-        if output.strip():
-            print(Panel(output, title=f"Last {tail} lines of output", title_align="left", expand=False, border_style="yellow"))
+    def execute() -> CommandResult:
+        print_info(f"Executing command: {command}")
+        return run_command(command, tail, tee=tee, timeout=timeout, idle_timeout=idle_timeout)
+
+    def speculate(output: str) -> Optional[CommandResult]:
+        from .llm import succeed_candidates
+        from .speculate import create_workspace, get_workspace_files, is_within, remove_workspace, run_candidates
+
+        root = os.getcwd()
+        candidates = []
+        for response, applier in succeed_candidates(conversation, output, parallel):
+            outside = [file_path for file_path in applier.edited_files if not is_within(file_path, root)]
+            if outside:
+                print_info(f"Skipping a candidate that edits files outside of the working directory: {', '.join(outside)}")
+            else:
+                candidates.append((response, applier))
+        if not candidates:
+            print_error("The language model couldn't make any changes. Aborting.")
+            return None
+
+        print_info(f"Executing command against {len(candidates)} candidate fixes: {command}")
+        files = get_workspace_files(root)
+        workspaces = []
+        try:
+            for _, applier in candidates:
+                workspaces.append(create_workspace(root, files, applier.updated_contents))
+            winner, results = run_candidates(command, workspaces, tail, timeout=timeout, idle_timeout=idle_timeout)
+        finally:
+            for workspace in workspaces:
+                remove_workspace(workspace)
+
+        if winner is None:
+            # Failed candidates are discarded, so the files keep the last state that was actually run
+            print_error(f"None of the {len(candidates)} candidate fixes passed, no files were changed. Aborting.")
+            return None
+        print_info(f"Candidate {winner + 1} of {len(candidates)} passed.")
+        response, applier = candidates[winner]
+        applier.promote()
+        conversation.record(response, applier.edited_files)
+        # Paths in the output should point at the real files
+        return results[winner]._replace(output=results[winner].output.replace(workspaces[winner], root))
+
+    result = execute()
+    iteration = 1
+
+    # All iterations are recorded as one group so that they can be undone in one go
+    with operation_group():
+        while result.exit_code != 0:
+            if max_tries is not None and iteration > max_tries:
+                print_error(f"Reached maximum number of tries ({max_tries}). Aborting.")
+                break
 
-        response, file_changes = succeed_chat(command, output, verbose=verbose)
+            output = result.output
+            if result.timed_out == "timeout":
+                print_error(f"Command timed out after {timeout:g} seconds. Iteration {iteration}.")
+                output += f"\n[Command was terminated after running for {timeout:g} seconds]\n"
+            elif result.timed_out == "idle":
+                print_error(f"Command produced no output for {idle_timeout:g} seconds. Iteration {iteration}.")
+                output += f"\n[Command was terminated after producing no output for {idle_timeout:g} seconds]\n"
+            else:
+                print_error(f"Command failed with exit code {result.exit_code} after {result.duration:.1f}s. Iteration {iteration}.")
+            if result.output.strip():
+                title = f"Last {tail} lines of output" if result.truncated else "Output"
+                print(Panel(result.output, title=title, subtitle=f"{result.bytes_seen} bytes", subtitle_align="right",
+                            title_align="left", expand=False, border_style="yellow"))
+
+            try:
+                if parallel > 1:
+                    candidate_result = speculate(output)
+                    if candidate_result is None:
+                        break
+                    invalidate_index()
+                    result = candidate_result
+                    iteration += 1
+                    continue
+                elif stream:
+                    with ResponseStream() as response_stream:
+                        response, file_changes = succeed_chat(conversation, output, verbose=verbose, on_text=response_stream, apply_early=True)
+                else:
+                    response, file_changes = succeed_chat(conversation, output, verbose=verbose)
+            except LLMUnavailableError as e:
+                # The edits of earlier iterations are kept, and can still be undone as one group
+                print_error(f"{e}\nAborting.")
+                break
         
-        if not file_changes:
-            print_error("The language model couldn't make any changes. Aborting.")
-            break
+            if not file_changes:
+                print_error("The language model couldn't make any changes. Aborting.")
+                break
 
-        print_info(f"Executing command: {command}")
-        exit_code, output = run_command(command, tail)
-        iteration += 1
+            invalidate_index()
+            result = execute()
+            iteration += 1
 
-    if exit_code == 0:
+    if result.exit_code == 0:
         print_success(f"Command succeeded after {iteration} iterations.")
     else:
         print_error(f"Command failed after {iteration} iterations. Unable to fix the issue.")
 
+def print_restored_files(restored_files):
+    for file_path, action in restored_files:
+        print_file_change(action, file_path)
+
 @app.command()
-def undo():
+def undo(to: Optional[int] = typer.Option(None, "--to", help="Undo every operation made after the operation with this id")):
     """
     Undo the last file changes made by the 'pin sh' or 'pin succeed' commands.
 
     This command reverts the added, updated, or removed files based on the last 'pin sh' or 'pin succeed' operation.
-    It only undoes the most recent changes and cannot perform multiple undos.
-    """
-    last_operation = get_last_operation()
-    succeed_operations = get_succeed_operations()
-
-    if succeed_operations:
-        for operation in reversed(succeed_operations):
-            for file_path, action in operation.get("edited_files", {}).items():
-                print_info(f"Undoing action '{action}' for file: {file_path}")
-                if action == "added":
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        print_file_change("Removed", file_path)
-                    else:
-                        print_error(f"File not found: {file_path}")
-                elif action in ["updated", "removed"]:
-                    previous_content = get_file_version(file_path)
-                    if previous_content is not None:
-                        update_file(file_path, previous_content)
-                        print_file_change("Restored", file_path)
-                    else:
-                        print_error(f"No previous version found for: {file_path}")
-        clear_succeed_operations()
-        print_success("Undo operation for 'pin succeed' completed.")
-    elif last_operation:
-        edited_files = last_operation.get("edited_files", {})
-        if not edited_files:
-            print_info("No files were affected in the last operation.")
-            return
-
-        print_info(f"Files affected in the last operation: {', '.join(edited_files.keys())}")
-
-        for file_path, action in edited_files.items():
-            print_info(f"Undoing action '{action}' for file: {file_path}")
-            if action == "added":
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    print_file_change("Removed", file_path)
-                else:
-                    print_error(f"File not found: {file_path}")
-            elif action in ["updated", "removed"]:
-                previous_content = get_file_version(file_path)
-                if previous_content is not None:
-                    update_file(file_path, previous_content)
-                    print_file_change("Restored", file_path)
-                else:
-                    print_error(f"No previous version found for: {file_path}")
+    All iterations of a 'pin succeed' run are undone together. Repeated undos step further back in the history,
+    and --to reverts the files to their state right after the given operation (see 'pin history').
+    """
+    try:
+        restored_files = undo_operations(to)
+    except ValueError as e:
+        print_error(str(e))
+        return
 
-        clear_last_operation()
-        print_success("Undo operation for 'pin sh' completed.")
-    else:
+    if not restored_files:
         print_error("No previous operation to undo.")
+        return
+    print_restored_files(restored_files)
+    print_success("Undo operation completed.")
+
+@app.command()
+def redo():
+    """
+    Redo the file changes of the most recently undone operation.
+    """
+    restored_files = redo_operations()
+    if not restored_files:
+        print_error("No undone operation to redo.")
+        return
+    print_restored_files(restored_files)
+    print_success("Redo operation completed.")
+
+@app.command()
+def history(limit: int = typer.Option(20, "--limit", "-n", help="Number of operations to show")):
+    """
+    List the most recent file operations in the undo history.
+    """
+    operations = list_operations(limit)
+    if not operations:
+        print_info("The undo history is empty.")
+        return
+
+    table = Table(
+        border_style="blue",
+        box=box.ROUNDED,
+        expand=False,
+        show_header=True,
+        header_style="bold"
+    )
+    table.add_column("Id")
+    table.add_column("Command")
+    table.add_column("Time")
+    table.add_column("Files")
+
+    for operation in operations:
+        kind = f"{operation['kind']} (undone)" if operation["undone"] else operation["kind"]
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(operation["created"]))
+        files = "\n".join(f"{action}: {file_path}" for file_path, action in operation["edited_files"].items())
+        table.add_row(str(operation["id"]), kind, created, files)
+
+    console.print(table)
+
+DEFAULT_STATS_RUNS = 50
+
+def format_duration(seconds: float) -> str:
+    return f"{seconds * 1000:.1f} ms" if seconds < 10 else f"{seconds:.1f} s"
+
+@app.command()
+def stats(runs: int = typer.Option(DEFAULT_STATS_RUNS, "--runs", "-n", help="Number of recent profiled runs to summarize")):
+    """
+    Summarize where the time went in recent profiled runs.
+
+    Commands are profiled when run with 'pin --profile' or with the PINBOARD_PROFILE environment variable set.
+    Timings are shown as percentiles per phase, and per model for LLM requests.
+    """
+    spans = load_spans(runs)
+    if not spans:
+        print_info(f"No profiled runs yet. Run commands with 'pin --profile' or set {PROFILE_ENV}=1 to record them.")
+        return
+
+    table = Table(
+        border_style="blue",
+        box=box.ROUNDED,
+        expand=False,
+        show_header=True,
+        header_style="bold",
+        title=f"{len({s['run'] for s in spans})} run(s)"
+    )
+    for column in ("Phase", "Model", "Count", "p50", "p90", "p99", "Max", "Mean size"):
+        table.add_column(column, justify="left" if column in ("Phase", "Model", "Mean size") else "right")
+
+    for row in summarize(spans):
+        sizes = []
+        if "bytes" in row:
+            sizes.append(f"{row['bytes']:.0f} bytes")
+        if "input_tokens" in row:
+            sizes.append(f"{row['input_tokens']:.0f} in / {row.get('cache_read_input_tokens', 0):.0f} cached / {row.get('output_tokens', 0):.0f} out tokens")
+        if "time_to_first_token" in row:
+            sizes.append(f"first token after {format_duration(row['time_to_first_token'])}")
+        table.add_row(row["span"], row["model"] or "", str(row["count"]),
+                      *(format_duration(row[key]) for key in ("p50", "p90", "p99", "max")), "\n".join(sizes))
+
+    console.print(table)
+
+@app.command()
+def daemon(stop: bool = typer.Option(False, "--stop", help="Stop the running daemon")):
+    """
+    Run a background daemon that keeps pinboard state warm between commands.
+
+    While the daemon is running, other pin commands are executed by it over a local Unix socket,
+    reusing its file index, cached file contents and LLM connection. The interactive shell and
+    'pin succeed' always run in-process. Without a running daemon, all commands run in-process.
+    A command sent while the daemon is busy with another one also runs in-process, and a command
+    whose client exits is aborted before it applies any edits.
+    """
+    from .daemon import serve, stop as stop_daemon, SOCKET_FILE
+    if stop:
+        if stop_daemon():
+            print_success("Daemon stopped.")
+        else:
+            print_info("No daemon is running.")
+        return
+
+    print_info(f"Daemon listening on {SOCKET_FILE}. Press Ctrl+C to stop.")
+    try:
+        serve()
+    except RuntimeError as e:
+        print_error(str(e))
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
@@ -1,46 +1,53 @@
-import pyclip
 import os
-from .pin import get_pinned_items, get_unique_files
-from .file import get_all_files_in_directory, is_valid_file
-from .term import get_term_content
+from .pin import (get_pinned_items, get_unique_files, get_directory_files, get_outline_files, get_pinned_folder,
+                  get_symbol_files, is_outline_item)
+from .outline import render_pinned_file, save_outlines
+from .symbols import is_symbol_item
+from .gather import read_files, capture_terms
 
 def copy_pinboard():
+    import pyclip
     pinned_items = get_pinned_items()
     unique_files = get_unique_files(pinned_items)
+    symbol_files = get_symbol_files(pinned_items)
+    outline_files = get_outline_files(pinned_items)
     content = ["Table of contents"]
 
     for item in pinned_items:
         if item.endswith("@tmux"):
             content.append(f"- {item[:-5]} (Tmux Session)")
-        elif os.path.isfile(item) and is_valid_file(item):
+        elif is_symbol_item(item):
+            content.append(f"- {os.path.relpath(item)} (Symbol)")
+        elif item in unique_files:
             content.append(f"- {os.path.relpath(item)}")
-        elif os.path.isdir(item):
-            content.append(f"- {os.path.relpath(item)}/ (Directory)")
-            dir_files = get_all_files_in_directory(item)
+        elif get_pinned_folder(item) is not None:
+            folder = get_pinned_folder(item)
+            content.append(f"- {os.path.relpath(folder)}/ ({'Outline' if is_outline_item(item) else 'Directory'})")
+            dir_files = get_directory_files(folder)
             for file in dir_files:
                 content.append(f"  - {os.path.relpath(file)}")
 
     content.append("")
 
-    for file in sorted(unique_files):
+    def read(file_path: str) -> str:
+        return render_pinned_file(file_path, symbol_files, outline_files, numbered=False)
+
+    for file, file_content in read_files(sorted(unique_files), read=read):
         content.append(f"# {os.path.basename(file)}")
         content.append(file)
         content.append("```")
-        try:
-            with open(file, "r") as f:
-                content.append(f.read())
-        except Exception as e:
-            content.append(f"Error reading file: {str(e)}")
+        content.append(file_content)
         content.append("```")
         content.append("")
 
-    for item in pinned_items:
-        if item.endswith("@tmux"):
-            session_name = item[:-5]
-            content.append(f"# Tmux Session: {session_name}")
-            content.append("```")
-            content.append(get_term_content(session_name))
-            content.append("```")
-            content.append("")
+    save_outlines()
+
+    session_names = [item[:-5] for item in pinned_items if item.endswith("@tmux")]
+    for session_name, term_content in capture_terms(session_names):
+        content.append(f"# Tmux Session: {session_name}")
+        content.append("```")
+        content.append(term_content)
+        content.append("```")
+        content.append("")
 
     pyclip.copy("\n".join(content))
\ No newline at end of file
@@ -1,28 +1,65 @@
-import shelve
+import json
 import os
+import shelve
+import sqlite3
 from platformdirs import user_config_dir
-from typing import Dict, Any, Optional, List
+from typing import Any, Optional
 
 CONFIG_DIR = user_config_dir("pinboard")
 CONFIG_FILE = f"{CONFIG_DIR}/config"
+STATE_FILE = f"{CONFIG_DIR}/state.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_connection: Optional[sqlite3.Connection] = None
 
 def ensure_config_dir():
     os.makedirs(CONFIG_DIR, exist_ok=True)
 
-def get_config():
-    ensure_config_dir()
+def get_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        ensure_config_dir()
+        is_new = not os.path.exists(STATE_FILE)
+        # Daemon commands run one at a time, but each in the thread of its connection
+        _connection = sqlite3.connect(STATE_FILE, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.executescript(SCHEMA)
+        if is_new:
+            migrate_shelve_config(_connection)
+        init_config(_connection)
+    return _connection
+
+def migrate_shelve_config(connection: sqlite3.Connection):
+    # Carry the model settings over from the shelve store used by earlier versions,
+    # undo history is not migrated
     try:
-        with shelve.open(CONFIG_FILE) as config:
-            return dict(config)
+        with shelve.open(CONFIG_FILE, flag="r") as config:
+            settings = {key: config[key] for key in ("llm_provider", "llm_model") if key in config}
+    except Exception:
+        return
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                               [(key, json.dumps(value)) for key, value in settings.items()])
+
+def get_setting(key: str, default: Any = None) -> Any:
+    try:
+        row = get_connection().execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
     except Exception as e:
         print(f"Error reading config: {e}")
-        return {}
+        return default
+    return json.loads(row[0]) if row else default
 
 def set_config(key, value):
-    ensure_config_dir()
     try:
-        with shelve.open(CONFIG_FILE, writeback=True) as config:
-            config[key] = value
+        with get_connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value)))
     except Exception as e:
         print(f"Error writing config: {e}")
 
@@ -33,55 +70,14 @@ def set_llm_config(model):
     set_config("llm_model", model.split("/")[1])
 
 def get_llm_config():
-    config = get_config()
     return {
-        "provider": config.get("llm_provider", "anthropic"),
-        "model": config.get("llm_model", "claude-3-5-sonnet-20240620")
+        "provider": get_setting("llm_provider", "anthropic"),
+        "model": get_setting("llm_model", "claude-3-5-sonnet-20240620")
     }
 
-def store_last_operation(operation_data: Dict[str, Any]):
-    set_config("last_operation", operation_data)
-
-def get_last_operation() -> Dict[str, Any]:
-    return get_config().get("last_operation", {})
-
-def clear_last_operation():
-    set_config("last_operation", {})
-
-def store_file_version(file_path: str, content: str):
-    with shelve.open(CONFIG_FILE, writeback=True) as config:
-        if "file_versions" not in config:
-            config["file_versions"] = {}
-        config["file_versions"][file_path] = content
-
-def get_file_version(file_path: str) -> Optional[str]:
-    with shelve.open(CONFIG_FILE) as config:
-        return config.get("file_versions", {}).get(file_path)
-
-def clear_file_versions():
-    with shelve.open(CONFIG_FILE, writeback=True) as config:
-        if "file_versions" in config:
-            del config["file_versions"]
-            
-def init_config():
-    if not get_config():
-        set_config("llm_provider", "anthropic")
-        set_config("llm_model", "claude-3-5-sonnet-20240620")
-
-def store_succeed_operation(operation_data: Dict[str, Any]):
-    with shelve.open(CONFIG_FILE, writeback=True) as config:
-        if "succeed_operations" not in config:
-            config["succeed_operations"] = []
-        config["succeed_operations"].append(operation_data)
-
-def get_succeed_operations() -> List[Dict[str, Any]]:
-    with shelve.open(CONFIG_FILE) as config:
-        return config.get("succeed_operations", [])
-
-def clear_succeed_operations():
-    with shelve.open(CONFIG_FILE, writeback=True) as config:
-        if "succeed_operations" in config:
-            del config["succeed_operations"]
+def init_config(connection: sqlite3.Connection):
+    with connection:
+        connection.executemany("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)",
+                               [("llm_provider", json.dumps("anthropic")),
+                                ("llm_model", json.dumps("claude-3-5-sonnet-20240620"))])
 
-# Initialize config on import
-init_config()
\ No newline at end of file
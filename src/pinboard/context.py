@@ -0,0 +1,253 @@
+import math
+import os
+import re
+import sqlite3
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from .config import get_setting
+from .pin import DATA_DIR, ensure_data_dir
+
+CONTEXT_CACHE_FILE = os.path.join(DATA_DIR, "context.db")
+
+# Default token budget for pinned file contents, leaving room in a 200k context
+# window for the system prompt, chat history, term output and the response
+DEFAULT_CONTEXT_BUDGET = 150_000
+# Largest follow-up turn of a 'pin succeed' run before the whole workspace is sent again
+DEFAULT_DELTA_BUDGET = 20_000
+# Largest whole conversation of a 'pin succeed' run, leaving room for the system prompt and the response
+DEFAULT_CONVERSATION_BUDGET = 180_000
+# Code tokenizes denser than prose, so err on the side of overestimating
+CHARS_PER_TOKEN = 3.5
+# Matches in a file path count this many times more than matches in its content
+PATH_WEIGHT = 5
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Stay below the number of parameters a statement may have on older SQLite versions
+MAX_QUERY_FILES = 500
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9]+")
+SUBWORD_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+# Per file, its token estimate, and once it was ranked, the number of terms in it and
+# how often each term occurs, as a line of the term and its count each. Only files that
+# changed are written.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    length INTEGER,
+    terms TEXT
+);
+"""
+
+_connection: Optional[sqlite3.Connection] = None
+# The rows of the files table by path, without their terms: mtime, size, tokens and length,
+# which is None until the file was ranked
+_files: Optional[Dict[str, Tuple[int, int, int, Optional[int]]]] = None
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase identifiers and their camelCase and snake_case parts."""
+    terms = []
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        terms.append(identifier.lower())
+        parts = SUBWORD_PATTERN.findall(identifier)
+        if len(parts) > 1:
+            terms.extend(part.lower() for part in parts)
+    return terms
+
+def get_context_connection() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        ensure_data_dir()
+        # Daemon commands run one at a time, but each in the thread of its connection
+        _connection = sqlite3.connect(CONTEXT_CACHE_FILE, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.executescript(SCHEMA)
+    return _connection
+
+def get_file_rows() -> Dict[str, Tuple[int, int, int, Optional[int]]]:
+    """Load the files table once per process, rather than querying it for every file."""
+    global _files
+    if _files is None:
+        _files = {path: (mtime, size, tokens, length) for path, mtime, size, tokens, length
+                  in get_context_connection().execute("SELECT path, mtime, size, tokens, length FROM files")}
+    return _files
+
+def save_cache():
+    """Commit the stats of the files indexed since the last call."""
+    if _connection is not None and _connection.in_transaction:
+        _connection.commit()
+
+def prune_cache(pinned_files: Iterable[str]):
+    """Drop the stats of the files that are no longer pinned."""
+    rows = get_file_rows()
+    unpinned = set(rows) - set(pinned_files)
+    if unpinned:
+        get_context_connection().executemany("DELETE FROM files WHERE path = ?", ((file_path,) for file_path in unpinned))
+        for file_path in unpinned:
+            del rows[file_path]
+        save_cache()
+
+def index_file(file_path: str, stat: os.stat_result, rank: bool) -> Optional[Tuple[int, Optional[int], Counter]]:
+    """
+    Read a file and store its token estimate, and with rank, its terms too. Returns the
+    tokens, length and term counts, or None if the file cannot be read.
+    """
+    try:
+        with open(file_path, 'r', errors='replace') as f:
+            content = f.read()
+    except OSError:
+        return None
+    lines = content.count("\n") + 1
+    # Account for the "N: " prefixes added when numbering the lines
+    tokens = math.ceil((len(content) + lines * (len(str(lines)) + 2)) / CHARS_PER_TOKEN)
+    counts: Counter = Counter(tokenize(content)) if rank else Counter()
+    length = sum(counts.values()) if rank else None
+    stored = "".join(f"\n{term} {count}" for term, count in counts.items()) if rank else None
+
+    get_context_connection().execute("INSERT OR REPLACE INTO files (path, mtime, size, tokens, length, terms) VALUES (?, ?, ?, ?, ?, ?)",
+                                     (file_path, stat.st_mtime_ns, stat.st_size, tokens, length, stored))
+    get_file_rows()[file_path] = (stat.st_mtime_ns, stat.st_size, tokens, length)
+    return tokens, length, counts
+
+def get_file_row(file_path: str, rank: bool = False) -> Tuple[Optional[os.stat_result], Optional[Tuple[int, int, int, Optional[int]]]]:
+    """Return the stat of a file and its row, if that is still current and, with rank, has its terms."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None, None
+    row = get_file_rows().get(file_path)
+    if row is None or row[0] != stat.st_mtime_ns or row[1] != stat.st_size or (rank and row[3] is None):
+        return stat, None
+    return stat, row
+
+def get_file_tokens(file_path: str) -> int:
+    """Return the estimated token count of a file, without indexing its terms."""
+    stat, row = get_file_row(file_path)
+    if row is not None:
+        return row[2]
+    indexed = index_file(file_path, stat, rank=False) if stat is not None else None
+    return indexed[0] if indexed is not None else 0
+
+def get_files_stats(files: Iterable[str], terms: Iterable[str] = ()) -> Dict[str, Dict[str, Any]]:
+    """
+    Return the estimated token count and number of terms of every file, and how often
+    each of the given terms occurs in it. Files are indexed again only when their mtime
+    or size changes, and the terms of the others are read in a few queries.
+    """
+    terms = sorted(set(terms))
+    stats: Dict[str, Dict[str, Any]] = {}
+    current = []
+    for file_path in files:
+        stat, row = get_file_row(file_path, rank=True)
+        if row is not None:
+            stats[file_path] = {"tokens": row[2], "length": row[3], "terms": {}}
+            current.append(file_path)
+            continue
+        indexed = index_file(file_path, stat, rank=True) if stat is not None else None
+        if indexed is not None:
+            tokens, length, counts = indexed
+            stats[file_path] = {"tokens": tokens, "length": length, "terms": {term: counts[term] for term in terms if term in counts}}
+        else:
+            stats[file_path] = {"tokens": 0, "length": 0, "terms": {}}
+    if not terms:
+        return stats
+
+    # Picks out only the query terms, rather than parsing all terms of a file. Starting
+    # with a newline, the pattern is only tried at the start of each line.
+    pattern = re.compile(f"\n({'|'.join(map(re.escape, terms))}) ([0-9]+)")
+    connection = get_context_connection()
+    rows = get_file_rows()
+    for start in range(0, len(current), MAX_QUERY_FILES):
+        chunk = current[start:start + MAX_QUERY_FILES]
+        for file_path, mtime, size, stored in connection.execute(
+                f"SELECT path, mtime, size, terms FROM files WHERE path IN ({', '.join('?' * len(chunk))})", chunk):
+            # Skips rows that another process wrote for a different version of the file
+            if stored is not None and (mtime, size) == rows[file_path][:2]:
+                stats[file_path]["terms"] = {term: int(count) for term, count in pattern.findall(stored)}
+    return stats
+
+def get_file_stats(file_path: str, terms: Iterable[str] = ()) -> Dict[str, Any]:
+    return get_files_stats([file_path], terms)[file_path]
+
+def rank_files(files: Iterable[str], query: str) -> Dict[str, float]:
+    """Score files against a query with BM25 over the identifiers in their content and path."""
+    query_terms = set(tokenize(query))
+    documents = {}
+    for file_path, stats in get_files_stats(files, query_terms).items():
+        path_terms = Counter(tokenize(file_path))
+        documents[file_path] = ({term: stats["terms"].get(term, 0) + PATH_WEIGHT * path_terms.get(term, 0) for term in query_terms},
+                                stats["length"] + PATH_WEIGHT * sum(path_terms.values()))
+
+    if not documents or not query_terms:
+        return {file_path: 0.0 for file_path in documents}
+
+    average_length = sum(length for _, length in documents.values()) / len(documents) or 1
+    document_frequency = Counter(term for frequencies, _ in documents.values() for term, count in frequencies.items() if count)
+    idf = {term: math.log(1 + (len(documents) - frequency + 0.5) / (frequency + 0.5))
+           for term, frequency in document_frequency.items()}
+
+    scores = {}
+    for file_path, (frequencies, length) in documents.items():
+        score = 0.0
+        for term, count in frequencies.items():
+            if count:
+                score += idf[term] * count * (BM25_K1 + 1) / (count + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+        scores[file_path] = score
+    return scores
+
+def get_context_budget() -> int:
+    return get_setting("context_budget", DEFAULT_CONTEXT_BUDGET)
+
+def get_delta_budget() -> int:
+    return get_setting("succeed_delta_budget", DEFAULT_DELTA_BUDGET)
+
+def get_conversation_budget() -> int:
+    return get_setting("succeed_conversation_budget", DEFAULT_CONVERSATION_BUDGET)
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def pack_files(files: Iterable[str], explicit_files: Set[str], query: str, budget: Optional[int] = None,
+               tokens: Optional[Dict[str, int]] = None) -> Tuple[List[str], List[str]]:
+    """
+    Select the files that fit into the token budget for the prompt.
+
+    Explicitly pinned files take priority over files that were only pinned as part of
+    a directory, and within each group files are picked by relevance to the query.
+    A budget of 0 disables packing. Returns the kept files sorted by path, followed
+    by the dropped files in order of relevance. Token counts of files that are only
+    partially rendered can be given in tokens.
+    """
+    files = sorted(set(files))
+    tokens = tokens or {}
+
+    def count_tokens(file_path: str) -> int:
+        return tokens[file_path] if file_path in tokens else get_file_tokens(file_path)
+
+    budget = get_context_budget() if budget is None else budget
+    if budget <= 0:
+        return files, []
+
+    if sum(count_tokens(file_path) for file_path in files) <= budget:
+        save_cache()
+        return files, []
+
+    scores = rank_files(files, query)
+    ordered = sorted(files, key=lambda file_path: (file_path not in explicit_files, -scores[file_path], file_path))
+
+    kept, dropped = [], []
+    remaining = budget
+    for file_path in ordered:
+        file_tokens = count_tokens(file_path)
+        if file_tokens <= remaining:
+            kept.append(file_path)
+            remaining -= file_tokens
+        else:
+            dropped.append(file_path)
+
+    save_cache()
+    return sorted(kept), dropped
@@ -0,0 +1,255 @@
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Any, Dict, List, Optional
+from .pin import DATA_DIR, ensure_data_dir
+
+SOCKET_FILE = os.path.join(DATA_DIR, "daemon.sock")
+
+# Commands that are executed by a running daemon. The interactive shell, 'pin succeed'
+# (which runs the user's command for a long time) and the daemon itself always run in-process.
+FORWARDED_COMMANDS = {"add", "rm", "cp", "llm", "budget", "limit", "cache", "ls", "sh", "undo", "redo", "history", "stats"}
+# Options of the pin command itself, which come before the subcommand
+GLOBAL_OPTIONS = {"--profile"}
+# Seconds between checks whether the daemon was asked to stop
+ACCEPT_INTERVAL = 0.5
+
+# Held while a command runs. Commands change the working directory, environment and
+# output streams of the process, so a client that finds the daemon busy runs in-process.
+_busy = threading.Lock()
+
+def main():
+    """Entry point of the pin command, forwarding to a running daemon when possible."""
+    exit_code = forward(sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+
+    from .cli import app
+    app()
+
+def is_forwardable(args: List[str]) -> bool:
+    while args and args[0] in GLOBAL_OPTIONS:
+        args = args[1:]
+    if not args or args[0] not in FORWARDED_COMMANDS:
+        return False
+    if any(arg in ("--help", "--install-completion", "--show-completion") for arg in args):
+        return False
+    # Without a message 'pin sh' starts the interactive shell
+    return args[0] != "sh" or any(not arg.startswith("-") for arg in args[1:])
+
+def connect() -> Optional[socket.socket]:
+    if not os.path.exists(SOCKET_FILE):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(SOCKET_FILE)
+    except OSError:
+        client.close()
+        return None
+    return client
+
+def forward(args: List[str]) -> Optional[int]:
+    """
+    Run a command on the daemon and relay its output. Returns the exit code, or
+    None if the command has to run in-process because no daemon is running.
+    """
+    if not is_forwardable(args):
+        return None
+    client = connect()
+    if client is None:
+        return None
+
+    try:
+        size = os.get_terminal_size(sys.stdout.fileno()) if sys.stdout.isatty() else None
+    except OSError:
+        size = None
+    request = {
+        "args": args,
+        "cwd": os.getcwd(),
+        "env": dict(os.environ),
+        "tty": sys.stdout.isatty(),
+        "width": size.columns if size else None,
+    }
+
+    with client, client.makefile("rb") as responses:
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        for line in responses:
+            response = json.loads(line)
+            if "out" in response:
+                sys.stdout.write(response["out"])
+                sys.stdout.flush()
+            elif response.get("busy"):
+                return None
+            elif "exit" in response:
+                return response["exit"]
+    # The daemon went away in the middle of the command
+    return 1
+
+class ClientDisconnected(Exception):
+    """Raised when output is written for a client that went away, which aborts its command."""
+
+class SocketWriter:
+    """
+    A text stream that relays everything written to it to a connected client. Once the
+    client went away, every write raises ClientDisconnected, so that its command stops
+    before it applies any edits, which are reported as they are staged.
+    """
+
+    def __init__(self, connection: socket.socket, tty: bool):
+        self.connection = connection
+        self.tty = tty
+        self.closed = False
+
+    def write(self, text: str) -> int:
+        if text:
+            self.send({"out": text})
+        return len(text)
+
+    def send(self, message: Dict[str, Any]):
+        if self.closed:
+            raise ClientDisconnected()
+        try:
+            self.connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        except OSError:
+            self.closed = True
+            raise ClientDisconnected()
+
+    def flush(self):
+        pass
+
+    def isatty(self) -> bool:
+        return self.tty
+
+    def fileno(self) -> int:
+        raise io.UnsupportedOperation("SocketWriter has no file descriptor")
+
+def serve():
+    """
+    Serve pin commands over a Unix domain socket until interrupted.
+
+    The process keeps the pinned file index, numbered file contents and the LLM
+    client with its connection pool warm between commands. Every connection is handled
+    in its own thread, and commands are executed one at a time, in the working directory
+    and environment of the calling client. Clients that connect while a command runs
+    are told that the daemon is busy and run their command in-process.
+    """
+    ensure_data_dir()
+    if connect() is not None:
+        raise RuntimeError(f"A pin daemon is already listening on {SOCKET_FILE}.")
+    if os.path.exists(SOCKET_FILE):
+        os.remove(SOCKET_FILE)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # The socket carries the client environment, including API keys
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(SOCKET_FILE)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    server.settimeout(ACCEPT_INTERVAL)
+
+    stopping = threading.Event()
+    try:
+        while not stopping.is_set():
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                continue
+            threading.Thread(target=serve_connection, args=(connection, stopping), daemon=True).start()
+    finally:
+        server.close()
+        if os.path.exists(SOCKET_FILE):
+            os.remove(SOCKET_FILE)
+        # Let a running command finish, instead of exiting in the middle of applying its edits
+        with _busy:
+            pass
+
+def serve_connection(connection: socket.socket, stopping: threading.Event):
+    with connection:
+        try:
+            if handle(connection):
+                stopping.set()
+        except ClientDisconnected:
+            pass
+        except Exception:
+            traceback.print_exc()
+
+def stop() -> bool:
+    """Ask a running daemon to shut down. Returns False if no daemon is running."""
+    client = connect()
+    if client is None:
+        return False
+    with client, client.makefile("rb") as responses:
+        client.sendall(json.dumps({"stop": True}).encode("utf-8") + b"\n")
+        responses.readline()
+    return True
+
+def handle(connection: socket.socket) -> bool:
+    """Execute one client request. Returns True if the daemon was asked to stop."""
+    with connection.makefile("rb") as requests:
+        line = requests.readline()
+    if not line:
+        return False
+    request = json.loads(line)
+    writer = SocketWriter(connection, request.get("tty", False))
+    if request.get("stop"):
+        writer.send({"exit": 0})
+        return True
+    if not _busy.acquire(blocking=False):
+        writer.send({"busy": True})
+        return False
+    try:
+        run_command(request, writer)
+    finally:
+        _busy.release()
+    return False
+
+def run_command(request: Dict[str, Any], writer: SocketWriter):
+    import click
+    import rich
+    from .cli import app
+    from .watch import sync_pinned_state
+    from .trace import flush, set_profiling
+
+    cwd = os.getcwd()
+    environ = dict(os.environ)
+    exit_code = 0
+    try:
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        rich.reconfigure(file=writer, width=request["width"], force_terminal=request["tty"])
+        # Files may have changed since the last command
+        sync_pinned_state()
+        with redirect_stdout(writer), redirect_stderr(writer):
+            app(args=request["args"], prog_name="pin", standalone_mode=False)
+    except click.exceptions.Exit as e:
+        exit_code = e.exit_code
+    except click.ClickException as e:
+        e.show(file=writer)
+        exit_code = e.exit_code
+    except click.Abort:
+        exit_code = 1
+    except ClientDisconnected:
+        # Edits staged for the client were discarded on the way out
+        return
+    except Exception:
+        writer.write(traceback.format_exc())
+        exit_code = 1
+    finally:
+        flush()
+        set_profiling(False)
+        rich.reconfigure()
+        os.environ.clear()
+        os.environ.update(environ)
+        os.chdir(cwd)
+    writer.send({"exit": exit_code})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import difflib
+from typing import List, Optional
+
+# Unchanged lines shown around every changed region
+DIFF_CONTEXT_LINES = 2
+
+def split_lines(content: str) -> List[str]:
+    """
+    Split content on '\\n' only, like apply_edits, so that characters str.splitlines()
+    also breaks on cannot shift line numbers. A trailing newline does not start another line.
+    """
+    lines = content.split("\n")
+    return lines[:-1] if content.endswith("\n") else lines
+
+def render_numbered(file_path: str, content: str) -> str:
+    numbered_content = "".join(f"{i+1}: {line}\n" for i, line in enumerate(split_lines(content)))
+    return f"<artifact identifier=\"{file_path}\">\n{numbered_content}\n</artifact>\n\n"
+
+def render_delta(file_path: str, before: Optional[str], after: Optional[str]) -> str:
+    """
+    Render how a file changed as a numbered diff. Lines that are kept or added carry
+    their current line number, removed lines are marked with '-'. New files, and files
+    whose diff would be longer than their content, are rendered in full instead.
+    """
+    if before == after:
+        return ""
+    if after is None:
+        return f"<artifactRemoved identifier=\"{file_path}\" />\n\n"
+    if before is None:
+        return render_numbered(file_path, after)
+
+    old_lines, new_lines = split_lines(before), split_lines(after)
+    diff: List[str] = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for group in matcher.get_grouped_opcodes(DIFF_CONTEXT_LINES):
+        i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+        diff.append(f"@@ -{i1 + 1},{i2 - i1} +{j1 + 1},{j2 - j1} @@")
+        for tag, a1, a2, b1, b2 in group:
+            if tag == "equal":
+                diff.extend(f" {j + 1}: {new_lines[j]}" for j in range(b1, b2))
+                continue
+            diff.extend(f"-{old_lines[i]}" for i in range(a1, a2))
+            diff.extend(f"+{j + 1}: {new_lines[j]}" for j in range(b1, b2))
+
+    rendered = f"<artifactDiff identifier=\"{file_path}\">\n" + "\n".join(diff) + "\n</artifactDiff>\n\n"
+    full = render_numbered(file_path, after)
+    return full if len(rendered) >= len(full) else rendered
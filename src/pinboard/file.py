@@ -1,36 +1,217 @@
+import codecs
+import json
 import os
-from typing import Set
+import shutil
+import tempfile
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+from platformdirs import user_data_dir
+from .config import get_setting
+from .trace import span
+
+# Same directory as pin.DATA_DIR, which cannot be imported here since pin.py imports this module
+VERDICTS_FILE = os.path.join(user_data_dir("pinboard"), "verdicts.json")
+# Leading block of a file that is checked for binary content
+SNIFF_BYTES = 8192
+DEFAULT_MAX_FILE_BYTES = 8 * 1024 * 1024
+DEFAULT_MAX_TOTAL_BYTES = 64 * 1024 * 1024
+
+# Content verdicts by path, with the mtime and size they were made for
+_verdicts: Optional[Dict[str, List[Any]]] = None
+_verdicts_dirty = False
+
+IGNORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.ico', '.svg',
+                      '.mp3', '.wav', '.ogg', '.mp4', '.avi', '.mov', '.wmv',
+                      '.zip', '.tar', '.gz', '.rar', '.7z',
+                      '.exe', '.dll', '.so', '.dylib',
+                      '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'}
 
 def is_valid_file(file_path: str) -> bool:
-    ignored_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.ico', '.svg',
-                          '.mp3', '.wav', '.ogg', '.mp4', '.avi', '.mov', '.wmv',
-                          '.zip', '.tar', '.gz', '.rar', '.7z',
-                          '.exe', '.dll', '.so', '.dylib',
-                          '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'}
-    
     return (not os.path.basename(file_path).startswith('.') and
-            os.path.splitext(file_path)[1].lower() not in ignored_extensions)
-
-def get_all_files_in_directory(directory: str) -> Set[str]:
-    all_files = set()
-    for root, dirs, files in os.walk(directory):
-        # Ignore hidden directories
-        dirs[:] = [d for d in dirs if not d.startswith('.') and not d.startswith('__')]
-        
-        for file in files:
-            file_path = os.path.abspath(os.path.join(root, file))
-            if is_valid_file(file_path):
-                all_files.add(file_path)
-    return all_files
-
-def update_file(file_path: str, new_content: str):
-    with open(file_path, "w") as f:
-        f.write(new_content)
-
-def add_new_file(file_path: str, content: str):
-    with open(file_path, "w") as f:
-        f.write(content)
+            os.path.splitext(file_path)[1].lower() not in IGNORED_EXTENSIONS)
+
+def is_ignored_directory(name: str) -> bool:
+    # Ignore hidden directories
+    return name.startswith('.') or name.startswith('__')
+
+def get_max_file_bytes() -> int:
+    return get_setting("max_file_bytes", DEFAULT_MAX_FILE_BYTES)
+
+def get_max_total_bytes() -> int:
+    return get_setting("max_total_bytes", DEFAULT_MAX_TOTAL_BYTES)
+
+def format_size(size: int) -> str:
+    if size < 1024:
+        return f"{size} bytes"
+    return f"{size / (1024 * 1024):.1f} MB" if size >= 1024 * 1024 else f"{size / 1024:.1f} KB"
+
+def load_verdicts() -> Dict[str, List[Any]]:
+    global _verdicts
+    if _verdicts is None:
+        try:
+            with open(VERDICTS_FILE, 'r') as f:
+                _verdicts = json.load(f)
+        except (OSError, ValueError):
+            _verdicts = {}
+    return _verdicts
+
+def save_verdicts():
+    global _verdicts_dirty
+    if _verdicts is None or not _verdicts_dirty:
+        return
+    os.makedirs(os.path.dirname(VERDICTS_FILE), exist_ok=True)
+    tmp_file = f"{VERDICTS_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(_verdicts, f)
+    os.replace(tmp_file, VERDICTS_FILE)
+    _verdicts_dirty = False
+
+def sniff_content(file_path: str, size: int) -> Optional[str]:
+    """Check the leading block of a file for NUL bytes and invalid UTF-8."""
+    with open(file_path, 'rb') as f:
+        block = f.read(SNIFF_BYTES)
+    if b"\0" in block:
+        return "binary content"
+    try:
+        # A character may be cut off at the end of the block
+        codecs.getincrementaldecoder("utf-8")().decode(block, final=size <= SNIFF_BYTES)
+    except UnicodeDecodeError:
+        return "not UTF-8 text"
+    return None
+
+def classify_file(file_path: str, max_file_bytes: int = 0, check_name: bool = True) -> Tuple[int, Optional[str]]:
+    """
+    Return the size of a file and the reason it is excluded from the pinboard, or None
+    if it is included. Content is only sniffed once per mtime and size of the file.
+    """
+    global _verdicts_dirty
+    if check_name and not is_valid_file(file_path):
+        return 0, "hidden file" if os.path.basename(file_path).startswith('.') else "ignored file type"
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return 0, "unreadable"
+    if max_file_bytes and stat.st_size > max_file_bytes:
+        return stat.st_size, f"larger than {format_size(max_file_bytes)}"
+
+    verdicts = load_verdicts()
+    verdict = verdicts.get(file_path)
+    if verdict is None or verdict[0] != stat.st_mtime_ns or verdict[1] != stat.st_size:
+        try:
+            reason = sniff_content(file_path, stat.st_size)
+        except OSError:
+            return stat.st_size, "unreadable"
+        verdict = verdicts[file_path] = [stat.st_mtime_ns, stat.st_size, reason]
+        _verdicts_dirty = True
+    return stat.st_size, verdict[2]
+
+def get_file_content_if_exists(file_path: str) -> Optional[str]:
+    if not os.path.isfile(file_path):
+        return None
+    with open(file_path, "r") as f:
+        return f.read()
 
 def remove_file(file_path: str):
     if os.path.exists(file_path):
-        os.remove(file_path)
\ No newline at end of file
+        os.remove(file_path)
+
+def stage_file(file_path: str, content: Union[str, Callable[[BinaryIO], None]]) -> str:
+    """
+    Write content to a synced temporary file next to file_path and return its path.
+    The content can also be a function that writes the file in binary mode.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp")
+    try:
+        with span("file.stage") as s, os.fdopen(fd, "w" if isinstance(content, str) else "wb") as f:
+            if isinstance(content, str):
+                f.write(content)
+            else:
+                content(f)
+            f.flush()
+            os.fsync(f.fileno())
+            s["bytes"] = f.tell()
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temp_path)
+        else:
+            # mkstemp creates files readable only by their owner
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+def sync_directory(directory: str):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class FileTransaction:
+    """
+    Stage new file contents next to their targets and swap them in all at once.
+
+    Every staged file is written and synced before commit() renames any of them into
+    place with os.replace, so each file is either fully old or fully new. If a rename
+    fails, the files that were already replaced are restored to their original content.
+    """
+
+    def __init__(self):
+        # Target path to staged temporary file, or None if the target is to be removed
+        self.staged: Dict[str, Optional[str]] = {}
+
+    def write(self, file_path: str, content: Union[str, Callable[[BinaryIO], None]]):
+        self.unstage(file_path)
+        self.staged[file_path] = stage_file(file_path, content)
+
+    def remove(self, file_path: str):
+        self.unstage(file_path)
+        self.staged[file_path] = None
+
+    def unstage(self, file_path: str):
+        temp_path = self.staged.pop(file_path, None)
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def discard(self):
+        for file_path in list(self.staged):
+            self.unstage(file_path)
+
+    def commit(self, original_contents: Dict[str, Optional[str]]):
+        """
+        Replace all staged files. original_contents holds the content of every target
+        before the transaction, or None if it did not exist, and is used for rollback.
+        """
+        with span("file.commit", files=len(self.staged)):
+            self._commit(original_contents)
+
+    def _commit(self, original_contents: Dict[str, Optional[str]]):
+        replaced = []
+        try:
+            for file_path, temp_path in self.staged.items():
+                if temp_path is None:
+                    remove_file(file_path)
+                else:
+                    os.replace(temp_path, file_path)
+                replaced.append(file_path)
+        except BaseException:
+            for file_path in reversed(replaced):
+                original_content = original_contents.get(file_path)
+                if original_content is None:
+                    remove_file(file_path)
+                else:
+                    os.replace(stage_file(file_path, original_content), file_path)
+            self.discard()
+            raise
+
+        for directory in {os.path.dirname(os.path.abspath(file_path)) for file_path in self.staged}:
+            sync_directory(directory)
+        self.staged = {}
@@ -1,9 +1,17 @@
-from rich.console import Console
+import re
+from rich import get_console
+from rich.live import Live
 from rich.panel import Panel
 from rich import box
 from typing import Optional
 
-console = Console()
+# Share rich's global console, so that output can be redirected with rich.reconfigure()
+console = get_console()
+
+def collapse_artifact_edits(text: str) -> str:
+    text = re.sub(r'<artifactEdit[^>]*>.*?</artifactEdit>', "...", text, flags=re.DOTALL)
+    # Also hide an edit that is still being streamed in
+    return re.sub(r'<artifactEdit.*\Z', "...", text, flags=re.DOTALL)
 
 def print_success(message: str):
     console.print(Panel(message, title="Success", title_align="left", border_style="green", box=box.ROUNDED, expand=False))
@@ -22,5 +30,34 @@ def print_file_change(action: str, file_path: str, from_line: Optional[int] = No
             print_success(f"{action} file: {file_path} (lines {from_line}-{to_line})")
         else:
             print_success(f"{action} file: {file_path}")
-    elif action == "Removed":
-        print_success(f"{action} file: {file_path}")
\ No newline at end of file
+    elif action in ("Removed", "Restored"):
+        print_success(f"{action} file: {file_path}")
+
+def print_token_usage(usage):
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    console.print(f"[dim]Tokens: {usage.input_tokens} uncached input, {cache_read} cache hit, {cache_write} cache write, {usage.output_tokens} output[/dim]")
+
+class ResponseStream:
+    """Render a response live in a panel while its text is being streamed in."""
+
+    def __init__(self, title: str = "Response", border_style: str = "green"):
+        self.title = title
+        self.border_style = border_style
+        self.text = ""
+        self.live = Live(self.render(), console=console, refresh_per_second=8)
+
+    def render(self) -> Panel:
+        return Panel(collapse_artifact_edits(self.text) or "...", title=self.title, title_align="left", expand=False, border_style=self.border_style)
+
+    def __call__(self, text: str):
+        self.text += text
+        self.live.update(self.render())
+
+    def __enter__(self):
+        self.live.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.live.update(self.render(), refresh=True)
+        self.live.stop()
@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Callable, List, Tuple
+from .utils import get_numbered_file_content
+from .trace import span
+
+MAX_FILE_WORKERS = 16
+MAX_TERM_CAPTURES = 4
+FILE_READ_TIMEOUT = 30
+TERM_CAPTURE_TIMEOUT = 5
+
+def read_files(file_paths: List[str], read: Callable[[str], str] = get_numbered_file_content,
+               max_workers: int = MAX_FILE_WORKERS, timeout: float = FILE_READ_TIMEOUT) -> List[Tuple[str, str]]:
+    """
+    Read files concurrently on a thread pool and return (path, content) pairs in input order.
+
+    A file that fails to read, or takes longer than the timeout once the previous
+    files are done, is returned with an error message as its content.
+    """
+    with span("files.read", files=len(file_paths)) as s:
+        results = _read_files(file_paths, read, max_workers, timeout)
+        s["bytes"] = sum(len(content) for _, content in results if content)
+    return results
+
+def _read_files(file_paths: List[str], read: Callable[[str], str], max_workers: int, timeout: float) -> List[Tuple[str, str]]:
+    if len(file_paths) < 2:
+        return [(file_path, _read_file(read, file_path)) for file_path in file_paths]
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(file_paths)))
+    try:
+        futures = [executor.submit(_read_file, read, file_path) for file_path in file_paths]
+        results = []
+        for file_path, future in zip(file_paths, futures):
+            try:
+                results.append((file_path, future.result(timeout=timeout)))
+            except TimeoutError:
+                results.append((file_path, f"Error reading file: timed out after {timeout} seconds"))
+        return results
+    finally:
+        # Don't block on reads that hang, e.g. on an unresponsive network filesystem
+        executor.shutdown(wait=False)
+
+def _read_file(read: Callable[[str], str], file_path: str) -> str:
+    try:
+        return read(file_path)
+    except Exception as e:
+        return f"Error reading file: {str(e)}"
+
+def capture_terms(session_names: List[str], max_concurrency: int = MAX_TERM_CAPTURES,
+                  timeout: float = TERM_CAPTURE_TIMEOUT) -> List[Tuple[str, str]]:
+    """Capture the panes of several tmux sessions concurrently, returning (session, content) pairs in input order."""
+    if not session_names:
+        return []
+    with span("term.capture", sessions=len(session_names)) as s:
+        results = asyncio.run(_capture_terms(session_names, max_concurrency, timeout))
+        s["bytes"] = sum(len(content) for _, content in results)
+    return results
+
+async def _capture_terms(session_names: List[str], max_concurrency: int, timeout: float) -> List[Tuple[str, str]]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+    contents = await asyncio.gather(*(_capture_term(session_name, semaphore, timeout) for session_name in session_names))
+    return list(zip(session_names, contents))
+
+async def _capture_term(session_name: str, semaphore: asyncio.Semaphore, timeout: float) -> str:
+    async with semaphore:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "tmux", "capture-pane", "-p", "-t", session_name,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT
+            )
+        except OSError as e:
+            return f"Error capturing term content: {e}"
+
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return f"Error capturing term content: timed out after {timeout} seconds"
+
+        output = output.decode("utf-8", errors="replace")
+        if process.returncode != 0:
+            return f"Error capturing term content: {output}"
+        return output.strip()
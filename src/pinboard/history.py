@@ -0,0 +1,307 @@
+import difflib
+import hashlib
+import json
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .config import get_connection, get_setting
+from .file import FileTransaction, get_file_content_if_exists
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    base TEXT,
+    depth INTEGER NOT NULL,
+    codec TEXT NOT NULL,
+    data BLOB NOT NULL,
+    stored_size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id INTEGER,
+    kind TEXT NOT NULL,
+    created REAL NOT NULL,
+    undone INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS journal_group ON journal (group_id);
+CREATE TABLE IF NOT EXISTS journal_files (
+    operation_id INTEGER NOT NULL REFERENCES journal (id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    action TEXT NOT NULL,
+    before_hash TEXT,
+    after_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS journal_files_operation ON journal_files (operation_id);
+CREATE INDEX IF NOT EXISTS journal_files_path ON journal_files (path);
+"""
+
+# Versions are stored as line deltas against the previous version of the same
+# file, with a full copy after this many deltas to bound reconstruction cost
+MAX_DELTA_DEPTH = 16
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+FileChange = Tuple[Optional[str], Optional[str]]
+
+_initialized = False
+_current_group: Optional[List[Optional[int]]] = None
+
+def get_history_connection():
+    global _initialized
+    connection = get_connection()
+    if not _initialized:
+        connection.executescript(SCHEMA)
+        connection.execute("PRAGMA foreign_keys=ON")
+        _initialized = True
+    return connection
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def _compress(data: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=9).compress(data)
+    return "zlib", zlib.compress(data, 9)
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The undo history was compressed with zstandard, which is not installed.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def _make_delta(base: str, content: str) -> List[Any]:
+    base_lines = base.splitlines(keepends=True)
+    lines = content.splitlines(keepends=True)
+    delta = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, base_lines, lines, autojunk=False).get_opcodes():
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append("".join(lines[j1:j2]))
+    return delta
+
+def _apply_delta(base: str, delta: List[Any]) -> str:
+    base_lines = base.splitlines(keepends=True)
+    return "".join("".join(base_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in delta)
+
+def _encode_blob(connection, content: str, base_hash: Optional[str]) -> Tuple[Optional[str], int, str, bytes]:
+    """Return the base, depth, codec and data to store content with, as a delta against base_hash if that is smaller."""
+    codec, data = _compress(content.encode("utf-8"))
+    if base_hash is not None and base_hash != content_hash(content):
+        row = connection.execute("SELECT depth FROM blobs WHERE hash = ?", (base_hash,)).fetchone()
+        if row and row[0] < MAX_DELTA_DEPTH:
+            delta = json.dumps(_make_delta(load_blob(connection, base_hash), content)).encode("utf-8")
+            delta_codec, delta_data = _compress(delta)
+            if len(delta_data) < len(data):
+                return base_hash, row[0] + 1, delta_codec, delta_data
+    return None, 0, codec, data
+
+def store_blob(connection, content: str, base_hash: Optional[str] = None) -> str:
+    """Store a file version once per content hash, as a delta against base_hash if that is smaller."""
+    digest = content_hash(content)
+    if connection.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone():
+        return digest
+    base, depth, codec, data = _encode_blob(connection, content, base_hash)
+    connection.execute("INSERT INTO blobs (hash, base, depth, codec, data, stored_size) VALUES (?, ?, ?, ?, ?, ?)",
+                       (digest, base, depth, codec, data, len(data)))
+    return digest
+
+def load_blob(connection, digest: str) -> str:
+    base, codec, data = connection.execute("SELECT base, codec, data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+    payload = _decompress(codec, data).decode("utf-8")
+    if base is None:
+        return payload
+    return _apply_delta(load_blob(connection, base), json.loads(payload))
+
+@contextmanager
+def operation_group() -> Iterator[None]:
+    """Record all operations within the block as one group that is undone and redone at once."""
+    global _current_group
+    _current_group = [None]
+    try:
+        yield
+    finally:
+        _current_group = None
+
+def _latest_hash(connection, path: str) -> Optional[str]:
+    row = connection.execute("SELECT after_hash, before_hash FROM journal_files WHERE path = ? ORDER BY rowid DESC LIMIT 1", (path,)).fetchone()
+    return (row[0] or row[1]) if row else None
+
+def record_operation(kind: str, changes: Dict[str, FileChange], actions: Dict[str, str]) -> int:
+    """
+    Record the before and after content of every changed file as one journal entry.
+
+    A None before or after content means the file did not exist at that point.
+    Recording a new operation discards all operations that are currently undone.
+    """
+    connection = get_history_connection()
+    with connection:
+        discarded = connection.execute("DELETE FROM journal WHERE undone = 1").rowcount
+
+        group_id = _current_group[0] if _current_group else None
+        operation_id = connection.execute("INSERT INTO journal (group_id, kind, created) VALUES (?, ?, ?)",
+                                          (group_id, kind, time.time())).lastrowid
+        if group_id is None:
+            group_id = operation_id
+            connection.execute("UPDATE journal SET group_id = ? WHERE id = ?", (group_id, operation_id))
+            if _current_group is not None:
+                _current_group[0] = group_id
+
+        for path, (before, after) in changes.items():
+            base_hash = _latest_hash(connection, path)
+            before_hash = store_blob(connection, before, base_hash) if before is not None else None
+            after_hash = store_blob(connection, after, before_hash or base_hash) if after is not None else None
+            connection.execute("INSERT INTO journal_files (operation_id, path, action, before_hash, after_hash) VALUES (?, ?, ?, ?, ?)",
+                               (operation_id, path, actions[path], before_hash, after_hash))
+
+        evicted = evict(connection)
+        if discarded or evicted:
+            collect_garbage(connection)
+    return operation_id
+
+def evict(connection) -> int:
+    """Drop the oldest groups until the stored snapshots fit the configured size cap."""
+    max_bytes = get_setting("history_max_bytes", DEFAULT_MAX_BYTES)
+    evicted = 0
+    while True:
+        total = connection.execute("SELECT COALESCE(SUM(stored_size), 0) FROM blobs").fetchone()[0]
+        groups = connection.execute("SELECT DISTINCT group_id FROM journal ORDER BY group_id LIMIT 2").fetchall()
+        # Never evict the most recent group
+        if total <= max_bytes or len(groups) < 2:
+            return evicted
+        connection.execute("DELETE FROM journal WHERE group_id = ?", groups[0])
+        collect_garbage(connection)
+        evicted += 1
+
+def collect_garbage(connection):
+    """
+    Delete the blobs that the journal no longer references. A referenced version stored
+    as a delta against such a blob is first rebased onto its nearest referenced ancestor,
+    or stored in full, so that evicting old operations actually reclaims their versions.
+    """
+    bases = dict(connection.execute("SELECT hash, base FROM blobs").fetchall())
+    referenced = {digest for row in connection.execute("SELECT before_hash, after_hash FROM journal_files")
+                  for digest in row if digest is not None}
+    for digest in referenced:
+        base = bases.get(digest)
+        if base is None or base in referenced:
+            continue
+        while base is not None and base not in referenced:
+            base = bases.get(base)
+        # Every version is loaded before any blob is deleted, so chains are still intact
+        new_base, depth, codec, data = _encode_blob(connection, load_blob(connection, digest), base)
+        connection.execute("UPDATE blobs SET base = ?, depth = ?, codec = ?, data = ?, stored_size = ? WHERE hash = ?",
+                           (new_base, depth, codec, data, len(data), digest))
+    dead = [(digest,) for digest in bases if digest not in referenced]
+    connection.executemany("DELETE FROM blobs WHERE hash = ?", dead)
+    update_depths(connection)
+
+def update_depths(connection):
+    """
+    Recompute the delta chain depth of every blob once bases changed, so the depths of the
+    versions stored against rebased ones stay right. Versions whose chain became longer
+    than MAX_DELTA_DEPTH are stored in full.
+    """
+    rows = connection.execute("SELECT hash, base, depth FROM blobs").fetchall()
+    bases = {digest: base for digest, base, _ in rows}
+    stored = {digest: depth for digest, _, depth in rows}
+    depths: Dict[str, int] = {}
+
+    def get_depth(digest: str) -> int:
+        if digest not in depths:
+            base = bases[digest]
+            depths[digest] = 0 if base is None else get_depth(base) + 1
+        return depths[digest]
+
+    # Bases come before the versions stored against them
+    for digest in sorted(bases, key=get_depth):
+        base = bases[digest]
+        depth = 0 if base is None else depths[base] + 1
+        if depth > MAX_DELTA_DEPTH:
+            codec, data = _compress(load_blob(connection, digest).encode("utf-8"))
+            connection.execute("UPDATE blobs SET base = NULL, depth = 0, codec = ?, data = ?, stored_size = ? WHERE hash = ?",
+                               (codec, data, len(data), digest))
+            bases[digest], depth = None, 0
+        elif depth != stored[digest]:
+            connection.execute("UPDATE blobs SET depth = ? WHERE hash = ?", (depth, digest))
+        depths[digest] = depth
+
+def list_operations(limit: int = 20) -> List[Dict[str, Any]]:
+    connection = get_history_connection()
+    rows = connection.execute("SELECT id, group_id, kind, created, undone FROM journal ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    operations = []
+    for operation_id, group_id, kind, created, undone in rows:
+        files = connection.execute("SELECT path, action FROM journal_files WHERE operation_id = ? ORDER BY rowid", (operation_id,)).fetchall()
+        operations.append({"id": operation_id, "group_id": group_id, "kind": kind, "created": created,
+                           "undone": bool(undone), "edited_files": dict(files)})
+    return operations
+
+def _restore(connection, operation_ids: List[int], undo: bool) -> List[Tuple[str, str]]:
+    # Collect the final content of every path first, so all files are replaced in one transaction
+    targets: Dict[str, Optional[str]] = {}
+    for operation_id in operation_ids:
+        files = connection.execute("SELECT path, action, before_hash, after_hash FROM journal_files WHERE operation_id = ? ORDER BY rowid",
+                                   (operation_id,)).fetchall()
+        for path, action, before_hash, after_hash in (reversed(files) if undo else files):
+            targets.pop(path, None)
+            targets[path] = before_hash if undo else after_hash
+        connection.execute("UPDATE journal SET undone = ? WHERE id = ?", (int(undo), operation_id))
+
+    transaction = FileTransaction()
+    restored = []
+    try:
+        for path, digest in targets.items():
+            if digest is None:
+                transaction.remove(path)
+                restored.append((path, "Removed"))
+            else:
+                transaction.write(path, load_blob(connection, digest))
+                restored.append((path, "Restored"))
+        transaction.commit({path: get_file_content_if_exists(path) for path in targets})
+    except BaseException:
+        transaction.discard()
+        raise
+    return restored
+
+def forget_operation(operation_id: int):
+    """Drop an operation whose changes could not be applied."""
+    connection = get_history_connection()
+    with connection:
+        connection.execute("DELETE FROM journal WHERE id = ?", (operation_id,))
+        collect_garbage(connection)
+
+def undo(to: Optional[int] = None) -> List[Tuple[str, str]]:
+    """
+    Undo the most recent group of operations, or every operation after the
+    operation with id `to`. Returns the restored paths and what was done to them.
+    """
+    connection = get_history_connection()
+    if to is None:
+        row = connection.execute("SELECT group_id FROM journal WHERE undone = 0 ORDER BY id DESC LIMIT 1").fetchone()
+        if row is None:
+            return []
+        query, params = "SELECT id FROM journal WHERE undone = 0 AND group_id = ? ORDER BY id DESC", row
+    else:
+        if not connection.execute("SELECT 1 FROM journal WHERE id = ?", (to,)).fetchone():
+            raise ValueError(f"No operation with id {to} in the undo history.")
+        query, params = "SELECT id FROM journal WHERE undone = 0 AND id > ? ORDER BY id DESC", (to,)
+    with connection:
+        operation_ids = [operation_id for operation_id, in connection.execute(query, params).fetchall()]
+        return _restore(connection, operation_ids, undo=True)
+
+def redo() -> List[Tuple[str, str]]:
+    """Redo the oldest undone group of operations."""
+    connection = get_history_connection()
+    row = connection.execute("SELECT group_id FROM journal WHERE undone = 1 ORDER BY id LIMIT 1").fetchone()
+    if row is None:
+        return []
+    with connection:
+        operation_ids = [operation_id for operation_id, in connection.execute(
+            "SELECT id FROM journal WHERE undone = 1 AND group_id = ? ORDER BY id", row).fetchall()]
+        return _restore(connection, operation_ids, undo=False)
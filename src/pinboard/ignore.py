@@ -0,0 +1,245 @@
+import hashlib
+import os
+import re
+import subprocess
+from typing import Iterable, Iterator, List, Optional, Pattern, Tuple
+
+GITIGNORE_FILE = ".gitignore"
+PINBOARD_IGNORE_FILE = ".pinboardignore"
+IGNORE_FILES = (GITIGNORE_FILE, PINBOARD_IGNORE_FILE)
+GIT_LIST_TIMEOUT = 30
+# Mode of the index entries of submodules
+GITLINK_MODE = b"160000"
+
+def translate_pattern(pattern: str) -> str:
+    """Translate a gitignore glob, without its leading '!' or trailing '/', into a regular expression."""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+            parts.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i) and i + 2 == len(pattern) and (i == 0 or pattern[i - 1] == "/"):
+            parts.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                parts.append(re.escape(c))
+            else:
+                content = pattern[i + 1:end]
+                if content[0] in "!^":
+                    content = "^" + content[1:]
+                parts.append("[" + content.replace("\\", "\\\\") + "]")
+                i = end
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return "".join(parts)
+
+class IgnoreRules:
+    """The compiled patterns of one ignore file, matched relative to the directory containing it."""
+
+    def __init__(self, base: str, lines: Iterable[str]):
+        self.base = base
+        # (pattern, negated, directories only), matched last to first
+        self.patterns: List[Tuple[Pattern[str], bool, bool]] = []
+        for line in lines:
+            line = line.rstrip("\n")
+            # Trailing spaces are ignored unless they are escaped
+            while line.endswith(" ") and not line.endswith("\\ "):
+                line = line[:-1]
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            elif line.startswith("\\!") or line.startswith("\\#"):
+                line = line[1:]
+            directory_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            if "/" in line:
+                # Patterns with an inner or leading slash are relative to the base directory
+                regex = translate_pattern(line.lstrip("/"))
+            else:
+                regex = "(?:.*/)?" + translate_pattern(line)
+            self.patterns.append((re.compile(regex + r"\Z"), negated, directory_only))
+        # Most paths match no pattern at all, which one combined expression rules out quickly
+        self.any_pattern = re.compile("|".join(f"(?:{p.pattern})" for p, _, _ in self.patterns)) if self.patterns else None
+
+    @classmethod
+    def from_file(cls, base: str, file_path: str) -> "IgnoreRules":
+        try:
+            with open(file_path, "r", errors="replace") as f:
+                return cls(base, f.readlines())
+        except OSError:
+            return cls(base, [])
+
+    def match(self, path: str, is_dir: bool) -> Optional[bool]:
+        """Return whether the last matching pattern ignores the path, or None if no pattern matches."""
+        if self.any_pattern is None or not path.startswith(self.base + os.sep):
+            return None
+        relative = path[len(self.base) + 1:].replace(os.sep, "/")
+        if not self.any_pattern.match(relative):
+            return None
+        for pattern, negated, directory_only in reversed(self.patterns):
+            if (is_dir or not directory_only) and pattern.match(relative):
+                return not negated
+        return None
+
+class IgnoreMatcher:
+    """
+    The ignore rules in effect in one directory: those of its ancestors, followed by its own.
+
+    The signature changes whenever one of the ignore files the rules were loaded from does,
+    so that results cached with it can be revalidated.
+    """
+
+    def __init__(self, rules: Tuple[IgnoreRules, ...] = (), signature: str = ""):
+        self.rules = rules
+        self.signature = signature
+
+    def child(self, directory: str, names: Iterable[str]) -> "IgnoreMatcher":
+        """Return the matcher for a directory below this one that contains the given ignore files."""
+        return self.extend(directory, [os.path.join(directory, name) for name in names])
+
+    def extend(self, base: str, file_paths: Iterable[str]) -> "IgnoreMatcher":
+        """Add the rules of ignore files that are matched relative to base."""
+        rules = list(self.rules)
+        stats = [self.signature]
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            rules.append(IgnoreRules.from_file(base, file_path))
+            stats.append(f"{file_path}:{stat.st_mtime_ns}:{stat.st_size}")
+        if len(stats) == 1:
+            return self
+        return IgnoreMatcher(tuple(rules), hashlib.sha1("\0".join(stats).encode()).hexdigest()[:16])
+
+    def is_ignored(self, path: str, is_dir: bool) -> bool:
+        # Rules of deeper directories take precedence
+        for rules in reversed(self.rules):
+            matched = rules.match(path, is_dir)
+            if matched is not None:
+                return matched
+        return False
+
+def find_git_root(directory: str) -> Optional[str]:
+    path = os.path.abspath(directory)
+    while True:
+        if os.path.exists(os.path.join(path, ".git")):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+def get_git_dir(git_root: str) -> str:
+    git_dir = os.path.join(git_root, ".git")
+    if os.path.isfile(git_dir):
+        # Worktrees and submodules point to their git directory from a .git file
+        with open(git_dir, "r") as f:
+            content = f.read().strip()
+        if content.startswith("gitdir:"):
+            return os.path.normpath(os.path.join(git_root, content[len("gitdir:"):].strip()))
+    return git_dir
+
+def base_matcher(directory: str, names: Iterable[str] = IGNORE_FILES) -> IgnoreMatcher:
+    """
+    Return the ignore rules in effect for the entries of a directory that come from outside it:
+    the repository's info/exclude file and the ignore files of the directories above it.
+    """
+    directory = os.path.abspath(directory)
+    names = tuple(names)
+    matcher = IgnoreMatcher()
+    git_root = find_git_root(directory)
+    if git_root is None:
+        return matcher
+    if GITIGNORE_FILE in names:
+        matcher = matcher.extend(git_root, [os.path.join(get_git_dir(git_root), "info", "exclude")])
+    ancestors = []
+    path = directory
+    while path != git_root:
+        path = os.path.dirname(path)
+        ancestors.append(path)
+    for ancestor in reversed(ancestors):
+        matcher = matcher.child(ancestor, names)
+    return matcher
+
+def is_ignored_path(path: str, is_dir: bool) -> bool:
+    """Check a single path against the ignore files above it."""
+    path = os.path.abspath(path)
+    return base_matcher(os.path.dirname(path)).child(os.path.dirname(path), IGNORE_FILES).is_ignored(path, is_dir)
+
+def is_ignored_tree(directory: str) -> bool:
+    """Check whether a directory, or any directory above it up to the root of its git work tree, is ignored."""
+    path = os.path.abspath(directory)
+    git_root = find_git_root(path)
+    if git_root is None:
+        return False
+    while path != git_root:
+        if is_ignored_path(path, True):
+            return True
+        path = os.path.dirname(path)
+    return False
+
+def walk(root: str) -> Iterator[Tuple[str, List[str], List[str]]]:
+    """Like os.walk, leaving out the files and directories that are ignored by an ignore file."""
+    root = os.path.abspath(root)
+    matchers = {root: base_matcher(root)}
+    for current, dirs, files in os.walk(root):
+        matcher = matchers.pop(current).child(current, [name for name in files if name in IGNORE_FILES])
+        dirs[:] = [d for d in dirs if not matcher.is_ignored(os.path.join(current, d), True)]
+        files = [name for name in files if not matcher.is_ignored(os.path.join(current, name), False)]
+        yield current, dirs, files
+        # The caller may have pruned dirs further
+        for d in dirs:
+            matchers[os.path.join(current, d)] = matcher
+
+def list_git_files(directory: str) -> Optional[List[str]]:
+    """
+    List the tracked and untracked, not ignored files below a directory in a git work tree,
+    in a single git call. Submodules are left out. Returns None if git is unavailable or
+    the call fails.
+    """
+    try:
+        result = subprocess.run(["git", "ls-files", "-z", "-t", "--stage", "--cached", "--deleted", "--others", "--exclude-standard"],
+                                cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=GIT_LIST_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0:
+        return None
+
+    files, deleted = [], set()
+    for entry in result.stdout.split(b"\0"):
+        # Untracked nested repositories are listed as directories
+        if not entry or entry.endswith(b"/"):
+            continue
+        # Each path is tagged with its status, ? for untracked files and R for files deleted
+        # from the work tree. Tracked paths also carry their mode, object and stage.
+        tag, path = entry[:1], entry[2:]
+        if tag != b"?":
+            mode, _, path = path.partition(b"\t")
+            # Submodules are tracked as gitlinks, which are directories in the work tree
+            if mode.startswith(GITLINK_MODE):
+                continue
+        path = os.fsdecode(path)
+        if tag == b"R":
+            deleted.add(path)
+        else:
+            files.append(path)
+    return [os.path.join(directory, path) for path in dict.fromkeys(files) if path not in deleted]
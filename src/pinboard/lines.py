@@ -0,0 +1,142 @@
+import io
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+from typing import BinaryIO, Dict, Iterable, List, Sequence, Tuple, Union, overload
+
+# Files at least this large are numbered and edited through a line index
+LARGE_FILE_BYTES = 1024 * 1024
+# Amount of content decoded at once when rendering a large file
+RENDER_BLOCK_BYTES = 1024 * 1024
+MAX_CACHED_INDEXES = 32
+
+# Line start offsets by path, with the (inode, mtime, size) they were built for
+_offsets: Dict[str, Tuple[Tuple[int, int, int], array]] = {}
+
+def is_large_file(file_path: str) -> bool:
+    try:
+        return os.path.getsize(file_path) >= LARGE_FILE_BYTES
+    except OSError:
+        return False
+
+class LineIndex(Sequence[str]):
+    """
+    The lines of a memory-mapped file, as content.split('\\n') would return them.
+
+    Only the byte offset of every line is kept in memory, lines are decoded from
+    the mapping when they are accessed. Use as a context manager to close the mapping.
+    """
+
+    def __init__(self, file_path: str):
+        with open(file_path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.size = stat.st_size
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = _offsets.get(file_path)
+        if cached is not None and cached[0] == version:
+            self.offsets = cached[1]
+        else:
+            self.offsets = self.build_offsets()
+            if len(_offsets) >= MAX_CACHED_INDEXES:
+                del _offsets[next(iter(_offsets))]
+            _offsets[file_path] = (version, self.offsets)
+
+    def build_offsets(self) -> array:
+        offsets = array("Q", [0])
+        find = self.data.find
+        position = find(b"\n")
+        while position != -1:
+            offsets.append(position + 1)
+            position = find(b"\n", position + 1)
+        return offsets
+
+    def __enter__(self) -> "LineIndex":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def line_bytes(self, start: int, end: int) -> Tuple[int, int]:
+        """Byte range of lines start to end (exclusive), without the newline after the last one."""
+        return self.offsets[start], self.offsets[end] - 1 if end < len(self.offsets) else self.size
+
+    @overload
+    def __getitem__(self, i: int) -> str: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> List[str]: ...
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("line index out of range")
+        start, end = self.line_bytes(i, i + 1)
+        return self.data[start:end].decode("utf-8").rstrip("\r")
+
+    def render_numbered(self) -> str:
+        """Render the file like get_numbered_file_content, decoding one block of lines at a time."""
+        # A trailing newline does not start another numbered line
+        count = len(self) - 1 if self.offsets[-1] == self.size else len(self)
+        out = io.StringIO()
+        line = 0
+        while line < count:
+            end = min(max(bisect_left(self.offsets, self.offsets[line] + RENDER_BLOCK_BYTES), line + 1), count)
+            block = self.data[self.offsets[line]:self.offsets[end] if end < len(self) else self.size]
+            for number, text in enumerate(block.decode("utf-8").replace("\r\n", "\n").split("\n")[:end - line], line + 1):
+                out.write(f"{number}: {text}\n")
+            line = end
+        rendered = out.getvalue()
+        # Like readlines(), the last line keeps no newline if the file has none
+        return rendered if self.offsets[-1] == self.size else rendered[:-1]
+
+    def get_newline(self) -> bytes:
+        """The line ending of the file, as used by its first line."""
+        if len(self.offsets) > 1 and self.data[self.offsets[1] - 2:self.offsets[1] - 1] == b"\r":
+            return b"\r\n"
+        return b"\n"
+
+    def write_spliced(self, out: BinaryIO, spans: Iterable[Tuple[int, int, List[str]]]):
+        """
+        Write the file with each (start, end, new lines) span of lines replaced, copying
+        the untouched byte ranges straight from the mapping. New lines are written with
+        the file's line ending.
+        """
+        newline = self.get_newline()
+
+        def untouched(start: int, end: int) -> Tuple[int, int]:
+            first, last = self.line_bytes(start, end)
+            # The newline written after the range restores the carriage return of its last line
+            if newline == b"\r\n" and end < len(self) and last > first and self.data[last - 1:last] == b"\r":
+                last -= 1
+            return first, last
+
+        segments = []
+        position = 0
+        for start, end, new_lines in spans:
+            if start > position:
+                segments.append(untouched(position, start))
+            if new_lines:
+                segments.append(newline.join(line.encode("utf-8") for line in new_lines))
+            position = end
+        if position < len(self):
+            segments.append(untouched(position, len(self)))
+
+        for i, segment in enumerate(segments):
+            if i:
+                out.write(newline)
+            if isinstance(segment, bytes):
+                out.write(segment)
+            else:
+                out.write(self.data[segment[0]:segment[1]])
@@ -1,205 +1,705 @@
 import os
 import json
-import re
-from typing import Dict, List, Union
-from anthropic import Anthropic
-import typer
-from rich.console import Console
-from .config import get_llm_config, store_last_operation, store_file_version, clear_file_versions, store_succeed_operation
-from .file import update_file, add_new_file, get_all_files_in_directory, is_valid_file, remove_file
-from .pin import get_pinned_items, remove_pins
-from .term import get_term_content
-from .utils import get_file_content, get_numbered_file_content, parse_llm_response, apply_edits
-from .format import print_file_change, print_info
-
-console = Console()
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar, Union
+from .config import get_llm_config, get_setting
+from .context import pack_files, prune_cache, get_context_budget, get_conversation_budget, get_delta_budget, estimate_tokens
+from .delta import render_delta
+from .trace import record, span
+from .cache import get_cache_mode, lookup_response, store_response
+from .history import record_operation, forget_operation
+from .file import FileTransaction, get_file_content_if_exists
+from .pin import get_pinned_items, get_outline_files, get_symbol_files, get_unique_files
+from .outline import render_pinned_file, save_outlines
+from .gather import read_files, capture_terms
+from .utils import get_file_content, apply_edits, locate_edit, resolve_edits, parse_artifact_requests, ArtifactEditParser, EditError
+from .lines import LineIndex, is_large_file
+from .format import console, print_file_change, print_error, print_info, print_token_usage, collapse_artifact_edits
+
+_client = None
 
 def get_llm_client():
-    return Anthropic()
+    # Reuse one client per process, so that its HTTP connections are kept alive
+    global _client
+    if _client is None:
+        # Imported lazily, the SDK takes longer to import than all other modules combined
+        from anthropic import Anthropic
+        # Requests are retried by the retry policy instead, which the SDK knows nothing about
+        _client = Anthropic(max_retries=0)
+    return _client
+
+# Attempts per request when the API is rate limited, overloaded or unreachable
+MAX_REQUEST_ATTEMPTS = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+# Seconds a request may take, including all of its retries
+DEFAULT_REQUEST_DEADLINE = 600
+# Seconds that may be spent waiting to retry requests since one last succeeded, across all of them
+DEFAULT_RETRY_BUDGET = 900
+# Requests in a row that have to fail for good before the circuit opens, and for how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_COOLDOWN = 60
+
+T = TypeVar("T")
+
+class LLMUnavailableError(Exception):
+    """Raised when a request fails despite retries, or is not sent because the circuit is open."""
+
+def is_retryable(error: BaseException) -> bool:
+    from anthropic import APIConnectionError, APIStatusError
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, APIConnectionError)
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(response.headers[header]) * scale
+        except (KeyError, ValueError):
+            continue
+    return None
+
+def describe_error(error: BaseException) -> str:
+    status_code = getattr(error, "status_code", None)
+    return f"{type(error).__name__} ({status_code})" if status_code is not None else type(error).__name__
+
+class RetryPolicy:
+    """
+    Decide whether and when failed requests are retried, shared by all requests of a process.
+
+    Retries back off exponentially with full jitter, or wait as long as the API asks for
+    with retry-after. A request gives up once waiting would take it past its deadline,
+    and all waiting counts against one retry budget, which is refilled whenever a request
+    succeeds. After several requests in a row failed for good, the circuit opens and
+    requests fail fast until the cooldown passed.
+    """
+
+    def __init__(self):
+        self.budget = float(get_setting("retry_budget", DEFAULT_RETRY_BUDGET))
+        self.spent = 0.0
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        # Candidate fixes are requested from several threads
+        self.lock = threading.Lock()
+
+    @property
+    def remaining_budget(self) -> float:
+        return max(self.budget - self.spent, 0.0)
+
+    def check(self):
+        """Raise LLMUnavailableError if the circuit is open. Once the cooldown passed, requests are let through again."""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + CIRCUIT_COOLDOWN - time.monotonic()
+            if remaining > 0:
+                raise LLMUnavailableError(f"Not sending requests for another {remaining:.0f} s, after {self.failures} requests "
+                                          f"in a row failed. {self.remaining_budget:.0f} s of the retry budget are left.")
+            self.opened_at = None
+
+    def get_delay(self, error: BaseException, attempt: int, deadline: float) -> Optional[float]:
+        """Return how long to wait before the next attempt after a failed one, or None to give up."""
+        if attempt >= MAX_REQUEST_ATTEMPTS or not is_retryable(error):
+            return None
+        delay = get_retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(BACKOFF_BASE * 2 ** (attempt - 1), BACKOFF_MAX))
+        with self.lock:
+            if time.monotonic() + delay >= deadline or delay > self.remaining_budget:
+                return None
+            self.spent += delay
+        return delay
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.spent = 0.0
+
+    def failed(self, error: BaseException) -> LLMUnavailableError:
+        """Count a request that failed for good, and return the error to raise for it."""
+        with self.lock:
+            self.failures += 1
+            if self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+                self.opened_at = time.monotonic()
+        return LLMUnavailableError(f"The request failed with {describe_error(error)}: {error} "
+                                   f"({self.remaining_budget:.0f} s of the retry budget left)")
+
+_retry_policy: Optional[RetryPolicy] = None
+
+def get_retry_policy() -> RetryPolicy:
+    global _retry_policy
+    if _retry_policy is None:
+        _retry_policy = RetryPolicy()
+    return _retry_policy
+
+def get_request_deadline() -> float:
+    return float(get_setting("request_deadline", DEFAULT_REQUEST_DEADLINE))
+
+def send_with_retries(send: Callable[[float], T]) -> T:
+    """
+    Call send with the seconds left until the request deadline, which it should use as
+    the timeout of its attempt, and retry it according to the retry policy.
+    """
+    policy = get_retry_policy()
+    deadline = time.monotonic() + get_request_deadline()
+    attempt = 1
+    while True:
+        policy.check()
+        try:
+            result = send(deadline - time.monotonic())
+        except Exception as e:
+            delay = policy.get_delay(e, attempt, deadline)
+            if delay is None:
+                if is_retryable(e):
+                    raise policy.failed(e) from e
+                raise
+            record("llm.retry", delay, attempt=attempt, error=describe_error(e))
+            print_info(f"{describe_error(e)}, retrying in {delay:.1f} s (attempt {attempt + 1} of {MAX_REQUEST_ATTEMPTS}, "
+                       f"{policy.remaining_budget:.0f} s of the retry budget left).")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        policy.succeeded()
+        return result
+
+PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+MAX_LISTED_DROPPED_FILES = 10
+# Follow-up turns that answer requests for the full content of artifacts, per response
+MAX_ARTIFACT_REQUESTS = 2
 
 def get_all_pinned_files():
+    return sorted(get_unique_files(get_pinned_items()))
+
+def get_explicitly_pinned_files():
     pinned_items = get_pinned_items()
-    return [item for item in pinned_items if os.path.isfile(item) and is_valid_file(item)] + \
-           [file for item in pinned_items if os.path.isdir(item) 
-            for file in get_all_files_in_directory(item)]
-
-def generate_file_change_summary(edited_files: Dict[str, Union[str, List[Dict[str, Union[str, int]]]]]) -> str:
-    summary = []
-    for file_path, edits in edited_files.items():
-        if file_path.endswith("@tmux"):
-            summary.append(f"Skipped read-only term object: {file_path}")
-        elif isinstance(edits, list):
-            if any(edit['content'].strip() == "" for edit in edits):
-                summary.append(f"Removed file: {file_path}")
-            else:
-                summary.append(f"Updated file: {file_path}")
-        elif isinstance(edits, str):
-            summary.append(f"Added file: {file_path}")
+    unique_files = get_unique_files(pinned_items)
+    return {item for item in pinned_items if item in unique_files} | set(get_symbol_files(pinned_items))
+
+def get_packed_pinned_files(query: str) -> List[str]:
+    """Return the pinned files that fit into the context budget, ranked by relevance to the query."""
+    # Files pinned by symbol or as part of an outline only cost the tokens of what is shown of them
+    pinned_items = get_pinned_items()
+    symbol_files, outline_files = get_symbol_files(pinned_items), get_outline_files(pinned_items)
+    partial_files = sorted(set(symbol_files) | outline_files)
+    tokens = {file_path: estimate_tokens(content) for file_path, content in
+              read_files(partial_files, read=lambda file_path: render_pinned_file(file_path, symbol_files, outline_files))}
+    save_outlines()
+    pinned_files = get_all_pinned_files()
+    prune_cache(pinned_files)
+    all_files, dropped_files = pack_files(pinned_files, get_explicitly_pinned_files(), query, tokens=tokens)
+    if dropped_files:
+        listed = "\n".join(f"- {file}" for file in dropped_files[:MAX_LISTED_DROPPED_FILES])
+        if len(dropped_files) > MAX_LISTED_DROPPED_FILES:
+            listed += f"\n- ... and {len(dropped_files) - MAX_LISTED_DROPPED_FILES} more"
+        print_info(f"Left out {len(dropped_files)} file(s) that did not fit into the context budget of {get_context_budget()} tokens:\n{listed}")
+    return all_files
+
+def build_workspace_prompt(all_files: List[str]) -> str:
+    # Render files in a deterministic order so that the workspace prefix stays
+    # byte-identical between turns and can be served from the prompt cache
+    with span("prompt.workspace", files=len(all_files)) as s:
+        pinned_items = get_pinned_items()
+        symbol_files, outline_files = get_symbol_files(pinned_items), get_outline_files(pinned_items)
+
+        def read(file_path: str) -> str:
+            return render_pinned_file(file_path, symbol_files, outline_files)
+
+        workspace_prompt = ""
+        for file, content in read_files(sorted(set(all_files)), read=read):
+            workspace_prompt += f"<artifact identifier=\"{file}\">\n{content}\n</artifact>\n\n"
+        s["bytes"] = len(workspace_prompt)
+    return workspace_prompt
+
+def build_term_prompt() -> str:
+    term_prompt = ""
+    session_names = [item[:-5] for item in get_pinned_items() if item.endswith("@tmux")]
+    for session_name, content in capture_terms(session_names):
+        term_prompt += f"<artifact identifier=\"{session_name}@tmux\">\n{content}\n</artifact>\n\n"
+    return term_prompt
+
+def get_usage_fields(usage) -> Dict[str, Optional[int]]:
+    return {field: getattr(usage, field, None)
+            for field in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")}
+
+def count_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Estimate the tokens of messages whose content is either text or a list of text blocks."""
+    total = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        else:
+            total += sum(estimate_tokens(block.get("text", "")) for block in content)
+    return total
+
+def cached_text(text: str) -> Dict[str, Any]:
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
+def generate_file_change_summary(edited_files: Dict[str, str], rejected: Optional[Dict[str, str]] = None) -> str:
+    """Summarize the files that were actually changed, by action, and the files whose edits were rejected."""
+    summary = [f"{action.capitalize()} file: {file_path}" for file_path, action in edited_files.items()]
+    summary.extend(f"Skipped edits to {file_path}: {reason}" for file_path, reason in (rejected or {}).items())
     return "\n".join(summary) if summary else "No files were edited, added, or removed."
 
-def chat(message: str, clipboard_content: str = None, chat_history: List[Dict[str, str]] = None):
-    client = get_llm_client()
-    config = get_llm_config()
-    all_files = get_all_pinned_files()
-
-    system_prompt = ("You are an AI assistant that can answer questions about files and edit them. "
-                     "If the user requests any kinds of codebase changes, respond with the appropriate edits using <artifactEdit> tags. "
-                     "If the user asks a question, provide a succint response. "
-                     "Follow these rules strictly:\n"
-                     "1. For codebase changes, use <artifactEdit> tags with 'identifier', 'from', and 'to' attributes. For complete file rewrites, 'from' should be \"1\" and 'to' should be the last line number.\n"
-                     "2. Both the 'from' and 'to' indices are inclusive. Set 'from' to exactly the first line of the intended edit, and 'to' to exactly the last edited line. Mind the newlines. The two indices my coincide for a single line being overwritten (e.g. 3-3) with zero, one, or more lines.\n"
-                     "3. For genuinely new files that haven't existed before at all, use <artifactEdit> tags with only the 'identifier' attribute. Only skip 'from' and 'to' when the file doesn't exist. Otherwise, attempt edits between 'from' and 'to' line lumbers.\n"
-                     "4. Make sure to only use correct, absolute file paths as identifiers.\n"
-                     "5. Provide only the changed content within the <artifactEdit> tags.\n"
-                     "6. Do NOT include line numbers (e.g. '1.') between <artifactEdit> </artifactEdit> tags child content, not even for newly created files. The line numbers are only meant to help you identify which lines to edit, and are not actually part of the pinned files.\n"
-                     "7. To remove lines, provide no content within the <artifactEdit> tags.\n"
-                     "8. When creating new files or modifying existing ones, surgically update references (e.g. import statements) in all affected files to maintain consistency. Proactively identify and update any files that may be impacted by changes in module structure or file organization.\n"
-                     "9. Pinned term objects (ending with @tmux) are read-only. You can only update, add, or remove files.\n"
-                     "10. For questions, provide a concise, direct answer without using <artifactEdit> tags at all.\n"
-                     "11. Accurately preserve tab indentation when producing artifactEdits. The content inside <artifactEdit> tags will directly replace the referenced lines, so maintaining correct indentation is crucial.\n"
-                     "12. If you intend to make edits in different parts of the same artifact, rewrite the entire artifact with all changes included in one big edit. In general, however, try to make precise, surgical edits.\n"
-                     "13. If you intend to add a considerable number of novel lines to a file (e.g. an entirely new function, a series of new statement), attempt to make granular edits from and to a single line number which gets overwritten with the new content. Make sure to preserve the overwritten content in the new content in that case.\n")
-
-    human_prompt = "Workspace overview. Current pinned items:\n\n"
-    for file in all_files:
-        human_prompt += f"<artifact identifier=\"{file}\">\n{get_numbered_file_content(file)}\n</artifact>\n\n"
+class EditApplier:
+    """
+    Stage parsed artifact edits and commit them as one undoable operation.
 
-    pinned_items = get_pinned_items()
-    for item in pinned_items:
-        if item.endswith("@tmux"):
-            session_name = item[:-5]
-            human_prompt += f"<artifact identifier=\"{item}\">\n{get_term_content(session_name)}\n</artifact>\n\n"
+    Range edits are always applied to the file content as it was before the first
+    edit, so a file can be re-staged whenever more of its edits stream in. Nothing
+    is visible on disk until finish() journals the operation and swaps all staged
+    files in at once.
 
-    if clipboard_content:
-        human_prompt += f"Clipboard content:\n{clipboard_content}\n\n"
-    
-    messages = []
-    if chat_history:
-        messages.extend(chat_history)
-        
-    messages.append({"role": "user", "content": f"{human_prompt}\nUser: {message}"})
-
-    response = client.messages.create(
-        model=config["model"],
-        max_tokens=4000,
-        messages=messages,
-        system=system_prompt,
-    )
-
-    content = response.content[0].text if response.content else ""
-    if "<artifactEdit" in content:
-        edited_files = parse_llm_response(content)
-        last_operation = {"edited_files": {}}
-        clear_file_versions()
-        
-        for file_path, edits in edited_files.items():
-            if file_path.endswith("@tmux"):
-                print_info(f"Skipping read-only term object: {file_path}")
-            elif isinstance(edits, list):
-                file_content = get_file_content(file_path)
-                store_file_version(file_path, file_content)
-                updated_content = apply_edits(file_content, edits)
-                if updated_content.strip() == "":
-                    remove_file(file_path)
+    With stage=False, edits are only applied in memory, for candidates that may
+    later be committed with promote().
+    """
+
+    def __init__(self, kind: str, stage: bool = True):
+        self.kind = kind
+        self.stage = stage
+        self.edited_files: Dict[str, str] = {}
+        self.original_contents: Dict[str, Optional[str]] = {}
+        self.updated_contents: Dict[str, Optional[str]] = {}
+        self.applied: Dict[str, int] = {}
+        # Files whose edits were not applied, with the reason
+        self.rejected: Dict[str, str] = {}
+        self.transaction = FileTransaction()
+        # Large files whose edits are spliced into the staged file straight from the original
+        self.spliced: Set[str] = set()
+
+    def is_applied(self, file_path: str, edits: Union[str, List[Dict[str, Union[str, int]]]]) -> bool:
+        return self.applied.get(file_path) == (len(edits) if isinstance(edits, list) else -1)
+
+    def get_original_content(self, file_path: str) -> Optional[str]:
+        if file_path not in self.original_contents:
+            self.original_contents[file_path] = get_file_content(file_path) if os.path.isfile(file_path) else None
+        return self.original_contents[file_path]
+
+    def reject(self, file_path: str, edits: List[Dict[str, Union[str, int]]], error: EditError):
+        """
+        Drop every edit to a file, including those staged before the invalid one streamed
+        in, so that a file is either edited completely or not at all.
+        """
+        print_error(f"Skipped edits to {file_path}: {error}")
+        self.rejected[file_path] = str(error)
+        self.applied[file_path] = len(edits)
+        self.transaction.unstage(file_path)
+        self.edited_files.pop(file_path, None)
+        self.updated_contents.pop(file_path, None)
+        self.spliced.discard(file_path)
+
+    def apply(self, file_path: str, edits: Union[str, List[Dict[str, Union[str, int]]]]):
+        if file_path in self.rejected:
+            self.applied[file_path] = len(edits) if isinstance(edits, list) else -1
+        elif file_path.endswith("@tmux"):
+            print_info(f"Skipping read-only term object: {file_path}")
+            self.rejected[file_path] = "read-only term object"
+            self.applied[file_path] = len(edits) if isinstance(edits, list) else -1
+        elif isinstance(edits, list) and self.stage and (file_path in self.spliced or (
+                file_path not in self.original_contents and is_large_file(file_path))):
+            self.apply_spliced(file_path, edits)
+        elif isinstance(edits, list):
+            original_content = self.get_original_content(file_path) or ""
+            try:
+                updated_content = apply_edits(original_content, edits)
+            except EditError as e:
+                self.reject(file_path, edits, e)
+                return
+            if updated_content.strip() == "":
+                if self.stage:
+                    self.transaction.remove(file_path)
                     print_file_change("Removed", file_path)
-                    last_operation["edited_files"][file_path] = "removed"
-                else:
-                    update_file(file_path, updated_content)
-                    for edit in edits:
-                        print_file_change("Updated", file_path, edit["from"], edit["to"])
-                    last_operation["edited_files"][file_path] = "updated"
-            elif isinstance(edits, str):  # New file
-                add_new_file(file_path, edits)
+                self.edited_files[file_path] = "removed"
+                self.updated_contents[file_path] = None
+            else:
+                if self.stage:
+                    self.transaction.write(file_path, updated_content)
+                    lines = original_content.split("\n")
+                    for edit in edits[self.applied.get(file_path, 0):]:
+                        print_file_change("Updated", file_path, *locate_edit(lines, edit))
+                self.edited_files[file_path] = "updated"
+                self.updated_contents[file_path] = updated_content
+            self.applied[file_path] = len(edits)
+        elif isinstance(edits, str):  # New file
+            self.get_original_content(file_path)
+            if self.stage:
+                self.transaction.write(file_path, edits)
                 print_file_change("Added", file_path)
-                last_operation["edited_files"][file_path] = "added"
-        
-        store_last_operation(last_operation)
-        if not edited_files:
-            print_info("No files were edited, added, or removed. Note that files can only be added in pinned directories, and that only pinned files or files in pinned directories can be edited or removed.")
-        
-        # Generate a summary of file changes for the chat history
-        file_change_summary = generate_file_change_summary(edited_files)
-        
-        return content, file_change_summary
+            self.edited_files[file_path] = "added"
+            self.updated_contents[file_path] = edits
+            self.applied[file_path] = -1
+
+    def apply_spliced(self, file_path: str, edits: List[Dict[str, Union[str, int]]]):
+        try:
+            with LineIndex(file_path) as index:
+                spans = resolve_edits(index, edits)
+                self.transaction.write(file_path, lambda out: index.write_spliced(out, spans))
+                ranges = [locate_edit(index, edit) for edit in edits[self.applied.get(file_path, 0):]]
+        except EditError as e:
+            self.reject(file_path, edits, e)
+            return
+
+        self.spliced.add(file_path)
+        self.applied[file_path] = len(edits)
+        if os.path.getsize(self.transaction.staged[file_path]) == 0:
+            self.transaction.remove(file_path)
+            print_file_change("Removed", file_path)
+            self.edited_files[file_path] = "removed"
+            return
+        for from_line, to_line in ranges:
+            print_file_change("Updated", file_path, from_line, to_line)
+        self.edited_files[file_path] = "updated"
+
+    def finish(self):
+        if not self.edited_files or not self.stage:
+            return
+        for file_path in self.spliced:
+            # Both versions are only loaded for the undo journal, once the response is complete
+            self.get_original_content(file_path)
+            staged_path = self.transaction.staged[file_path]
+            self.updated_contents[file_path] = get_file_content(staged_path) if staged_path is not None else None
+        changes = {file_path: (self.original_contents[file_path], self.updated_contents[file_path])
+                   for file_path in self.edited_files}
+        with span("edits.commit", files=len(changes)):
+            # The journal is written first, so an interrupted commit can still be undone
+            operation_id = record_operation(self.kind, changes, self.edited_files)
+            try:
+                self.transaction.commit(self.original_contents)
+            except OSError as e:
+                forget_operation(operation_id)
+                print_error(f"Could not apply the edits, no files were changed: {e}")
+                self.edited_files = {}
+
+    def promote(self):
+        """Stage and commit the in-memory edits of an applier created with stage=False."""
+        self.stage = True
+        for file_path, action in self.edited_files.items():
+            if action == "removed":
+                self.transaction.remove(file_path)
+            else:
+                self.transaction.write(file_path, self.updated_contents[file_path])
+            print_file_change(action.capitalize(), file_path)
+        self.finish()
+
+    def discard(self):
+        self.transaction.discard()
+
+def request_edits(client, request: Dict[str, Any], kind: str,
+                  on_text: Optional[Callable[[str], None]] = None, apply_early: bool = False,
+                  turns: Optional[List[Dict[str, Any]]] = None):
+    """
+    Send a request to the LLM and apply the artifact edits in its response.
+
+    When on_text is given, the response is streamed and every text delta is passed
+    to it. Edits are then parsed as they arrive and, with apply_early, each file is
+    staged as soon as the closing tag of one of its edits has been received. All
+    files are replaced together once the response is complete.
+
+    If the response only asks for the full content of artifacts, the content is sent
+    in a follow-up turn, which is appended to turns if given, and the LLM is asked again.
+
+    Returns the response text and the applier, whose edited_files only hold the files
+    that were actually changed, or None if the response contains no edits.
+    """
+    parser = ArtifactEditParser()
+    applier = EditApplier(kind)
+    try:
+        return _request_edits(client, request, parser, applier, on_text, apply_early, turns)
+    except BaseException:
+        applier.discard()
+        raise
+
+def build_requested_prompt(file_paths: List[str]) -> str:
+    requested_prompt = "Full content of the requested artifacts:\n\n"
+    for file, content in read_files(file_paths):
+        requested_prompt += f"<artifact identifier=\"{file}\">\n{content}\n</artifact>\n\n"
+    return requested_prompt + "Continue with your response."
+
+def _request_edits(client, request: Dict[str, Any], parser: ArtifactEditParser, applier: EditApplier,
+                   on_text: Optional[Callable[[str], None]], apply_early: bool,
+                   turns: Optional[List[Dict[str, Any]]] = None, cached: bool = True):
+    for _ in range(MAX_ARTIFACT_REQUESTS):
+        content = _send_request(client, request, parser, applier, on_text, apply_early, cached)
+        requested = [file_path for file_path in dict.fromkeys(parse_artifact_requests(content))
+                     if parser.is_editable(file_path) and os.path.isfile(file_path)]
+        if "<artifactEdit" in content or not requested:
+            break
+        print_info(f"Sending the full content of {len(requested)} requested file(s).")
+        follow_up = [{"role": "assistant", "content": content}, {"role": "user", "content": build_requested_prompt(requested)}]
+        request = dict(request, messages=request["messages"] + follow_up)
+        if turns is not None:
+            turns.extend(follow_up)
     else:
+        content = _send_request(client, request, parser, applier, on_text, apply_early, cached)
+
+    if "<artifactEdit" not in content:
         return content, None
 
-def succeed_chat(command: str, error_output: str, verbose: bool = False):
+    for file_path, edits in parser.edited_files.items():
+        if not applier.is_applied(file_path, edits):
+            applier.apply(file_path, edits)
+
+    applier.finish()
+    if not parser.edited_files:
+        print_info("No files were edited, added, or removed. Note that files can only be added in pinned directories, and that only pinned files or files in pinned directories can be edited or removed.")
+
+    return content, applier
+
+def _send_request(client, request: Dict[str, Any], parser: ArtifactEditParser, applier: EditApplier,
+                  on_text: Optional[Callable[[str], None]], apply_early: bool, cached: bool = True) -> str:
+    start = time.perf_counter()
+    hit = lookup_response(request) if cached else None
+    if hit is not None:
+        content, usage_fields = hit
+        if on_text is not None:
+            on_text(content)
+        for file_path in parser.feed(content):
+            if apply_early:
+                applier.apply(file_path, parser.edited_files[file_path])
+        record("llm.request", time.perf_counter() - start, model=request["model"], streamed=on_text is not None, cached=True, **usage_fields)
+        console.print("[dim]Response served from the response cache[/dim]")
+        return content
+    if get_cache_mode() == "replay":
+        raise LLMUnavailableError("No response was recorded for this request, and none are requested while replaying.")
+
+    first_token = None
+
+    def send(timeout: float):
+        nonlocal first_token
+        if on_text is None:
+            response = client.messages.create(**request, timeout=timeout)
+            return response.content[0].text if response.content else "", response.usage
+        with client.messages.stream(**request, timeout=timeout) as stream:
+            try:
+                for text in stream.text_stream:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    on_text(text)
+                    for file_path in parser.feed(text):
+                        if apply_early:
+                            applier.apply(file_path, parser.edited_files[file_path])
+            except Exception as e:
+                # Text that was already shown and parsed cannot be taken back by a retry
+                if first_token is not None:
+                    raise LLMUnavailableError(f"The response broke off with {describe_error(e)}: {e}") from e
+                raise
+            return stream.get_final_text(), stream.get_final_message().usage
+
+    content, usage = send_with_retries(send)
+    if on_text is None:
+        parser.feed(content)
+    if cached:
+        store_response(request, content, get_usage_fields(usage))
+    record("llm.request", time.perf_counter() - start, model=request["model"], streamed=on_text is not None,
+           time_to_first_token=first_token, **get_usage_fields(usage))
+    print_token_usage(usage)
+    return content
+
+# Rules for editing artifacts, shared by the system prompts of chat and succeed
+EDIT_RULES = ("Follow these rules strictly:\n"
+              "1. For codebase changes, use <artifactEdit> tags with 'identifier', 'from', and 'to' attributes. For complete file rewrites, 'from' should be \"1\" and 'to' should be the last line number.\n"
+              "2. Both the 'from' and 'to' indices are inclusive. Set 'from' to exactly the first line of the intended edit, and 'to' to exactly the last edited line. Mind the newlines. The two indices may coincide for a single line being overwritten (e.g. 3-3) with zero, one, or more lines.\n"
+              "3. For genuinely new files that haven't existed before at all, use <artifactEdit> tags with only the 'identifier' attribute. Only skip 'from' and 'to' when the file doesn't exist. Otherwise, attempt edits between 'from' and 'to' line numbers.\n"
+              "4. Make sure to only use correct, absolute file paths as identifiers.\n"
+              "5. Provide only the changed content within the <artifactEdit> tags.\n"
+              "6. Do NOT include line numbers (e.g. '1.') between <artifactEdit> </artifactEdit> tags child content, not even for newly created files. The line numbers are only meant to help you identify which lines to edit, and are not actually part of the pinned files.\n"
+              "7. To remove lines, provide no content within the <artifactEdit> tags.\n"
+              "8. When creating new files or modifying existing ones, surgically update references (e.g. import statements) in all affected files to maintain consistency. Proactively identify and update any files that may be impacted by changes in module structure or file organization.\n"
+              "9. Pinned term objects (ending with @tmux) are read-only. You can only update, add, or remove files.\n"
+              "10. Accurately preserve tab indentation when producing artifactEdits. The content inside <artifactEdit> tags will directly replace the referenced lines, so maintaining correct indentation is crucial.\n"
+              "11. If you intend to make edits in different parts of the same artifact, use one small <artifactEdit> tag per changed region instead of rewriting the artifact. Line numbers always refer to the artifact as shown, before any of your edits, and the ranges of different edits must not overlap.\n"
+              "12. Instead of 'from' and 'to', an edit can be anchored by content: <artifactEdit identifier=\"/abs/path\" mode=\"replace\"><search>existing lines, without line numbers</search><replace>new lines</replace></artifactEdit>. The search block must match exactly one place in the artifact, so include enough lines to make it unique.\n"
+              "13. If you intend to add a considerable number of novel lines to a file (e.g. an entirely new function, a series of new statement), attempt to make granular edits from and to a single line number which gets overwritten with the new content. Make sure to preserve the overwritten content in the new content in that case.\n"
+              "14. Some artifacts only show the pinned parts of a file. Lines that were left out are marked by a line containing only '...', and line numbers still refer to the whole file. Only edit lines that are shown.\n"
+              "15. To see the whole content of an artifact that is only partly shown, for example before editing lines that are left out, respond with nothing but <artifactRequest identifier=\"/abs/path\"/> tags for the artifacts you need, and their full content will be sent to you. Artifacts of outlined folders only show the signatures and docstrings of their files, or their path and size if they cannot be outlined.\n")
+
+CHAT_SYSTEM_PROMPT = ("You are an AI assistant that can answer questions about files and edit them. "
+                      "If the user requests any kinds of codebase changes, respond with the appropriate edits using <artifactEdit> tags. "
+                      "If the user asks a question, provide a concise, direct answer without using <artifactEdit> tags at all. "
+                      + EDIT_RULES)
+
+def build_chat_request(workspace_prompt: str, turn_prompt: str, chat_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    # The system prompt and the workspace form a stable prefix marked for prompt
+    # caching, while per-turn content comes after the cache breakpoints
+    messages = [dict(entry) for entry in chat_history or []]
+    if messages:
+        messages[0]["content"] = [cached_text(workspace_prompt), {"type": "text", "text": messages[0]["content"]}]
+        if len(messages) > 1:
+            # A second breakpoint at the end of the history caches earlier turns as well
+            messages[-1]["content"] = [cached_text(messages[-1]["content"])]
+        messages.append({"role": "user", "content": turn_prompt})
+    else:
+        messages.append({"role": "user", "content": [cached_text(workspace_prompt), {"type": "text", "text": turn_prompt}]})
+
+    return {
+        "model": get_llm_config()["model"],
+        "max_tokens": 4000,
+        "messages": messages,
+        "system": [cached_text(CHAT_SYSTEM_PROMPT)],
+        "extra_headers": {"anthropic-beta": PROMPT_CACHING_BETA},
+    }
+
+def chat(message: str, clipboard_content: str = None, chat_history: List[Dict[str, str]] = None,
+         on_text: Optional[Callable[[str], None]] = None, apply_early: bool = False):
     client = get_llm_client()
-    config = get_llm_config()
-    all_files = get_all_pinned_files()
+    all_files = get_packed_pinned_files(message)
+    workspace_prompt = "Workspace overview. Current pinned items:\n\n" + build_workspace_prompt(all_files)
+
+    turn_prompt = build_term_prompt()
+    if clipboard_content:
+        turn_prompt += f"Clipboard content:\n{clipboard_content}\n\n"
+    turn_prompt += f"User: {message}"
+
+    request = build_chat_request(workspace_prompt, turn_prompt, chat_history)
+    content, applier = request_edits(client, request, "sh", on_text, apply_early)
+    if applier is None:
+        return content, None
 
-    system_prompt = ("You are an AI assistant tasked with fixing errors in code. "
+    # Generate a summary of file changes for the chat history
+    return content, generate_file_change_summary(applier.edited_files, applier.rejected)
+
+class SucceedConversation:
+    """
+    The conversation of one 'pin succeed' run.
+
+    The first turn sends the whole workspace. Later turns keep the previous attempts
+    in the conversation and only send numbered diffs of the files that changed since
+    they were last shown, along with the new error output. If that turn would exceed
+    the delta budget, or the whole conversation the conversation budget, the
+    conversation starts over with the whole workspace and a summary of the previous
+    attempts.
+    """
+
+    # Previous attempts summarized when the conversation starts over, and the length of each
+    MAX_SUMMARIZED_ATTEMPTS = 5
+    MAX_ATTEMPT_SUMMARY_CHARS = 2000
+
+    SYSTEM_PROMPT = ("You are an AI assistant tasked with fixing errors in code. "
                      "Analyze the error output and make necessary changes to the codebase to fix the issue. "
                      "Respond with the appropriate edits using <artifactEdit> tags. "
-                     "Follow these rules strictly:\n"
-                     "1. For codebase changes, use <artifactEdit> tags with 'identifier', 'from', and 'to' attributes. For complete file rewrites, 'from' should be \"1\" and 'to' should be the last line number.\n"
-                     "2. Both the 'from' and 'to' indices are inclusive. Set 'from' to exactly the first line of the intended edit, and 'to' to exactly the last edited line. Mind the newlines. The two indices may coincide for a single line being overwritten (e.g. 3-3) with zero, one, or more lines.\n"
-                     "3. For genuinely new files that haven't existed before at all, use <artifactEdit> tags with only the 'identifier' attribute. Only skip 'from' and 'to' when the file doesn't exist. Otherwise, attempt edits between 'from' and 'to' line numbers.\n"
-                     "4. Make sure to only use correct, absolute file paths as identifiers.\n"
-                     "5. Provide only the changed content within the <artifactEdit> tags.\n"
-                     "6. Do NOT include line numbers (e.g. '1.') between <artifactEdit> </artifactEdit> tags child content, not even for newly created files. The line numbers are only meant to help you identify which lines to edit, and are not actually part of the pinned files.\n"
-                     "7. To remove lines, provide no content within the <artifactEdit> tags.\n"
-                     "8. When creating new files or modifying existing ones, surgically update references (e.g. import statements) in all affected files to maintain consistency. Proactively identify and update any files that may be impacted by changes in module structure or file organization.\n"
-                     "9. Pinned term objects (ending with @tmux) are read-only. You can only update, add, or remove files.\n"
-                     "10. Accurately preserve tab indentation when producing artifactEdits. The content inside <artifactEdit> tags will directly replace the referenced lines, so maintaining correct indentation is crucial.\n"
-                     "11. If you intend to make edits in different parts of the same artifact, rewrite the entire artifact with all changes included in one big edit. In general, however, try to make precise, surgical edits.\n"
-                     "12. If you intend to add a considerable number of novel lines to a file (e.g. an entirely new function, a series of new statement), attempt to make granular edits from and to a single line number which gets overwritten with the new content. Make sure to preserve the overwritten content in the new content in that case.\n"
-                     "13. Provide a brief explanation of the changes you're making and why they should fix the issue.\n")
-
-    human_prompt = f"Command that failed: {command}\n\nError output:\n{error_output}\n\nCurrent pinned items:\n\n"
-    for file in all_files:
-        human_prompt += f"<artifact identifier=\"{file}\">\n{get_numbered_file_content(file)}\n</artifact>\n\n"
+                     + EDIT_RULES +
+                     "\nProvide a brief explanation of the changes you're making and why they should fix the issue. "
+                     "If the command still fails after your edits, you will be shown how the artifacts changed since they were last shown, as <artifactDiff> blocks: lines starting with ' ' or '+' are prefixed with their current line number, lines starting with '-' were removed. Do not repeat fixes that did not work. Prefer mode=\"replace\" edits from then on, since the line numbers of unchanged lines may have shifted.\n")
 
-    pinned_items = get_pinned_items()
-    for item in pinned_items:
-        if item.endswith("@tmux"):
-            session_name = item[:-5]
-            human_prompt += f"<artifact identifier=\"{item}\">\n{get_term_content(session_name)}\n</artifact>\n\n"
-
-    messages = [{"role": "user", "content": human_prompt}]
-
-    response = client.messages.create(
-        model=config["model"],
-        max_tokens=4000,
-        messages=messages,
-        system=system_prompt,
-    )
-
-    content = response.content[0].text if response.content else ""
-    if "<artifactEdit" in content:
-        edited_files = parse_llm_response(content)
-        last_operation = {"edited_files": {}}
-        clear_file_versions()
-        
-        for file_path, edits in edited_files.items():
-            if file_path.endswith("@tmux"):
-                print_info(f"Skipping read-only term object: {file_path}")
-            elif isinstance(edits, list):
-                file_content = get_file_content(file_path)
-                store_file_version(file_path, file_content)
-                updated_content = apply_edits(file_content, edits)
-                if updated_content.strip() == "":
-                    remove_file(file_path)
-                    print_file_change("Removed", file_path)
-                    last_operation["edited_files"][file_path] = "removed"
-                else:
-                    update_file(file_path, updated_content)
-                    for edit in edits:
-                        print_file_change("Updated", file_path, edit["from"], edit["to"])
-                    last_operation["edited_files"][file_path] = "updated"
-            elif isinstance(edits, str):  # New file
-                add_new_file(file_path, edits)
-                print_file_change("Added", file_path)
-                last_operation["edited_files"][file_path] = "added"
-        
-        store_succeed_operation(last_operation)
-        if not edited_files:
-            print_info("No files were edited, added, or removed. Note that files can only be added in pinned directories, and that only pinned files or files in pinned directories can be edited or removed.")
-        
-        # Generate a summary of file changes for the chat history
-        file_change_summary = generate_file_change_summary(edited_files)
-        
-        return content if verbose else re.sub(r'<artifactEdit[^>]*>.*?</artifactEdit>', "...", content, flags=re.DOTALL), file_change_summary
-    else:
-        return content, None
\ No newline at end of file
+    def __init__(self, command: str):
+        self.command = command
+        self.messages: List[Dict[str, Any]] = []
+        self.pending: List[Dict[str, Any]] = []
+        # Content of every tracked file as it was last shown, None if it did not exist
+        self.shown: Dict[str, Optional[str]] = {}
+        # Explanations of the previous responses, without their edits
+        self.attempts: List[str] = []
+
+    def build_delta_prompt(self) -> Tuple[str, Dict[str, Optional[str]]]:
+        current = dict(read_files(sorted(self.shown), read=get_file_content_if_exists))
+        delta_prompt = "".join(render_delta(file_path, self.shown[file_path], current[file_path]) for file_path in sorted(current))
+        return delta_prompt, current
+
+    def build_attempts_prompt(self) -> str:
+        attempts = self.attempts[-self.MAX_SUMMARIZED_ATTEMPTS:]
+        if not attempts:
+            return ""
+        first = len(self.attempts) - len(attempts) + 1
+        summary = "".join(f"Attempt {first + i}:\n{attempt}\n\n" for i, attempt in enumerate(attempts))
+        return f"Previous attempts, whose edits are already applied but did not fix the command:\n\n{summary}"
+
+    def build_request(self, error_output: str) -> Dict[str, Any]:
+        """Build the request for the next turn. The turn becomes part of the conversation once record() is called."""
+        config = get_llm_config()
+        messages = None
+        if self.messages:
+            delta_prompt, current = self.build_delta_prompt()
+            changes = f"The artifacts changed as follows:\n\n{delta_prompt}" if delta_prompt else "No artifacts changed.\n\n"
+            turn_prompt = build_term_prompt() + changes + f"The command still fails.\n\nError output:\n{error_output}\n"
+            if estimate_tokens(turn_prompt) > get_delta_budget():
+                print_info("The changes since the last attempt exceed the delta budget, sending the whole workspace again.")
+            elif count_message_tokens(self.messages) + estimate_tokens(turn_prompt) > get_conversation_budget():
+                print_info("The conversation exceeds its token budget, sending the whole workspace again with a summary of the previous attempts.")
+            else:
+                self.pending = self.messages + [{"role": "user", "content": turn_prompt}]
+                messages = [dict(message) for message in self.pending]
+                # Cache the conversation up to the previous response as well
+                messages[-2]["content"] = [cached_text(messages[-2]["content"])]
+                self.shown = current
+
+        if messages is None:
+            all_files = get_packed_pinned_files(f"{self.command}\n{error_output}")
+            workspace_prompt = "Current pinned items:\n\n" + build_workspace_prompt(all_files)
+            turn_prompt = build_term_prompt() + self.build_attempts_prompt() + f"Command that failed: {self.command}\n\nError output:\n{error_output}\n"
+            messages = [{"role": "user", "content": [cached_text(workspace_prompt), {"type": "text", "text": turn_prompt}]}]
+            self.pending = messages
+            self.shown = dict(read_files(sorted(set(all_files)), read=get_file_content_if_exists))
+
+        return {
+            "model": config["model"],
+            "max_tokens": 4000,
+            "messages": messages,
+            "system": [cached_text(self.SYSTEM_PROMPT)],
+            "extra_headers": {"anthropic-beta": PROMPT_CACHING_BETA},
+        }
+
+    def record(self, content: str, edited_files: Iterable[str], turns: Iterable[Dict[str, Any]] = ()):
+        """Add the response, after any follow-up turns, to the pending turn, and track files created by it."""
+        self.messages = list(self.pending) + list(turns)
+        self.messages.append({"role": "assistant", "content": content or "(no response)"})
+        attempt = collapse_artifact_edits(content).strip()
+        self.attempts.append(attempt[:self.MAX_ATTEMPT_SUMMARY_CHARS] or "(no explanation)")
+        for file_path in edited_files:
+            if not file_path.endswith("@tmux"):
+                self.shown.setdefault(file_path, None)
+
+def succeed_chat(conversation: SucceedConversation, error_output: str, verbose: bool = False,
+                 on_text: Optional[Callable[[str], None]] = None, apply_early: bool = False):
+    client = get_llm_client()
+    request = conversation.build_request(error_output)
+    turns: List[Dict[str, Any]] = []
+    content, applier = request_edits(client, request, "succeed", on_text, apply_early, turns)
+    edited_files = applier.edited_files if applier is not None else {}
+    conversation.record(content, edited_files, turns)
+    if not edited_files:
+        # Rejected edits changed nothing, so retrying the command would not make progress
+        return content, None
+
+    # Generate a summary of file changes for the chat history
+    file_change_summary = generate_file_change_summary(edited_files, applier.rejected)
+
+    return content if verbose else collapse_artifact_edits(content), file_change_summary
+
+def request_candidate(client, request: Dict[str, Any], kind: str) -> Tuple[str, EditApplier]:
+    """
+    Request edits without writing them, returning the response and an unstaged applier.
+    Candidates bypass the response cache, which would answer each of them the same.
+    """
+    parser = ArtifactEditParser()
+    applier = EditApplier(kind, stage=False)
+    content, _ = _request_edits(client, request, parser, applier, None, False, cached=False)
+    return content, applier
+
+def succeed_candidates(conversation: SucceedConversation, error_output: str, count: int) -> List[Tuple[str, EditApplier]]:
+    """
+    Request several fixes for a failed command concurrently. Returns the candidates
+    that contain edits, each with its response and an applier holding its edits.
+    The promoted candidate has to be recorded in the conversation by the caller.
+    """
+    client = get_llm_client()
+    # Built once in this thread, so the requests share the file index and the prompt cache
+    request = conversation.build_request(error_output)
+    candidates = []
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [executor.submit(request_candidate, client, request, "succeed") for _ in range(count)]
+        for future in futures:
+            try:
+                content, applier = future.result()
+            except Exception as e:
+                print_error(f"Requesting a candidate fix failed: {e}")
+                continue
+            if applier.edited_files:
+                candidates.append((content, applier))
+    return candidates
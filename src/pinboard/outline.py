@@ -0,0 +1,80 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set
+from .pin import DATA_DIR, ensure_data_dir
+from .symbols import Span, get_resolver, render_spans, render_symbols
+from .utils import get_file_content, get_numbered_file_content
+
+OUTLINE_CACHE_FILE = os.path.join(DATA_DIR, "outlines.json")
+# Beyond this many cached outlines, the oldest ones are dropped
+MAX_CACHED_OUTLINES = 10_000
+# Shown instead of the outline of files whose type cannot be outlined
+OUTLINE_STUB = "... ({path}, {size} bytes, not outlined)\n"
+
+_cache: Optional[Dict[str, Any]] = None
+_cache_dirty = False
+# Outlines are rendered from the file reading threads
+_lock = threading.Lock()
+
+def load_outlines() -> Dict[str, Any]:
+    global _cache
+    if _cache is None:
+        try:
+            with open(OUTLINE_CACHE_FILE, 'r') as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+def save_outlines():
+    global _cache_dirty
+    if _cache is None or not _cache_dirty:
+        return
+    ensure_data_dir()
+    tmp_file = f"{OUTLINE_CACHE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(_cache, f)
+    os.replace(tmp_file, OUTLINE_CACHE_FILE)
+    _cache_dirty = False
+
+def get_outline_spans(file_path: str, content: str) -> List[Span]:
+    """Return the outline spans of a file's content, cached by a hash of the content and the file type."""
+    global _cache_dirty
+    resolver = get_resolver(file_path)
+    if resolver is None:
+        return []
+    key = hashlib.sha1(f"{os.path.splitext(file_path)[1].lower()}\0{content}".encode()).hexdigest()
+    with _lock:
+        spans = load_outlines().get(key)
+    if spans is None:
+        spans = [list(span) for span in resolver.outline(content)]
+        with _lock:
+            cache = load_outlines()
+            cache[key] = spans
+            while len(cache) > MAX_CACHED_OUTLINES:
+                del cache[next(iter(cache))]
+            _cache_dirty = True
+    return [(start, end) for start, end in spans]
+
+def render_outline(file_path: str, numbered: bool = True) -> str:
+    """
+    Render the signatures and docstrings of a file, numbered as in the whole file. Files
+    of a type that cannot be outlined are rendered as a stub with their path and size.
+    """
+    if get_resolver(file_path) is None:
+        return OUTLINE_STUB.format(path=file_path, size=os.path.getsize(file_path))
+    with open(file_path, "r") as f:
+        content = f.read()
+    lines = io.StringIO(content).readlines()
+    return render_spans(lines, get_outline_spans(file_path, content), numbered)
+
+def render_pinned_file(file_path: str, symbol_files: Dict[str, List[str]], outline_files: Set[str], numbered: bool = True) -> str:
+    """Render a pinned file as it is shown to the LLM: by its pinned symbols, as an outline, or in full."""
+    if file_path in symbol_files:
+        return render_symbols(file_path, symbol_files[file_path], numbered)
+    if file_path in outline_files:
+        return render_outline(file_path, numbered)
+    return get_numbered_file_content(file_path) if numbered else get_file_content(file_path)
@@ -1,12 +1,29 @@
 import os
 import json
-from typing import List, Set
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 from platformdirs import user_data_dir
-from .file import is_valid_file, get_all_files_in_directory
+from .file import (is_valid_file, is_ignored_directory, classify_file, format_size, get_max_file_bytes,
+                   get_max_total_bytes, save_verdicts)
+from .ignore import IGNORE_FILES, PINBOARD_IGNORE_FILE, IgnoreMatcher, base_matcher, find_git_root, is_ignored_tree, list_git_files
+from .symbols import SYMBOL_SEPARATOR, get_symbol_pins, is_symbol_item, split_symbol_item
 from .term import add_term, remove_term
+from .trace import record, span
 
 DATA_DIR = user_data_dir("pinboard")
 PINBOARD_FILE = os.path.join(DATA_DIR, "pinboard.json")
+INDEX_FILE = os.path.join(DATA_DIR, "index.json")
+# Suffix of pinned folders whose files are only outlined, unless they are pinned otherwise
+OUTLINE_SUFFIX = "@outline"
+
+# Directories modified this recently are rescanned on every lookup, since a
+# change within the same mtime tick would otherwise go unnoticed.
+RACY_MTIME_NS = 2_000_000_000
+
+_index: Optional[Dict[str, Dict[str, Any]]] = None
+_snapshot: Dict[str, Set[str]] = {}
+# Per snapshot root: the per-file size cap, the sizes of included files and the reasons for excluded files
+_classified: Dict[str, Tuple[int, Dict[str, int], Dict[str, str]]] = {}
 
 def ensure_data_dir():
     os.makedirs(DATA_DIR, exist_ok=True)
@@ -23,6 +40,23 @@ def save_pinned_items(items: List[str]):
     with open(PINBOARD_FILE, 'w') as f:
         json.dump(items, f)
 
+def is_outline_item(item: str) -> bool:
+    return item.endswith(OUTLINE_SUFFIX)
+
+def get_pinned_folder(item: str) -> Optional[str]:
+    """Return the folder of a pinned folder or outlined folder item, or None for other items."""
+    if is_outline_item(item):
+        return item[:-len(OUTLINE_SUFFIX)]
+    return item if os.path.isdir(item) else None
+
+def normalize_item(item: str) -> str:
+    if is_outline_item(item):
+        return os.path.abspath(item[:-len(OUTLINE_SUFFIX)]) + OUTLINE_SUFFIX
+    if is_symbol_item(item):
+        file_path, symbol = split_symbol_item(item)
+        return f"{os.path.abspath(file_path)}{SYMBOL_SEPARATOR}{symbol}"
+    return os.path.abspath(item)
+
 def add_pins(items: List[str]) -> int:
     existing_pins = set(get_pinned_items())
     new_pins = set()
@@ -30,7 +64,7 @@ def add_pins(items: List[str]) -> int:
         if item.endswith("@tmux"):
             new_pins.update(add_term([item[:-5]]))
         else:
-            new_pins.add(os.path.abspath(item))
+            new_pins.add(normalize_item(item))
     updated_pins = list(existing_pins.union(new_pins))
     save_pinned_items(updated_pins)
     return len(updated_pins) - len(existing_pins)
@@ -42,7 +76,7 @@ def remove_pins(items: List[str]) -> int:
         if item.endswith("@tmux"):
             items_to_remove.update(remove_term([item[:-5]]))
         else:
-            items_to_remove.add(os.path.abspath(item))
+            items_to_remove.add(normalize_item(item))
     updated_pins = list(existing_pins - items_to_remove)
     save_pinned_items(updated_pins)
     return len(existing_pins) - len(updated_pins)
@@ -50,13 +84,251 @@ def remove_pins(items: List[str]) -> int:
 def clear_pins():
     save_pinned_items([])
 
+def load_index() -> Dict[str, Dict[str, Any]]:
+    global _index
+    if _index is None:
+        try:
+            with open(INDEX_FILE, 'r') as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+    return _index
+
+def save_index():
+    if _index is None:
+        return
+    ensure_data_dir()
+    tmp_file = f"{INDEX_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(_index, f)
+    os.replace(tmp_file, INDEX_FILE)
+
+def scan_directory(directory: str) -> Set[str]:
+    """
+    List all valid files below a directory that are not ignored. Inside a git work tree
+    the files are listed by git, otherwise only the subdirectories whose mtime or ignore
+    files changed since they were last recorded in the persistent index are rescanned.
+    """
+    start = time.perf_counter()
+    root = os.path.abspath(directory)
+    # git lists nothing below an ignored directory, which can still be pinned explicitly,
+    # as can the folders inside it
+    if find_git_root(root) is not None and not is_ignored_tree(root):
+        git_files = scan_git_directory(root)
+        if git_files is not None:
+            record("index.scan", time.perf_counter() - start, git=True, files=len(git_files))
+            return git_files
+
+    index = load_index()
+    now = time.time_ns()
+    all_files = set()
+    visited = set()
+    rescanned = 0
+    stack = [(root, base_matcher(root))]
+
+    while stack:
+        path, matcher = stack.pop()
+        visited.add(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+
+        entry = index.get(path)
+        if entry is not None and entry["mtime"] == mtime:
+            matcher = matcher.child(path, entry.get("ignore_files", []))
+            if entry.get("ignore") != matcher.signature:
+                entry = None
+        else:
+            entry = None
+
+        if entry is None:
+            files, dirs, ignore_files = [], [], []
+            try:
+                with os.scandir(path) as it:
+                    items = list(it)
+            except OSError:
+                continue
+            ignore_files = [item.name for item in items if item.name in IGNORE_FILES]
+            matcher = matcher.child(path, ignore_files)
+            for item in items:
+                if item.is_dir():
+                    # Like os.walk, symlinked directories are not followed
+                    if not is_ignored_directory(item.name) and not item.is_symlink() and not matcher.is_ignored(item.path, True):
+                        dirs.append(item.name)
+                elif is_valid_file(item.name) and not matcher.is_ignored(item.path, False):
+                    files.append(item.name)
+            entry = {"mtime": mtime if now - mtime > RACY_MTIME_NS else None, "files": files, "dirs": dirs,
+                     "ignore_files": ignore_files, "ignore": matcher.signature}
+            index[path] = entry
+            rescanned += 1
+
+        all_files.update(os.path.join(path, name) for name in entry["files"])
+        stack.extend((os.path.join(path, name), matcher) for name in entry["dirs"])
+
+    prefix = root + os.sep
+    stale = [path for path in index if path.startswith(prefix) and path not in visited]
+    for path in stale:
+        del index[path]
+
+    if rescanned or stale:
+        save_index()
+    record("index.scan", time.perf_counter() - start, directories=len(visited), rescanned=rescanned, files=len(all_files))
+    return all_files
+
+def scan_git_directory(root: str) -> Optional[Set[str]]:
+    """
+    List the valid files below a directory in a git work tree with a single git call,
+    which already leaves out files ignored by .gitignore and .git/info/exclude.
+    Returns None if git cannot list the files.
+    """
+    paths = list_git_files(root)
+    if paths is None:
+        return None
+
+    rule_directories = {os.path.dirname(path) for path in paths if os.path.basename(path) == PINBOARD_IGNORE_FILE}
+    # Matchers for .pinboardignore files by directory, or None for ignored directories
+    matchers: Dict[str, Optional[IgnoreMatcher]] = {root: base_matcher(root, [PINBOARD_IGNORE_FILE])}
+
+    def get_matcher(directory: str) -> Optional[IgnoreMatcher]:
+        if directory not in matchers:
+            parent = get_matcher(os.path.dirname(directory))
+            if parent is None or is_ignored_directory(os.path.basename(directory)) or parent.is_ignored(directory, True):
+                matchers[directory] = None
+            else:
+                matchers[directory] = parent.child(directory, [PINBOARD_IGNORE_FILE] if directory in rule_directories else [])
+        return matchers[directory]
+
+    if root in rule_directories:
+        matchers[root] = matchers[root].child(root, [PINBOARD_IGNORE_FILE])
+    all_files = set()
+    for path in paths:
+        matcher = get_matcher(os.path.dirname(path))
+        if matcher is not None and is_valid_file(os.path.basename(path)) and not matcher.is_ignored(path, False):
+            all_files.add(path)
+    return all_files
+
+def get_directory_listing(directory: str) -> Set[str]:
+    """Return the files below a directory that are not ignored by name, sharing one snapshot per command."""
+    root = os.path.abspath(directory)
+    if root not in _snapshot:
+        _snapshot[root] = scan_directory(root)
+    return _snapshot[root]
+
+def classify_directory(directory: str, max_file_bytes: int) -> Tuple[Dict[str, int], Dict[str, str]]:
+    """Split the files below a directory into the sizes of included files and the reasons for excluded files."""
+    root = os.path.abspath(directory)
+    cached = _classified.get(root)
+    if cached is None or cached[0] != max_file_bytes:
+        included, excluded = {}, {}
+        for file_path in get_directory_listing(root):
+            # Names were already checked while listing the directory
+            size, reason = classify_file(file_path, max_file_bytes, check_name=False)
+            if reason is None:
+                included[file_path] = size
+            else:
+                excluded[file_path] = reason
+        cached = _classified[root] = (max_file_bytes, included, excluded)
+        save_verdicts()
+    return cached[1], cached[2]
+
+def get_directory_files(directory: str) -> Set[str]:
+    """Return the files below a directory that can be pinned."""
+    return set(classify_directory(directory, get_max_file_bytes())[0])
+
+def invalidate_index(paths: Optional[Iterable[str]] = None):
+    """
+    Drop the in-memory snapshot so the next lookup revalidates against the disk.
+    If changed paths are given, only directories containing a changed listing are dropped,
+    and only the roots containing a changed file are classified again.
+    """
+    if paths is None:
+        _snapshot.clear()
+        _classified.clear()
+        return
+    paths = list(paths)
+    index = load_index()
+    # A changed ignore file changes the listing of its directory as well
+    directories = [path for path in paths if path in index or os.path.isdir(path) or os.path.basename(path) in IGNORE_FILES]
+    for root in list(_snapshot):
+        if any(path == root or path.startswith(root + os.sep) for path in directories):
+            del _snapshot[root]
+    for root in list(_classified):
+        if root not in _snapshot or any(path.startswith(root + os.sep) for path in paths):
+            del _classified[root]
+
+def classify_pinned_files(pinned_items: List[str]) -> Tuple[Set[str], Dict[str, str]]:
+    """
+    Return the pinned files to include and the reason each other file is excluded.
+
+    Files are excluded by name, content or size. Once the total size cap is reached,
+    explicitly pinned files are kept before the files of pinned folders, in path order.
+    """
+    with span("pin.unique_files") as s:
+        max_file_bytes = get_max_file_bytes()
+        explicit: Dict[str, int] = {}
+        from_directories: Dict[str, int] = {}
+        excluded: Dict[str, str] = {}
+        for item in pinned_items:
+            if is_symbol_item(item):
+                # Files with pinned symbols are included like explicitly pinned files
+                item = split_symbol_item(item)[0]
+            elif is_outline_item(item):
+                item = get_pinned_folder(item)
+            if item.endswith("@tmux"):
+                continue
+            elif os.path.isfile(item):
+                size, reason = classify_file(item, max_file_bytes)
+                if reason is None:
+                    explicit[os.path.abspath(item)] = size
+                else:
+                    excluded[os.path.abspath(item)] = reason
+            elif os.path.isdir(item):
+                included, rejected = classify_directory(item, max_file_bytes)
+                from_directories.update(included)
+                excluded.update(rejected)
+        save_verdicts()
+
+        max_total_bytes = get_max_total_bytes()
+        unique_files = set()
+        total = 0
+        for file_path, size in [*sorted(explicit.items()), *sorted(from_directories.items())]:
+            if file_path in unique_files:
+                continue
+            if max_total_bytes and total + size > max_total_bytes:
+                excluded[file_path] = f"over the total size cap of {format_size(max_total_bytes)}"
+                continue
+            unique_files.add(file_path)
+            total += size
+        s["files"] = len(unique_files)
+        s["bytes"] = total
+    return unique_files, excluded
+
 def get_unique_files(pinned_items: List[str]) -> Set[str]:
-    unique_files = set()
+    return classify_pinned_files(pinned_items)[0]
+
+def get_excluded_files(pinned_items: List[str]) -> Dict[str, str]:
+    return classify_pinned_files(pinned_items)[1]
+
+def get_whole_files(pinned_items: List[str], unique_files: Set[str]) -> Set[str]:
+    """Return the included files that are pinned as a whole, explicitly or as part of a folder."""
+    max_file_bytes = get_max_file_bytes()
+    whole_files = {item for item in pinned_items if item in unique_files}
     for item in pinned_items:
-        if item.endswith("@tmux"):
-            continue
-        elif os.path.isfile(item) and is_valid_file(item):
-            unique_files.add(os.path.abspath(item))
-        elif os.path.isdir(item):
-            unique_files.update(get_all_files_in_directory(item))
-    return unique_files
\ No newline at end of file
+        if os.path.isdir(item):
+            whole_files.update(file_path for file_path in classify_directory(item, max_file_bytes)[0] if file_path in unique_files)
+    return whole_files
+
+def get_symbol_files(pinned_items: List[str]) -> Dict[str, List[str]]:
+    """Return the pinned symbols by file, for the included files that are not pinned as a whole."""
+    unique_files = get_unique_files(pinned_items)
+    whole_files = get_whole_files(pinned_items, unique_files)
+    return {file_path: symbols for file_path, symbols in get_symbol_pins(pinned_items).items()
+            if file_path in unique_files and file_path not in whole_files}
+
+def get_outline_files(pinned_items: List[str]) -> Set[str]:
+    """Return the included files that are only pinned as part of an outlined folder."""
+    if not any(is_outline_item(item) for item in pinned_items):
+        return set()
+    unique_files = get_unique_files(pinned_items)
+    return unique_files - get_whole_files(pinned_items, unique_files) - set(get_symbol_pins(pinned_items))
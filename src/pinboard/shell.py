@@ -1,40 +1,165 @@
+import os
+import selectors
+import signal
 import subprocess
-import shlex
-from typing import Tuple
+import sys
+import threading
+import time
+from collections import deque
+from typing import NamedTuple, Optional
+from .trace import record
 
-def run_command(command: str, tail: int = 20) -> Tuple[int, str]:
+READ_SIZE = 65536
+# Longest line kept in the output tail, longer lines keep only their end
+MAX_LINE_BYTES = 65536
+# Time granted to a process group to exit after SIGTERM before it is killed
+KILL_GRACE_PERIOD = 2.0
+# How often a terminated process group is checked for whether it exited
+KILL_POLL_INTERVAL = 0.05
+# How often a cancellable command checks whether it was cancelled
+CANCEL_POLL_INTERVAL = 0.1
+
+class CommandResult(NamedTuple):
+    exit_code: int
+    output: str
+    duration: float = 0.0
+    bytes_seen: int = 0
+    truncated: bool = False
+    timed_out: Optional[str] = None
+
+def run_command(command: str, tail: int = 20, tee: bool = False,
+                timeout: Optional[float] = None, idle_timeout: Optional[float] = None,
+                cwd: Optional[str] = None, cancel: Optional[threading.Event] = None) -> CommandResult:
     """
     Run a shell command and return its exit code and last N lines of output.
-    
+
+    Only the last N lines are ever held in memory, so commands with very large
+    output run in bounded memory. If the command runs longer than the timeout or
+    produces no output for longer than the idle timeout, its whole process group
+    is terminated.
+
     Args:
         command (str): The shell command to run.
         tail (int): Number of last lines to capture from the output.
-    
+        tee (bool): Also write the output to the terminal as it is produced.
+        timeout (float): Maximum wall-clock time in seconds, or None for no limit.
+        idle_timeout (float): Maximum time in seconds without any output, or None for no limit.
+        cwd (str): Directory to run the command in, or None for the current directory.
+        cancel (threading.Event): Terminate the command as soon as this event is set.
+
     Returns:
-        Tuple[int, str]: The exit code and the last N lines of output.
+        CommandResult: The exit code, the last N lines of output, the duration in seconds,
+        the number of output bytes seen, whether output was left out of the tail, and
+        "timeout", "idle" or "cancelled" if the command was terminated.
     """
+    start = time.monotonic()
     try:
         process = subprocess.Popen(
             command,
             shell=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
+            start_new_session=True,
+            cwd=cwd
         )
-        
-        output_lines = []
-        for line in process.stdout:
-            output_lines.append(line)
-        
-        process.wait()
-        exit_code = process.returncode
-        
-        # Get the last N lines of output
-        last_n_lines = ''.join(output_lines[-tail:])
-        
-        return exit_code, last_n_lines
-    
     except Exception as e:
-        return 1, f"Error running command: {str(e)}"
\ No newline at end of file
+        return CommandResult(1, f"Error running command: {str(e)}")
+
+    lines = deque(maxlen=max(tail, 1))
+    partial = b""
+    bytes_seen = 0
+    line_count = 0
+    truncated = False
+    timed_out = None
+    last_output = start
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ)
+        while True:
+            now = time.monotonic()
+            waits = []
+            if timeout is not None:
+                waits.append(start + timeout - now)
+            if idle_timeout is not None:
+                waits.append(last_output + idle_timeout - now)
+            if waits and min(waits) <= 0:
+                timed_out = "timeout" if timeout is not None and now - start >= timeout else "idle"
+                break
+            if cancel is not None:
+                if cancel.is_set():
+                    timed_out = "cancelled"
+                    break
+                waits.append(CANCEL_POLL_INTERVAL)
+
+            if not selector.select(min(waits) if waits else None):
+                continue
+            chunk = os.read(process.stdout.fileno(), READ_SIZE)
+            if not chunk:
+                break
+
+            last_output = time.monotonic()
+            bytes_seen += len(chunk)
+            if tee:
+                sys.stdout.buffer.write(chunk)
+                sys.stdout.flush()
+
+            data = partial + chunk
+            newlines = data.count(b"\n")
+            if newlines:
+                end = data.rindex(b"\n")
+                # Only the lines that can still end up in the tail are split off
+                for line in data[:end].rsplit(b"\n", lines.maxlen)[-min(newlines, lines.maxlen):]:
+                    truncated = truncated or len(line) > MAX_LINE_BYTES
+                    lines.append(line[-MAX_LINE_BYTES:])
+                line_count += newlines
+                partial = data[end + 1:]
+            else:
+                partial = data
+            if len(partial) > MAX_LINE_BYTES:
+                partial = partial[-MAX_LINE_BYTES:]
+                truncated = True
+
+    process.stdout.close()
+    if not timed_out:
+        try:
+            # The command may close its output before it exits
+            remaining = start + timeout - time.monotonic() if timeout is not None else None
+            process.wait(max(remaining, 0) if remaining is not None else None)
+        except subprocess.TimeoutExpired:
+            timed_out = "timeout"
+    if timed_out:
+        _kill_process_group(process)
+    exit_code = process.wait()
+
+    if partial:
+        lines.append(partial)
+        line_count += 1
+    truncated = truncated or line_count > tail
+    output = b"\n".join(list(lines)[-tail:] if tail > 0 else []).decode("utf-8", errors="replace")
+    if output and not partial:
+        output += "\n"
+
+    duration = time.monotonic() - start
+    record("shell.run", duration, bytes=bytes_seen, exit_code=exit_code, timed_out=timed_out)
+    return CommandResult(exit_code, output, duration, bytes_seen, truncated, timed_out)
+
+def _kill_process_group(process: subprocess.Popen):
+    """Terminate the process group of a command, and kill whatever is left of it after the grace period."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    # The shell may exit right away while its children ignore SIGTERM, so the
+    # whole group is waited for, not just the shell
+    deadline = time.monotonic() + KILL_GRACE_PERIOD
+    while time.monotonic() < deadline:
+        process.poll()
+        try:
+            os.killpg(process.pid, 0)
+        except ProcessLookupError:
+            return
+        time.sleep(KILL_POLL_INTERVAL)
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
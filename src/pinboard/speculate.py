@@ -0,0 +1,120 @@
+import os
+import shutil
+import stat
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple
+from .file import remove_file, stage_file
+from .ignore import list_git_files, walk
+from .pin import DATA_DIR, ensure_data_dir, get_pinned_items, get_unique_files
+from .shell import run_command, CommandResult
+
+CANDIDATES_DIR = os.path.join(DATA_DIR, "candidates")
+# Tool caches that every candidate gets its own copy of, since concurrent runs would write them at once
+CACHE_DIRECTORIES = {".pytest_cache", ".mypy_cache", ".ruff_cache", ".hypothesis", ".tox", ".nox"}
+# Installed dependencies, which are too large to copy on every iteration and are shared through a symlink
+DEPENDENCY_DIRECTORIES = {"node_modules", ".venv", "venv"}
+# ioctl request that clones a file copy-on-write on Linux (btrfs, xfs)
+FICLONE = 0x40049409
+
+def is_within(path: str, root: str) -> bool:
+    return os.path.abspath(path).startswith(os.path.abspath(root) + os.sep)
+
+def get_workspace_files(root: str) -> List[str]:
+    """
+    List the files a candidate workspace is made of: the files git tracks or would track
+    below root, or those not ignored by an ignore file outside of git, and the pinned files.
+    """
+    files = list_git_files(root)
+    if files is None:
+        files = [os.path.join(current, name) for current, _, names in walk(root) for name in names]
+    files.extend(get_unique_files(get_pinned_items()))
+    skipped = CACHE_DIRECTORIES | DEPENDENCY_DIRECTORIES | {"__pycache__", ".git"}
+    return sorted(file_path for file_path in set(files) if is_within(file_path, root)
+                  and not skipped.intersection(os.path.relpath(file_path, root).split(os.sep)[:-1]))
+
+def clone_file(source: str, destination: str):
+    """Copy a file, sharing its blocks copy-on-write where the file system supports it."""
+    try:
+        import fcntl
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(source, destination)
+    except (ImportError, OSError):
+        shutil.copy2(source, destination)
+
+def mirror_file(source: str, destination: str):
+    """
+    Copy a file into a workspace. Read-only files are hardlinked, since a command cannot
+    change them in place without changing their permissions first.
+    """
+    if os.path.islink(source):
+        os.symlink(os.readlink(source), destination)
+        return
+    if not os.stat(source).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH):
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            pass
+    clone_file(source, destination)
+
+def create_workspace(root: str, files: Iterable[str], updated_contents: Dict[str, Optional[str]]) -> str:
+    """
+    Create an isolated copy of the given files below root, with the given files replaced or removed.
+
+    Tool caches at the top of root are copied as well, and dependency directories are
+    symlinked. Everything else, including .git, is left out.
+    """
+    ensure_data_dir()
+    os.makedirs(CANDIDATES_DIR, exist_ok=True)
+    workspace = tempfile.mkdtemp(prefix="candidate-", dir=CANDIDATES_DIR)
+    for file_path in files:
+        target = os.path.join(workspace, os.path.relpath(file_path, root))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            mirror_file(file_path, target)
+        except FileNotFoundError:
+            # Deleted since it was listed
+            continue
+    for name in os.listdir(root):
+        source = os.path.join(root, name)
+        if name in CACHE_DIRECTORIES and os.path.isdir(source) and not os.path.islink(source):
+            shutil.copytree(source, os.path.join(workspace, name), symlinks=True, copy_function=clone_file)
+        elif name in DEPENDENCY_DIRECTORIES and os.path.isdir(source):
+            os.symlink(source, os.path.join(workspace, name))
+
+    for file_path, content in updated_contents.items():
+        target = os.path.join(workspace, os.path.relpath(file_path, root))
+        if content is None:
+            remove_file(target)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(stage_file(target, content), target)
+    return workspace
+
+def remove_workspace(workspace: str):
+    shutil.rmtree(workspace, ignore_errors=True)
+
+def run_candidates(command: str, workspaces: List[str], tail: int = 20, timeout: Optional[float] = None,
+                   idle_timeout: Optional[float] = None) -> Tuple[Optional[int], List[Optional[CommandResult]]]:
+    """
+    Run a command in every workspace concurrently. As soon as one run succeeds, all
+    other runs are cancelled. Returns the index of the successful workspace, or None,
+    and the result of every run.
+    """
+    cancel = threading.Event()
+    results: List[Optional[CommandResult]] = [None] * len(workspaces)
+    winner = None
+    with ThreadPoolExecutor(max_workers=len(workspaces)) as executor:
+        futures = {executor.submit(run_command, command, tail, timeout=timeout, idle_timeout=idle_timeout,
+                                   cwd=workspace, cancel=cancel): i
+                   for i, workspace in enumerate(workspaces)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if winner is None and results[i].exit_code == 0:
+                winner = i
+                cancel.set()
+    return winner, results
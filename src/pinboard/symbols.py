@@ -0,0 +1,172 @@
+import ast
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Separates the file path from the symbol in pinned items like path.py::Class.method
+SYMBOL_SEPARATOR = "::"
+# Marks the lines left out between the pinned parts of a file
+GAP_MARKER = "..."
+
+Span = Tuple[int, int]
+
+class SymbolResolver(ABC):
+    """Find the line spans of the symbols defined in a file of one language."""
+
+    @abstractmethod
+    def index(self, content: str) -> Dict[str, Span]:
+        """Return the 1-based, inclusive line span of every symbol by its qualified name."""
+
+    def outline(self, content: str) -> List[Span]:
+        """Return the spans of the signatures and docstrings that outline a file."""
+        return []
+
+class PythonResolver(SymbolResolver):
+    """
+    Classes, functions and module or class level assignments, including their decorators.
+    Outlines consist of the module docstring and the headers and docstrings of classes and functions.
+    """
+
+    def index(self, content: str) -> Dict[str, Span]:
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            return {}
+        spans: Dict[str, Span] = {}
+        self.add_definitions(tree.body, "", spans)
+        return spans
+
+    def outline(self, content: str) -> List[Span]:
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            return []
+        spans: List[Span] = []
+        docstring = self.get_docstring(tree.body)
+        if docstring is not None:
+            spans.append((docstring.lineno, docstring.end_lineno))
+        self.add_outline(tree.body, content.split("\n"), spans)
+        return spans
+
+    def get_docstring(self, body: List[ast.stmt]) -> Optional[ast.stmt]:
+        if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+            return body[0]
+        return None
+
+    def add_outline(self, body: List[ast.stmt], lines: List[str], spans: List[Span]):
+        for node in body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+                docstring = self.get_docstring(node.body)
+                if docstring is not None:
+                    end = docstring.end_lineno
+                else:
+                    # The header may span several lines and ends before the first statement,
+                    # not counting the blank lines and comments in between
+                    first = node.body[0]
+                    end = max(node.lineno, min([first.lineno] + [d.lineno for d in getattr(first, "decorator_list", [])]) - 1)
+                    while end > node.lineno and (not lines[end - 1].strip() or lines[end - 1].lstrip().startswith("#")):
+                        end -= 1
+                spans.append((start, end))
+                if isinstance(node, ast.ClassDef):
+                    self.add_outline(node.body, lines, spans)
+
+    def add_definitions(self, body: List[ast.stmt], prefix: str, spans: Dict[str, Span]):
+        for node in body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+                spans[prefix + node.name] = (start, node.end_lineno)
+                if isinstance(node, ast.ClassDef):
+                    self.add_definitions(node.body, f"{prefix}{node.name}.", spans)
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    if isinstance(target, ast.Name):
+                        spans.setdefault(prefix + target.id, (node.lineno, node.end_lineno))
+
+_resolvers: Dict[str, SymbolResolver] = {}
+# Symbol spans by path, with the mtime and size they were resolved for
+_indexes: Dict[str, Tuple[Tuple[int, int], Dict[str, Span]]] = {}
+
+def register_resolver(extensions: Iterable[str], resolver: SymbolResolver):
+    for extension in extensions:
+        _resolvers[extension.lower()] = resolver
+
+register_resolver([".py", ".pyi"], PythonResolver())
+
+def is_symbol_item(item: str) -> bool:
+    return SYMBOL_SEPARATOR in item and not item.endswith("@tmux")
+
+def split_symbol_item(item: str) -> Tuple[str, str]:
+    file_path, _, symbol = item.partition(SYMBOL_SEPARATOR)
+    return file_path, symbol
+
+def get_resolver(file_path: str) -> Optional[SymbolResolver]:
+    return _resolvers.get(os.path.splitext(file_path)[1].lower())
+
+def get_symbol_index(file_path: str) -> Dict[str, Span]:
+    """Return the symbol spans of a file, resolved again only when its mtime or size changes."""
+    resolver = get_resolver(file_path)
+    if resolver is None:
+        return {}
+    stat = os.stat(file_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _indexes.get(file_path)
+    if cached is None or cached[0] != version:
+        with open(file_path, "r") as f:
+            cached = _indexes[file_path] = (version, resolver.index(f.read()))
+    return cached[1]
+
+def get_symbol_span(file_path: str, symbol: str) -> Optional[Span]:
+    try:
+        return get_symbol_index(file_path).get(symbol)
+    except (OSError, UnicodeDecodeError):
+        return None
+
+def get_symbol_pins(pinned_items: Iterable[str]) -> Dict[str, List[str]]:
+    """Return the pinned symbols by file."""
+    symbols: Dict[str, List[str]] = {}
+    for item in pinned_items:
+        if is_symbol_item(item):
+            file_path, symbol = split_symbol_item(item)
+            symbols.setdefault(file_path, []).append(symbol)
+    return symbols
+
+def merge_spans(spans: Iterable[Span]) -> List[Span]:
+    merged: List[Span] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def render_spans(lines: List[str], spans: Iterable[Span], numbered: bool = True) -> str:
+    """
+    Render only the given spans of lines, numbered as in the whole file, with a gap
+    marker wherever lines are left out.
+    """
+    rendered = []
+    for start, end in merge_spans(spans):
+        if start > 1 and not (rendered and rendered[-1] == f"{GAP_MARKER}\n"):
+            rendered.append(f"{GAP_MARKER}\n")
+        for number in range(start, min(end, len(lines)) + 1):
+            line = lines[number - 1]
+            rendered.append(f"{number}: {line}" if numbered else line)
+        if end < len(lines):
+            rendered.append(f"{GAP_MARKER}\n")
+    if not rendered and lines:
+        rendered.append(f"{GAP_MARKER}\n")
+    return "".join(rendered)
+
+def render_symbols(file_path: str, symbols: Iterable[str], numbered: bool = True) -> str:
+    """
+    Render only the lines of the given symbols. If a symbol cannot be resolved
+    anymore, the whole file is rendered instead.
+    """
+    with open(file_path, "r") as f:
+        lines = f.readlines()
+    spans = [get_symbol_span(file_path, symbol) for symbol in symbols]
+    if any(span is None for span in spans):
+        spans = [(1, len(lines))]
+    return render_spans(lines, spans, numbered)
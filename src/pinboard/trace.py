@@ -0,0 +1,130 @@
+import atexit
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from platformdirs import user_data_dir
+
+# Same directory as pin.DATA_DIR, which cannot be imported here since pin.py is traced itself
+TRACE_FILE = os.path.join(user_data_dir("pinboard"), "trace.jsonl")
+# The trace log is rotated into a single backup once it grows past this size
+MAX_TRACE_BYTES = 4 * 1024 * 1024
+PROFILE_ENV = "PINBOARD_PROFILE"
+
+_profile = False
+_command: Optional[str] = None
+_run: Optional[str] = None
+_spans: List[Dict[str, Any]] = []
+
+def set_profiling(enabled: bool):
+    global _profile
+    _profile = enabled
+
+def set_command(command: Optional[str]):
+    global _command
+    _command = command
+
+def is_enabled() -> bool:
+    # The environment is checked on every span, since the daemon swaps it per command
+    return _profile or os.environ.get(PROFILE_ENV, "") not in ("", "0")
+
+class span:
+    """
+    Time a block of code as a named span when profiling is enabled.
+
+    Counts such as bytes, files or tokens can be attached by setting keys on the
+    span while it is open, e.g. `with span("read_files") as s: s["files"] = 3`.
+    """
+
+    __slots__ = ("name", "fields", "start")
+
+    def __init__(self, name: str, **fields: Any):
+        self.name = name
+        self.fields = fields
+
+    def __setitem__(self, key: str, value: Any):
+        self.fields[key] = value
+
+    def __enter__(self) -> "span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if is_enabled():
+            if exc_type is not None:
+                self.fields["error"] = exc_type.__name__
+            record(self.name, time.perf_counter() - self.start, **self.fields)
+        return False
+
+def record(name: str, duration: float, **fields: Any):
+    """Record a span that was timed by the caller."""
+    global _run
+    if not is_enabled():
+        return
+    if _run is None:
+        _run = f"{os.getpid()}-{time.time():.6f}"
+    _spans.append({"run": _run, "command": _command, "span": name, "time": time.time(),
+                   "duration": duration, **fields})
+
+def flush():
+    """Append the recorded spans to the trace log. The next span starts a new run."""
+    global _run
+    spans = _spans[:]
+    _spans.clear()
+    _run = None
+    if not spans:
+        return
+
+    os.makedirs(os.path.dirname(TRACE_FILE), exist_ok=True)
+    try:
+        if os.path.getsize(TRACE_FILE) > MAX_TRACE_BYTES:
+            os.replace(TRACE_FILE, f"{TRACE_FILE}.1")
+    except OSError:
+        pass
+    with open(TRACE_FILE, "a") as f:
+        f.write("".join(json.dumps(s) + "\n" for s in spans))
+
+atexit.register(flush)
+
+def load_spans(runs: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Load the spans of the most recent runs from the trace log and its backup."""
+    spans = []
+    for file_path in (f"{TRACE_FILE}.1", TRACE_FILE):
+        try:
+            with open(file_path, "r") as f:
+                for line in f:
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        # A line may have been cut short by a crash
+                        continue
+        except OSError:
+            continue
+    if runs is not None:
+        recent = set(list(dict.fromkeys(s["run"] for s in spans))[-runs:])
+        spans = [s for s in spans if s["run"] in recent]
+    return spans
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+def summarize(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Group spans by name and model, with duration percentiles and mean token counts."""
+    groups = defaultdict(list)
+    for s in spans:
+        groups[(s["span"], s.get("model"))].append(s)
+
+    summary = []
+    for (name, model), group in sorted(groups.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+        durations = [s["duration"] for s in group]
+        row = {"span": name, "model": model, "count": len(group),
+               "p50": percentile(durations, 0.5), "p90": percentile(durations, 0.9),
+               "p99": percentile(durations, 0.99), "max": max(durations)}
+        for key in ("bytes", "input_tokens", "output_tokens", "cache_read_input_tokens", "time_to_first_token"):
+            values = [s[key] for s in group if s.get(key) is not None]
+            if values:
+                row[key] = sum(values) / len(values)
+        summary.append(row)
+    return summary
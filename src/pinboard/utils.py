@@ -1,10 +1,16 @@
-import pyclip
 import re
 import os
-from typing import List, Dict, Union
-from .pin import get_pinned_items, get_unique_files
+import difflib
+from typing import Iterable, List, Dict, Optional, Sequence, Tuple, Union
+from .pin import get_pinned_items, get_pinned_folder, get_unique_files
+from .lines import LARGE_FILE_BYTES, LineIndex
+
+_numbered_contents: Dict[str, Tuple[Tuple[int, int], str]] = {}
+# Set while a watcher reports every change to pinned files, so cached contents are used without a stat
+_trust_cached_contents = False
 
 def get_clipboard_content():
+    import pyclip
     return pyclip.paste().decode('utf-8')
 
 def get_file_content(file_path: str) -> str:
@@ -12,41 +18,211 @@ def get_file_content(file_path: str) -> str:
         return f.read()
 
 def get_numbered_file_content(file_path: str) -> str:
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
-    return ''.join(f"{i+1}: {line}" for i, line in enumerate(lines))
+    # Cached by mtime and size, which mostly pays off in long-running processes
+    if _trust_cached_contents and file_path in _numbered_contents:
+        return _numbered_contents[file_path][1]
+    stat = os.stat(file_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _numbered_contents.get(file_path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
 
-def parse_llm_response(response: str) -> Dict[str, Union[str, List[Dict[str, Union[str, int]]]]]:
-    artifact_edit_pattern = r'<artifactEdit identifier="([^"]+)" from="(\d+)" to="(\d+)">(.*?)</artifactEdit>'
-    new_file_pattern = r'<artifactEdit identifier="([^"]+)">(.*?)</artifactEdit>'
-    
-    pinned_items = get_pinned_items()
-    pinned_files = get_unique_files(pinned_items)
-    pinned_folders = [item for item in pinned_items if os.path.isdir(item)]
-    
-    artifact_edits = {}
-    for identifier, from_line, to_line, content in re.findall(artifact_edit_pattern, response, re.DOTALL):
-        if identifier in pinned_files or any(identifier.startswith(folder) for folder in pinned_folders):
-            if identifier not in artifact_edits:
-                artifact_edits[identifier] = []
-            artifact_edits[identifier].append({
+    if stat.st_size >= LARGE_FILE_BYTES:
+        # Rendered from a line index, without holding every line as a string
+        with LineIndex(file_path) as index:
+            numbered_content = index.render_numbered()
+    else:
+        with open(file_path, 'r') as f:
+            lines = f.readlines()
+        numbered_content = ''.join(f"{i+1}: {line}" for i, line in enumerate(lines))
+    _numbered_contents[file_path] = (version, numbered_content)
+    return numbered_content
+
+def invalidate_file_contents(paths: Optional[Iterable[str]] = None):
+    """Drop cached contents of the given files and of files below the given folders, or all of them."""
+    if paths is None:
+        _numbered_contents.clear()
+        return
+    paths = set(paths)
+    prefixes = tuple(path + os.sep for path in paths)
+    for file_path in [p for p in _numbered_contents if p in paths or p.startswith(prefixes)]:
+        del _numbered_contents[file_path]
+
+def trust_cached_contents(trusted: bool):
+    global _trust_cached_contents
+    _trust_cached_contents = trusted
+
+ARTIFACT_EDIT_PATTERN = re.compile(r'<artifactEdit identifier="([^"]+)" from="(\d+)" to="(\d+)">(.*?)</artifactEdit>', re.DOTALL)
+REPLACE_EDIT_PATTERN = re.compile(r'<artifactEdit identifier="([^"]+)" mode="replace">\s*<search>(.*?)</search>\s*<replace>(.*?)</replace>\s*</artifactEdit>', re.DOTALL)
+NEW_FILE_PATTERN = re.compile(r'<artifactEdit identifier="([^"]+)">(.*?)</artifactEdit>', re.DOTALL)
+ARTIFACT_REQUEST_PATTERN = re.compile(r'<artifactRequest identifier="([^"]+)"\s*/?>')
+
+def parse_artifact_requests(text: str) -> List[str]:
+    """Return the identifiers of the artifacts whose full content is requested in a response."""
+    return ARTIFACT_REQUEST_PATTERN.findall(text)
+
+class ArtifactEditParser:
+    """
+    Incrementally extract <artifactEdit> blocks from a response as it streams in.
+
+    Each call to feed() returns the identifiers whose edits were completed by the
+    new text, so callers can validate or apply a file as soon as its closing tag
+    arrives. Only edits to pinned files or files within pinned folders are kept.
+    """
+
+    def __init__(self):
+        pinned_items = get_pinned_items()
+        self.pinned_files = get_unique_files(pinned_items)
+        self.pinned_folders = [folder for folder in map(get_pinned_folder, pinned_items) if folder is not None]
+        self.edited_files: Dict[str, Union[str, List[Dict[str, Union[str, int]]]]] = {}
+        self.buffer = ""
+        self.position = 0
+
+    def is_editable(self, identifier: str) -> bool:
+        return identifier in self.pinned_files or any(identifier.startswith(folder) for folder in self.pinned_folders)
+
+    def feed(self, text: str) -> List[str]:
+        self.buffer += text
+        completed = []
+        while True:
+            start = self.buffer.find("<artifactEdit", self.position)
+            if start == -1:
+                break
+            end = self.buffer.find("</artifactEdit>", start)
+            if end == -1:
+                break
+            self.position = end + len("</artifactEdit>")
+            identifier = self._add_block(self.buffer[start:self.position])
+            if identifier is not None:
+                completed.append(identifier)
+        return completed
+
+    def _add_block(self, block: str) -> Optional[str]:
+        match = ARTIFACT_EDIT_PATTERN.fullmatch(block)
+        if match:
+            identifier, from_line, to_line, content = match.groups()
+            if not self.is_editable(identifier) or isinstance(self.edited_files.get(identifier), str):
+                return None
+            self.edited_files.setdefault(identifier, []).append({
                 'from': int(from_line),
                 'to': int(to_line),
                 'content': content.strip("\n")
             })
-    
-    new_files = {}
-    for identifier, content in re.findall(new_file_pattern, response, re.DOTALL):
-        if identifier in pinned_files or any(identifier.startswith(folder) for folder in pinned_folders):
-            new_files[identifier] = content.strip()
-    
-    return {**artifact_edits, **new_files}
+            return identifier
+
+        match = REPLACE_EDIT_PATTERN.fullmatch(block)
+        if match:
+            identifier, search, replace = match.groups()
+            if not self.is_editable(identifier) or isinstance(self.edited_files.get(identifier), str):
+                return None
+            self.edited_files.setdefault(identifier, []).append({
+                'search': search.strip("\n"),
+                'replace': replace.strip("\n")
+            })
+            return identifier
+
+        match = NEW_FILE_PATTERN.fullmatch(block)
+        if match:
+            identifier, content = match.groups()
+            if not self.is_editable(identifier):
+                return None
+            self.edited_files[identifier] = content.strip()
+            return identifier
+        return None
+
+def parse_llm_response(response: str) -> Dict[str, Union[str, List[Dict[str, Union[str, int]]]]]:
+    parser = ArtifactEditParser()
+    parser.feed(response)
+    return parser.edited_files
+
+# Minimum similarity for a search block to match lines that differ from it
+FUZZY_MATCH_RATIO = 0.8
+
+class EditError(ValueError):
+    """Raised when artifact edits cannot be applied to a file."""
+
+def find_lines(lines: Sequence[str], search_lines: List[str]) -> int:
+    """
+    Find the index of the unique run of lines matching a search block. Exact matches are
+    preferred over matches that ignore surrounding whitespace, which are preferred over
+    fuzzy matches of at least FUZZY_MATCH_RATIO similarity.
+    """
+    count = len(search_lines)
+    if count == 0 or not any(line.strip() for line in search_lines):
+        raise EditError("The search block of a replace edit is empty.")
+    starts = range(len(lines) - count + 1)
+
+    for normalize in (lambda line: line, lambda line: line.strip()):
+        target = [normalize(line) for line in search_lines]
+        matches = [i for i in starts if normalize(lines[i]) == target[0]
+                   and [normalize(line) for line in lines[i:i + count]] == target]
+        if len(matches) == 1:
+            return matches[0]
+        if len(matches) > 1:
+            raise EditError(f"The search block matches {len(matches)} places (lines {', '.join(str(i + 1) for i in matches)}).")
+
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2("\n".join(line.strip() for line in search_lines))
+    best_ratio, best = FUZZY_MATCH_RATIO, []
+    for i in starts:
+        matcher.set_seq1("\n".join(line.strip() for line in lines[i:i + count]))
+        if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+            continue
+        ratio = matcher.ratio()
+        if ratio > best_ratio:
+            best_ratio, best = ratio, [i]
+        elif ratio == best_ratio:
+            best.append(i)
+    if len(best) == 1:
+        return best[0]
+    if best:
+        raise EditError(f"The search block matches {len(best)} places equally well.")
+    raise EditError("The search block does not match any lines of the file.")
+
+def locate_edit(lines: Sequence[str], edit: Dict[str, Union[str, int]]) -> Tuple[int, int]:
+    """Return the inclusive, 1-based line range an edit replaces. An empty range (to = from - 1) inserts."""
+    if "search" in edit:
+        start = find_lines(lines, edit["search"].split("\n"))
+        return start + 1, start + edit["search"].count("\n") + 1
+
+    from_line, to_line = edit["from"], edit["to"]
+    if from_line < 1 or to_line > len(lines) or from_line > to_line + 1:
+        raise EditError(f"Lines {from_line}-{to_line} are out of range for a file with {len(lines)} lines.")
+    return from_line, to_line
+
+def resolve_edits(lines: Sequence[str], edits: List[Dict[str, Union[str, int]]]) -> List[Tuple[int, int, List[str]]]:
+    """
+    Turn edits into sorted, non-overlapping (start, end, new lines) spans over the
+    0-based, end-exclusive line positions of the original file. Duplicate edits are
+    merged, overlapping ones are rejected.
+    """
+    spans = []
+    for edit in edits:
+        from_line, to_line = locate_edit(lines, edit)
+        content = edit["replace"] if "search" in edit else edit["content"]
+        spans.append((from_line - 1, to_line, content.split("\n") if content else []))
+    spans.sort(key=lambda span: (span[0], span[1]))
+
+    merged: List[Tuple[int, int, List[str]]] = []
+    for span in spans:
+        if merged and span == merged[-1]:
+            continue
+        if merged and span[0] < merged[-1][1]:
+            raise EditError(f"Edits to lines {merged[-1][0] + 1}-{merged[-1][1]} and {span[0] + 1}-{span[1]} overlap.")
+        merged.append(span)
+    return merged
 
 def apply_edits(file_content: str, edits: List[Dict[str, Union[str, int]]]) -> str:
+    """
+    Apply range and search/replace edits in a single pass over the file. All edits
+    refer to the file as it was before any of them, so their order does not matter.
+    """
     lines = file_content.split('\n')
-    for edit in sorted(edits, key=lambda x: x['from'], reverse=True):
-        from_line = edit['from'] - 1
-        to_line = edit['to']
-        new_content = edit['content'].split('\n')
-        lines[from_line:to_line] = new_content
-    return '\n'.join(lines)
\ No newline at end of file
+    result: List[str] = []
+    position = 0
+    for start, end, new_lines in resolve_edits(lines, edits):
+        result.extend(lines[position:start])
+        result.extend(new_lines)
+        position = end
+    result.extend(lines[position:])
+    return '\n'.join(result)
@@ -0,0 +1,240 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from .file import is_ignored_directory
+from .ignore import is_ignored_path, walk
+from .pin import get_pinned_folder, get_pinned_items, invalidate_index
+from .symbols import split_symbol_item
+from .utils import invalidate_file_contents, trust_cached_contents
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII")
+
+def get_item_path(item: str) -> Optional[str]:
+    """Return the folder or file a pinned item refers to, or None for tmux sessions."""
+    if item.endswith("@tmux"):
+        return None
+    folder = get_pinned_folder(item)
+    return os.path.abspath(folder if folder is not None else split_symbol_item(item)[0])
+
+def get_watch_roots(pinned_items: Iterable[str]) -> Tuple[List[str], List[str]]:
+    """Split pinned items into the directories and the individual files to watch."""
+    directories, files = [], []
+    for item in pinned_items:
+        path = get_item_path(item)
+        if path is None:
+            continue
+        elif get_pinned_folder(item) is not None:
+            directories.append(path)
+        else:
+            files.append(path)
+    return directories, files
+
+def iter_directories(root: str):
+    yield root
+    for current, dirs, _ in walk(root):
+        dirs[:] = [d for d in dirs if not is_ignored_directory(d)]
+        for d in dirs:
+            yield os.path.join(current, d)
+
+class Watcher(ABC):
+    """
+    Track changes to pinned files and folders between calls to poll().
+
+    poll() returns the set of changed paths, where a changed directory means that
+    entries were added to or removed from it, or None if changes may have been
+    missed and all cached state should be considered stale.
+    """
+
+    @abstractmethod
+    def watch(self, pinned_items: Iterable[str]):
+        """Watch the files and folders of the pinned items."""
+
+    @abstractmethod
+    def poll(self) -> Optional[Set[str]]:
+        """Return the paths that changed since the last call."""
+
+    def close(self):
+        pass
+
+class InotifyWatcher(Watcher):
+    """Watcher backed by Linux inotify, with one watch per directory."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories: Dict[int, str] = {}
+        self.descriptors: Dict[str, int] = {}
+        self.roots: Set[str] = set()
+        self.files: Set[str] = set()
+        self.overflowed = False
+        self.incomplete = False
+
+    def add_directory(self, directory: str):
+        if directory in self.descriptors:
+            return
+        descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if descriptor < 0:
+            # Typically the per-user watch limit, changes may go unnoticed from here on
+            self.incomplete = True
+            return
+        self.directories[descriptor] = directory
+        self.descriptors[directory] = descriptor
+
+    def watch(self, pinned_items: Iterable[str]):
+        directories, files = get_watch_roots(pinned_items)
+        for directory in directories:
+            if directory not in self.roots:
+                self.roots.add(directory)
+                for subdirectory in iter_directories(directory):
+                    self.add_directory(subdirectory)
+        for file_path in files:
+            # Watch the parent, since editors often replace files instead of writing them in place
+            self.files.add(file_path)
+            self.add_directory(os.path.dirname(file_path))
+
+    def is_relevant(self, path: str) -> bool:
+        return path in self.files or any(path == root or path.startswith(root + os.sep) for root in self.roots)
+
+    def poll(self) -> Optional[Set[str]]:
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+                self.handle_event(descriptor, mask, os.fsdecode(name), changed)
+
+        if self.overflowed or self.incomplete:
+            self.overflowed = False
+            return None
+        return changed
+
+    def handle_event(self, descriptor: int, mask: int, name: str, changed: Set[str]):
+        if mask & IN_Q_OVERFLOW:
+            self.overflowed = True
+            return
+        directory = self.directories.get(descriptor)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            del self.directories[descriptor]
+            self.descriptors.pop(directory, None)
+            return
+
+        path = os.path.join(directory, name) if name else directory
+        if not self.is_relevant(path) and not self.is_relevant(directory):
+            return
+        changed.add(path)
+        if mask & (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO):
+            changed.add(directory)
+        if (mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and not is_ignored_directory(name) and self.is_relevant(path)
+                and not is_ignored_path(path, True)):
+            for subdirectory in iter_directories(path):
+                self.add_directory(subdirectory)
+                changed.add(subdirectory)
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher(Watcher):
+    """Portable watcher that compares file and directory stats on every poll."""
+
+    def __init__(self):
+        self.pinned_items: List[str] = []
+        self.stats: Dict[str, Tuple[int, int]] = {}
+
+    def snapshot(self) -> Dict[str, Tuple[int, int]]:
+        directories, files = get_watch_roots(self.pinned_items)
+        paths = list(files)
+        for root in directories:
+            for current, dirs, names in walk(root):
+                dirs[:] = [d for d in dirs if not is_ignored_directory(d)]
+                paths.append(current)
+                paths.extend(os.path.join(current, name) for name in names)
+
+        stats = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def watch(self, pinned_items: Iterable[str]):
+        self.pinned_items = list(pinned_items)
+        self.stats = self.snapshot()
+
+    def poll(self) -> Optional[Set[str]]:
+        stats = self.snapshot()
+        changed = {path for path in stats.keys() | self.stats.keys() if stats.get(path) != self.stats.get(path)}
+        self.stats = stats
+        return changed
+
+def create_watcher() -> Watcher:
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher()
+
+_watcher: Optional[Watcher] = None
+_watched_items: Set[str] = set()
+
+def sync_pinned_state():
+    """
+    Bring cached file listings and contents up to date with the disk.
+
+    The first call starts watching the pinned items and drops all cached state.
+    Later calls only drop the state of paths that changed since the previous call,
+    so unchanged files are neither listed nor read again.
+    """
+    global _watcher, _watched_items
+    pinned_items = set(get_pinned_items())
+    if _watcher is None:
+        _watcher = create_watcher()
+        _watcher.watch(pinned_items)
+        changed = None
+    else:
+        changed = _watcher.poll()
+        # Newly pinned items were not watched before, their cached state may be stale
+        new_items = pinned_items - _watched_items
+        if new_items:
+            _watcher.watch(pinned_items)
+            if changed is not None:
+                changed.update(path for path in map(get_item_path, new_items) if path is not None)
+    _watched_items = pinned_items
+
+    invalidate_index(changed)
+    invalidate_file_contents(changed)
+    trust_cached_contents(changed is not None)
@@ -0,0 +1,24 @@
+import os
+import tempfile
+
+# Settings, pins and the history are stored below these folders, whose paths are
+# resolved when pinboard is imported, so they are isolated before any test imports it
+_home = tempfile.mkdtemp(prefix="pinboard-tests-")
+os.environ["HOME"] = _home
+os.environ["XDG_CONFIG_HOME"] = os.path.join(_home, ".config")
+os.environ["XDG_DATA_HOME"] = os.path.join(_home, ".local", "share")
+os.environ["PINBOARD_CACHE"] = "off"
+
+import pytest
+from pinboard import llm
+from pinboard.pin import clear_pins, invalidate_index
+
+@pytest.fixture(autouse=True)
+def isolated_state(monkeypatch, tmp_path):
+    """Run every test in its own folder, without pins and with a fresh retry policy."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llm, "_retry_policy", None)
+    clear_pins()
+    invalidate_index()
+    yield
+    clear_pins()
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+from anthropic import RateLimitError
+
+from pinboard.batch import BatchJob, dispatch, prepare_requests, run_batch
+from pinboard.pin import add_pins
+
+class FakeMessages:
+    """Stands in for the Messages endpoint, answering every request with respond(request)."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.starts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, timeout=None, **request):
+        self.starts.append(time.monotonic())
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.02)
+            result = self.respond(request)
+        finally:
+            self.in_flight -= 1
+        if isinstance(result, Exception):
+            raise result
+        return SimpleNamespace(content=[SimpleNamespace(text=result)], usage=SimpleNamespace(input_tokens=10, output_tokens=5))
+
+class FakeClient:
+    def __init__(self, respond):
+        self.messages = FakeMessages(respond)
+
+    async def close(self):
+        pass
+
+def get_message(request):
+    return request["messages"][-1]["content"][-1]["text"].rsplit("User: ", 1)[-1]
+
+def rate_limit_error(retry_after: float) -> RateLimitError:
+    response = httpx.Response(429, headers={"retry-after": str(retry_after)}, request=httpx.Request("POST", "http://fake/v1/messages"))
+    return RateLimitError("Rate limited", response=response, body=None)
+
+def test_dispatch_limits_requests_in_flight(tmp_path):
+    (tmp_path / "a.txt").write_text("a\n")
+    add_pins([str(tmp_path / "a.txt")])
+    jobs = [BatchJob(str(i), f"question {i}") for i in range(6)]
+    prepare_requests(jobs)
+    client = FakeClient(lambda request: f"answer to {get_message(request)}")
+
+    asyncio.run(dispatch(jobs, 2, client))
+
+    assert client.messages.max_in_flight == 2
+    assert [job.response for job in jobs] == [f"answer to question {i}" for i in range(6)]
+    assert all(job.status == "pending" and job.error is None for job in jobs)
+
+def test_rate_limit_pauses_all_requests(tmp_path):
+    (tmp_path / "a.txt").write_text("a\n")
+    add_pins([str(tmp_path / "a.txt")])
+    jobs = [BatchJob(str(i), f"question {i}") for i in range(3)]
+    prepare_requests(jobs)
+    limited_at = []
+
+    def respond(request):
+        if get_message(request) == "question 0" and not limited_at:
+            limited_at.append(time.monotonic())
+            return rate_limit_error(0.3)
+        return "answer"
+
+    client = FakeClient(respond)
+    asyncio.run(dispatch(jobs, 2, client))
+
+    assert [job.response for job in jobs] == ["answer"] * 3
+    assert jobs[0].retries == 1
+    # Requests started after the rate limit wait until its retry-after passed, not only the limited one
+    later = [start for start in client.messages.starts if start > limited_at[0]]
+    assert len(later) == 2
+    assert all(start >= limited_at[0] + 0.3 for start in later)
+
+def test_apply_skips_conflicting_jobs(tmp_path):
+    shared, other = tmp_path / "shared.txt", tmp_path / "other.txt"
+    shared.write_text("one\ntwo\n")
+    other.write_text("three\n")
+    add_pins([str(shared), str(other)])
+
+    def respond(request):
+        message = get_message(request)
+        edit = '<artifactEdit identifier="{}" mode="replace"><search>{}</search><replace>{}</replace></artifactEdit>'
+        if message == "first":
+            return edit.format(shared, "one", "ONE")
+        if message == "second":
+            return edit.format(shared, "two", "TWO") + edit.format(other, "three", "THREE")
+        return "No edits needed."
+
+    jobs = [BatchJob("first", "first"), BatchJob("second", "second"), BatchJob("question", "question")]
+    output_dir = tmp_path / "results"
+    run_batch(jobs, str(output_dir), concurrency=3, apply=True, client=FakeClient(respond))
+
+    assert [job.status for job in jobs] == ["applied", "conflict", "answered"]
+    assert shared.read_text() == "ONE\ntwo\n"
+    assert other.read_text() == "three\n"
+    result = json.loads((output_dir / "second.json").read_text())
+    assert result["status"] == "conflict"
+    assert sorted(result["changes"]) == [str(other), str(shared)]
+    assert (output_dir / "second.diff").exists()
+    assert not (output_dir / "question.diff").exists()
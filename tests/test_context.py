@@ -0,0 +1,62 @@
+import os
+
+from pinboard.context import get_context_connection, get_file_rows, get_file_stats, get_file_tokens, pack_files, prune_cache, rank_files, save_cache, tokenize
+
+def test_tokenize_splits_identifiers():
+    assert tokenize("parseValue snake_case 42") == ["parsevalue", "parse", "value", "snake_case", "snake", "case", "42"]
+
+def test_file_stats_follow_changes(tmp_path):
+    path = tmp_path / "module.py"
+    path.write_text("alpha beta alpha\n")
+    assert get_file_stats(str(path), ["alpha", "gamma"])["terms"] == {"alpha": 2}
+    save_cache()
+    # Served from the cache for unchanged files
+    assert get_file_stats(str(path), ["alpha", "beta"])["terms"] == {"alpha": 2, "beta": 1}
+
+    path.write_text("gamma gamma gamma gamma\n")
+    os.utime(path, ns=(1, 1))
+    stats = get_file_stats(str(path), ["alpha", "gamma"])
+    assert stats["terms"] == {"gamma": 4}
+    assert stats["length"] == 4
+
+def test_terms_are_only_indexed_for_ranking(tmp_path):
+    path = tmp_path / "counted.py"
+    path.write_text("alpha beta\n")
+    tokens = get_file_tokens(str(path))
+    assert tokens > 0
+    assert get_file_rows()[str(path)][3] is None
+    stats = get_file_stats(str(path), ["beta"])
+    assert stats == {"tokens": tokens, "length": 2, "terms": {"beta": 1}}
+    assert get_file_rows()[str(path)][3] == 2
+
+def test_prune_cache_drops_unpinned_files(tmp_path):
+    kept, unpinned = str(tmp_path / "kept.py"), str(tmp_path / "unpinned.py")
+    for path in (kept, unpinned):
+        with open(path, "w") as f:
+            f.write("alpha\n")
+        get_file_tokens(path)
+    prune_cache([kept])
+
+    assert kept in get_file_rows() and unpinned not in get_file_rows()
+    stored = {path for path, in get_context_connection().execute("SELECT path FROM files")}
+    assert kept in stored and unpinned not in stored
+
+def test_file_stats_of_unreadable_paths(tmp_path):
+    empty = {"tokens": 0, "length": 0, "terms": {}}
+    assert get_file_stats(str(tmp_path / "missing.py")) == empty
+    # A path that can be stat'ed but not opened as a file
+    assert get_file_stats(str(tmp_path)) == empty
+
+def test_pack_files_prefers_explicit_and_relevant_files(tmp_path):
+    files = {}
+    for name, word in (("parser.py", "parse"), ("render.py", "render"), ("explicit.py", "other")):
+        path = tmp_path / name
+        path.write_text(f"{word} = 1\n" * 40)
+        files[name] = str(path)
+    budget = get_file_stats(files["parser.py"])["tokens"] * 2
+
+    scores = rank_files(files.values(), "parse the input")
+    assert scores[files["parser.py"]] > scores[files["render.py"]]
+    kept, dropped = pack_files(files.values(), {files["explicit.py"]}, "parse the input", budget=budget)
+    assert kept == sorted([files["explicit.py"], files["parser.py"]])
+    assert dropped == [files["render.py"]]
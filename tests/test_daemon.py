@@ -0,0 +1,82 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import click
+import pytest
+import rich
+
+from pinboard import cli, daemon, watch
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    """Serve commands on a socket of the test, running a fake app that reports where and how it ran."""
+    monkeypatch.setattr(daemon, "SOCKET_FILE", str(tmp_path / "daemon.sock"))
+    monkeypatch.setattr(watch, "sync_pinned_state", lambda: None)
+    calls = []
+
+    def app(args, prog_name, standalone_mode):
+        calls.append({"args": args, "cwd": os.getcwd(), "value": os.environ.get("PINBOARD_TEST_VALUE")})
+        print(f"ran {' '.join(args)}")
+        rich.print("[bold]rich[/bold]")
+        # Changes made by a command do not outlive it
+        os.environ["PINBOARD_TEST_LEAKED"] = "1"
+        os.chdir(str(tmp_path))
+        raise click.exceptions.Exit(int(args[-1]))
+
+    monkeypatch.setattr(cli, "app", app)
+    thread = threading.Thread(target=daemon.serve, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while daemon.connect() is None:
+        assert time.monotonic() < deadline, "the daemon did not start"
+        time.sleep(0.01)
+    yield calls
+    assert daemon.stop()
+    thread.join(5)
+    assert not os.path.exists(daemon.SOCKET_FILE)
+
+def send(request):
+    with daemon.connect() as client, client.makefile("rb") as responses:
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        return [json.loads(line) for line in responses]
+
+def test_command_runs_in_the_client_cwd_and_env(server, tmp_path):
+    client_dir = tmp_path / "client"
+    client_dir.mkdir()
+    cwd, environ = os.getcwd(), dict(os.environ)
+    env = dict(environ, PINBOARD_TEST_VALUE="from the client")
+
+    responses = send({"args": ["ls", "3"], "cwd": str(client_dir), "env": env, "tty": False, "width": None})
+
+    assert server == [{"args": ["ls", "3"], "cwd": str(client_dir), "value": "from the client"}]
+    assert "".join(response.get("out", "") for response in responses) == "ran ls 3\nrich\n"
+    assert responses[-1] == {"exit": 3}
+    assert os.getcwd() == cwd
+    assert dict(os.environ) == environ
+    assert not isinstance(rich.get_console().file, daemon.SocketWriter)
+
+def test_forward_relays_output_and_exit_code(server, capsys):
+    assert daemon.forward(["ls", "2"]) == 2
+    assert capsys.readouterr().out == "ran ls 2\nrich\n"
+    # Commands that always run in-process are not sent
+    assert daemon.forward(["succeed", "0"]) is None
+    assert len(server) == 1
+
+def test_busy_daemon_falls_back_to_in_process(server):
+    with daemon._busy:
+        assert daemon.forward(["ls", "0"]) is None
+    assert server == []
+
+def test_stale_socket_falls_back_to_in_process(monkeypatch, tmp_path):
+    socket_file = str(tmp_path / "stale.sock")
+    # A socket that was bound but is not listening, as left behind by a killed daemon
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_file)
+    stale.close()
+    monkeypatch.setattr(daemon, "SOCKET_FILE", socket_file)
+
+    assert daemon.connect() is None
+    assert daemon.forward(["ls"]) is None
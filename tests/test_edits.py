@@ -0,0 +1,61 @@
+import pytest
+
+from pinboard.llm import EditApplier
+from pinboard.utils import EditError, apply_edits, find_lines, resolve_edits
+
+LINES = ["def main():", "    value = 1", "    return value", "", "def other():", "    return 2"]
+
+def test_find_lines_prefers_exact_matches():
+    assert find_lines(LINES, ["    return value"]) == 2
+    # Surrounding whitespace is ignored when nothing matches exactly
+    assert find_lines(LINES, ["value = 1", "return value"]) == 1
+
+def test_find_lines_falls_back_to_fuzzy_matches():
+    assert find_lines(LINES, ["def other( ):", "    return 2"]) == 4
+
+def test_find_lines_rejects_ambiguous_missing_and_empty_blocks():
+    with pytest.raises(EditError, match="matches 2 places"):
+        find_lines(["x", "y", "x"], ["x"])
+    with pytest.raises(EditError, match="does not match"):
+        find_lines(LINES, ["class Missing:"])
+    with pytest.raises(EditError, match="empty"):
+        find_lines(LINES, ["  ", ""])
+
+def test_resolve_edits_sorts_and_merges_duplicates():
+    edits = [{"from": 5, "to": 6, "content": "pass"}, {"from": 1, "to": 1, "content": "def run():"},
+             {"from": 5, "to": 6, "content": "pass"}]
+    assert resolve_edits(LINES, edits) == [(0, 1, ["def run():"]), (4, 6, ["pass"])]
+
+def test_resolve_edits_rejects_overlapping_and_out_of_range_edits():
+    with pytest.raises(EditError, match="overlap"):
+        resolve_edits(LINES, [{"from": 1, "to": 3, "content": "a"}, {"from": 3, "to": 4, "content": "b"}])
+    with pytest.raises(EditError, match="out of range"):
+        resolve_edits(LINES, [{"from": 6, "to": 8, "content": "a"}])
+
+def test_apply_edits_refers_to_the_original_lines():
+    content = "\n".join(LINES)
+    edits = [{"search": "    return 2", "replace": "    return 3"},
+             {"from": 2, "to": 2, "content": "    value = 1\n    value += 1"},
+             {"from": 4, "to": 3, "content": "# inserted"}]
+    assert apply_edits(content, edits).split("\n") == [
+        "def main():", "    value = 1", "    value += 1", "    return value", "# inserted", "",
+        "def other():", "    return 3"]
+
+def test_apply_edits_removes_lines_without_content():
+    assert apply_edits("a\nb\nc", [{"from": 2, "to": 2, "content": ""}]) == "a\nc"
+
+def test_rejected_file_keeps_no_edits(tmp_path):
+    path = tmp_path / "module.py"
+    path.write_text("one\ntwo\n")
+    applier = EditApplier("sh")
+    good = {"search": "one", "replace": "ONE"}
+    # Streamed edits are staged one at a time, until one of them cannot be applied
+    applier.apply(str(path), [good])
+    applier.apply(str(path), [good, {"search": "missing", "replace": "x"}])
+    applier.apply(str(path), [good, {"search": "missing", "replace": "x"}, {"search": "two", "replace": "TWO"}])
+    applier.finish()
+
+    assert applier.edited_files == {}
+    assert list(applier.rejected) == [str(path)]
+    assert path.read_text() == "one\ntwo\n"
+    assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from pinboard import file
+from pinboard.file import FileTransaction
+
+def test_commit_replaces_and_removes_files(tmp_path):
+    edited, removed, added = tmp_path / "edited.txt", tmp_path / "removed.txt", tmp_path / "new" / "added.txt"
+    edited.write_text("before\n")
+    removed.write_text("gone\n")
+    transaction = FileTransaction()
+    transaction.write(str(edited), "after\n")
+    transaction.remove(str(removed))
+    transaction.write(str(added), "new\n")
+    # Nothing is visible before the commit
+    assert edited.read_text() == "before\n" and removed.exists() and not added.exists()
+
+    transaction.commit({str(edited): "before\n", str(removed): "gone\n", str(added): None})
+    assert edited.read_text() == "after\n"
+    assert not removed.exists()
+    assert added.read_text() == "new\n"
+    assert transaction.staged == {}
+
+def test_failed_commit_rolls_back_replaced_files(tmp_path, monkeypatch):
+    first, second, added = tmp_path / "first.txt", tmp_path / "second.txt", tmp_path / "added.txt"
+    first.write_text("first\n")
+    second.write_text("second\n")
+    transaction = FileTransaction()
+    transaction.write(str(first), "FIRST\n")
+    transaction.write(str(added), "added\n")
+    transaction.write(str(second), "SECOND\n")
+
+    replace = os.replace
+    def fail_on_second(source, target):
+        if target == str(second):
+            raise OSError("disk full")
+        replace(source, target)
+    monkeypatch.setattr(file.os, "replace", fail_on_second)
+
+    with pytest.raises(OSError):
+        transaction.commit({str(first): "first\n", str(second): "second\n", str(added): None})
+    assert first.read_text() == "first\n"
+    assert second.read_text() == "second\n"
+    assert not added.exists()
+    # The staged temporary files are cleaned up as well
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["first.txt", "second.txt"]
+
+def test_discard_drops_staged_files(tmp_path):
+    path = tmp_path / "file.txt"
+    transaction = FileTransaction()
+    transaction.write(str(path), "content\n")
+    transaction.discard()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,134 @@
+import pytest
+
+from pinboard import history
+from pinboard.config import set_config
+from pinboard.history import get_history_connection, list_operations, operation_group, record_operation, redo, undo
+
+@pytest.fixture(autouse=True)
+def empty_history():
+    connection = get_history_connection()
+    with connection:
+        connection.execute("DELETE FROM journal")
+        connection.execute("DELETE FROM blobs")
+    set_config("history_max_bytes", history.DEFAULT_MAX_BYTES)
+
+def write(path, before, after, kind="sh"):
+    """Change a file like an applied edit does, and journal the change."""
+    if after is None:
+        path.unlink()
+    else:
+        path.write_text(after)
+    action = "added" if before is None else "removed" if after is None else "updated"
+    return record_operation(kind, {str(path): (before, after)}, {str(path): action})
+
+def get_blob_hashes():
+    connection = get_history_connection()
+    stored = {digest for digest, in connection.execute("SELECT hash FROM blobs")}
+    referenced = {digest for row in connection.execute("SELECT before_hash, after_hash FROM journal_files") for digest in row if digest}
+    return stored, referenced
+
+def test_undo_and_redo_restore_files(tmp_path):
+    edited, added = tmp_path / "edited.txt", tmp_path / "added.txt"
+    edited.write_text("one\n")
+    write(edited, "one\n", "two\n")
+    write(added, None, "new\n")
+
+    assert undo() == [(str(added), "Removed")]
+    assert not added.exists()
+    assert undo() == [(str(edited), "Restored")]
+    assert edited.read_text() == "one\n"
+    assert undo() == []
+
+    redo()
+    assert edited.read_text() == "two\n"
+    redo()
+    assert added.read_text() == "new\n"
+    assert redo() == []
+
+def test_group_is_undone_at_once(tmp_path):
+    first, second = tmp_path / "first.txt", tmp_path / "second.txt"
+    first.write_text("a\n")
+    second.write_text("b\n")
+    with operation_group():
+        write(first, "a\n", "A\n")
+        write(second, "b\n", "B\n")
+
+    assert len({operation["group_id"] for operation in list_operations()}) == 1
+    undo()
+    assert (first.read_text(), second.read_text()) == ("a\n", "b\n")
+
+def test_undo_to_operation(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("0\n")
+    first = write(path, "0\n", "1\n")
+    write(path, "1\n", "2\n")
+    write(path, "2\n", "3\n")
+
+    undo(to=first)
+    assert path.read_text() == "1\n"
+    with pytest.raises(ValueError):
+        undo(to=first + 100)
+
+def test_new_operation_discards_undone_ones(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("a\n")
+    write(path, "a\n", "b\n")
+    undo()
+    write(path, "a\n", "c\n")
+
+    assert redo() == []
+    assert [operation["undone"] for operation in list_operations()] == [False]
+    stored, referenced = get_blob_hashes()
+    assert stored == referenced
+
+def test_evict_reclaims_delta_bases(tmp_path):
+    path = tmp_path / "file.txt"
+    lines = [f"line {i} of a file that is large enough to be stored as deltas\n" for i in range(200)]
+    versions = []
+    for i in range(12):
+        lines[i * 10] = f"changed in version {i}\n"
+        versions.append("".join(lines))
+    path.write_text(versions[0])
+    for before, after in zip(versions, versions[1:]):
+        write(path, before, after)
+    connection = get_history_connection()
+    assert connection.execute("SELECT COUNT(*) FROM blobs WHERE base IS NOT NULL").fetchone()[0] > 0
+
+    # Only the last operations fit, their versions were stored as deltas against evicted ones
+    total = connection.execute("SELECT SUM(stored_size) FROM blobs").fetchone()[0]
+    set_config("history_max_bytes", total // 2)
+    write(path, versions[-1], versions[0])
+
+    assert len(list_operations()) < len(versions)
+    stored, referenced = get_blob_hashes()
+    assert stored == referenced
+    assert connection.execute("SELECT SUM(stored_size) FROM blobs").fetchone()[0] < total
+
+    # Rebased versions still restore the right content
+    while undo():
+        pass
+    assert path.read_text() == versions[len(versions) - len(list_operations())]
+
+def test_garbage_collection_keeps_chain_depths(tmp_path):
+    path = tmp_path / "file.txt"
+    lines = [f"line {i} of a file that is large enough to be stored as deltas\n" for i in range(200)]
+    versions = []
+    for i in range(12):
+        lines[i * 10] = f"changed in version {i}\n"
+        versions.append("".join(lines))
+    path.write_text(versions[0])
+    operations = [write(path, before, after) for before, after in zip(versions, versions[1:])]
+    connection = get_history_connection()
+
+    # Drop operations from the middle, the versions after them are rebased onto an earlier one
+    with connection:
+        connection.executemany("DELETE FROM journal WHERE id = ?", [(operation,) for operation in operations[4:7]])
+        history.collect_garbage(connection)
+
+    rows = connection.execute("SELECT hash, base, depth FROM blobs").fetchall()
+    depths = {digest: depth for digest, _, depth in rows}
+    for digest, base, depth in rows:
+        assert depth == (0 if base is None else depths[base] + 1)
+        assert depth <= history.MAX_DELTA_DEPTH
+    assert max(depths.values()) < len(versions) - 1
+    assert {history.load_blob(connection, digest) for digest in depths} == set(versions[:5] + versions[7:])
@@ -0,0 +1,93 @@
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from pinboard.ignore import IgnoreMatcher, IgnoreRules, list_git_files, translate_pattern, walk
+from pinboard.pin import scan_directory
+
+@pytest.mark.parametrize("pattern, matches, misses", [
+    ("*.pyc", ["a.pyc"], ["a.pyc/b", "dir/a.py"]),
+    ("doc/**/*.md", ["doc/a.md", "doc/x/y/a.md"], ["a.md", "src/doc/a.md"]),
+    ("build/**", ["build/a", "build/a/b"], ["build"]),
+    ("file?.txt", ["file1.txt"], ["file10.txt", "file/.txt"]),
+    ("[!a]*.log", ["b.log"], ["a.log"]),
+    ("\\#notes", ["#notes"], ["notes"]),
+])
+def test_translate_pattern(pattern, matches, misses):
+    regex = re.compile(translate_pattern(pattern) + r"\Z")
+    assert all(regex.match(path) for path in matches)
+    assert not any(regex.match(path) for path in misses)
+
+def test_rules_are_matched_relative_to_their_directory(tmp_path):
+    base = str(tmp_path)
+    rules = IgnoreRules(base, ["# comment\n", "*.log\n", "!keep.log\n", "/root-only\n", "cache/\n", "trailing \n"])
+
+    def match(relative, is_dir=False):
+        return rules.match(os.path.join(base, relative), is_dir)
+
+    assert match("debug.log") is True
+    assert match("sub/debug.log") is True
+    assert match("keep.log") is False
+    assert match("root-only") is True
+    assert match("sub/root-only") is None
+    assert match("cache", is_dir=True) is True
+    assert match("cache") is None
+    assert match("trailing") is True
+    assert rules.match(os.path.join(base + "-sibling", "debug.log"), False) is None
+
+def test_deeper_rules_take_precedence(tmp_path):
+    (tmp_path / ".gitignore").write_text("*.txt\n")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / ".gitignore").write_text("!keep.txt\n")
+    matcher = IgnoreMatcher().child(str(tmp_path), [".gitignore"]).child(str(tmp_path / "sub"), [".gitignore"])
+
+    assert matcher.is_ignored(str(tmp_path / "sub" / "other.txt"), False)
+    assert not matcher.is_ignored(str(tmp_path / "sub" / "keep.txt"), False)
+
+def test_walk_leaves_out_ignored_entries(tmp_path):
+    (tmp_path / ".gitignore").write_text("*.tmp\nbuild/\n")
+    for relative in ("a.py", "a.tmp", "build/out.py", "src/b.py", "src/c.tmp"):
+        path = tmp_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x\n")
+
+    found = sorted(os.path.relpath(os.path.join(current, name), tmp_path) for current, _, files in walk(str(tmp_path)) for name in files)
+    assert found == [".gitignore", "a.py", os.path.join("src", "b.py")]
+
+def git(*args, cwd):
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", "-c", "protocol.file.allow=always", *args],
+                   cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_list_git_files_leaves_out_submodules(tmp_path):
+    library, project = tmp_path / "library", tmp_path / "project"
+    for repository in (library, project):
+        repository.mkdir()
+        git("init", "-q", cwd=repository)
+    (library / "lib.py").write_text("x\n")
+    git("add", ".", cwd=library)
+    git("commit", "-qm", "library", cwd=library)
+    (project / "tracked.py").write_text("x\n")
+    (project / "deleted.py").write_text("x\n")
+    (project / ".gitignore").write_text("*.log\n")
+    git("add", ".", cwd=project)
+    git("submodule", "add", "-q", str(library), "library", cwd=project)
+    (project / "deleted.py").unlink()
+    (project / "untracked.py").write_text("x\n")
+    (project / "ignored.log").write_text("x\n")
+
+    files = list_git_files(str(project))
+    assert sorted(os.path.basename(path) for path in files) == [".gitignore", ".gitmodules", "tracked.py", "untracked.py"]
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_scan_directory_below_an_ignored_directory(tmp_path):
+    git("init", "-q", cwd=tmp_path)
+    (tmp_path / ".gitignore").write_text("build/\n")
+    (tmp_path / "build" / "sub").mkdir(parents=True)
+    (tmp_path / "build" / "sub" / "out.py").write_text("x\n")
+
+    for directory in (tmp_path / "build", tmp_path / "build" / "sub"):
+        assert scan_directory(str(directory)) == {str(tmp_path / "build" / "sub" / "out.py")}
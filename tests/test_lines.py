@@ -0,0 +1,34 @@
+import io
+
+import pytest
+
+from pinboard.lines import LineIndex
+
+def splice(tmp_path, content, spans):
+    path = tmp_path / "file.txt"
+    path.write_bytes(content)
+    out = io.BytesIO()
+    with LineIndex(str(path)) as index:
+        index.write_spliced(out, spans)
+    return out.getvalue()
+
+@pytest.mark.parametrize("content", [b"a\nb\nc\n", b"a\r\nb\r\nc", b"", b"\n"])
+def test_lines_match_split(tmp_path, content):
+    path = tmp_path / "file.txt"
+    path.write_bytes(content)
+    with LineIndex(str(path)) as index:
+        assert list(index) == content.decode().replace("\r\n", "\n").split("\n")
+
+def test_splice_first_and_last_lines(tmp_path):
+    assert splice(tmp_path, b"a\nb\nc\n", [(0, 1, ["A", "A2"])]) == b"A\nA2\nb\nc\n"
+    assert splice(tmp_path, b"a\nb\nc\n", [(2, 3, ["C"])]) == b"a\nb\nC\n"
+    assert splice(tmp_path, b"a\nb\nc\n", [(0, 1, []), (2, 3, ["C"])]) == b"b\nC\n"
+
+def test_splice_keeps_crlf_line_endings(tmp_path):
+    assert splice(tmp_path, b"a\r\nb\r\nc\r\n", [(1, 2, ["B", "B2"])]) == b"a\r\nB\r\nB2\r\nc\r\n"
+    assert splice(tmp_path, b"a\r\nb\r\nc\r\n", [(0, 1, ["A"]), (2, 3, [])]) == b"A\r\nb\r\n"
+
+def test_splice_without_trailing_newline(tmp_path):
+    assert splice(tmp_path, b"a\nb", [(1, 2, ["B"])]) == b"a\nB"
+    assert splice(tmp_path, b"a\nb\nc", [(1, 2, [])]) == b"a\nc"
+    assert splice(tmp_path, b"a\r\nb", [(0, 1, ["A"])]) == b"A\r\nb"
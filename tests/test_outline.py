@@ -0,0 +1,47 @@
+from pinboard import outline, symbols
+from pinboard.outline import get_outline_spans, render_outline, render_pinned_file
+from pinboard.symbols import PythonResolver
+
+SOURCE = '''"""Tools."""
+
+def parse(text):
+    """Parse text."""
+    return text.split()
+
+class Parser:
+    def feed(self, data):
+        self.data = data
+'''
+
+def test_render_outline(tmp_path):
+    path = tmp_path / "tools.py"
+    path.write_text(SOURCE)
+
+    expected = '1: """Tools."""\n...\n3: def parse(text):\n4:     """Parse text."""\n...\n7: class Parser:\n8:     def feed(self, data):\n...\n'
+    assert render_outline(str(path)) == expected
+    assert render_pinned_file(str(path), {}, {str(path)}) == expected
+
+def test_outlines_are_cached_by_content(tmp_path, monkeypatch):
+    calls = []
+
+    class CountingResolver(PythonResolver):
+        def outline(self, content):
+            calls.append(content)
+            return super().outline(content)
+
+    monkeypatch.setitem(symbols._resolvers, ".py", CountingResolver())
+    # Unique content, since the outline cache outlives a test
+    content = SOURCE + f"\nTMP = {str(tmp_path)!r}\n"
+    first = get_outline_spans(str(tmp_path / "a.py"), content)
+    # Another file with the same content shares the cached outline
+    assert get_outline_spans(str(tmp_path / "b.py"), content) == first
+    assert len(calls) == 1
+    get_outline_spans(str(tmp_path / "a.py"), content + "def more():\n    pass\n")
+    assert len(calls) == 2
+
+def test_unsupported_files_are_rendered_as_a_stub(tmp_path):
+    path = tmp_path / "notes.md"
+    path.write_text("# Notes\n\nSome text.\n")
+
+    assert render_outline(str(path)) == outline.OUTLINE_STUB.format(path=str(path), size=20)
+    assert "notes.md, 20 bytes" in render_outline(str(path))
@@ -0,0 +1,96 @@
+import httpx
+import pytest
+from anthropic import APIConnectionError, APIStatusError, BadRequestError
+
+from pinboard import llm
+from pinboard.config import set_config
+from pinboard.llm import LLMUnavailableError, RetryPolicy, get_retry_policy, send_with_retries
+
+REQUEST = httpx.Request("POST", "http://fake/v1/messages")
+
+def status_error(status_code: int, headers=None):
+    response = httpx.Response(status_code, headers=headers or {}, request=REQUEST)
+    error_class = BadRequestError if status_code == 400 else APIStatusError
+    return error_class(f"Status {status_code}", response=response, body=None)
+
+@pytest.fixture(autouse=True)
+def retry_settings():
+    set_config("retry_budget", llm.DEFAULT_RETRY_BUDGET)
+    set_config("request_deadline", llm.DEFAULT_REQUEST_DEADLINE)
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record the waits between attempts instead of sleeping."""
+    waited = []
+    monkeypatch.setattr(llm.time, "sleep", waited.append)
+    return waited
+
+def test_delay_follows_retry_after():
+    policy = RetryPolicy()
+    deadline = llm.time.monotonic() + 100
+    assert policy.get_delay(status_error(429, {"retry-after": "7"}), 1, deadline) == 7
+    assert policy.get_delay(status_error(529, {"retry-after-ms": "250"}), 1, deadline) == 0.25
+    assert policy.remaining_budget == llm.DEFAULT_RETRY_BUDGET - 7.25
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy()
+    deadline = llm.time.monotonic() + 1000
+    for attempt in range(1, llm.MAX_REQUEST_ATTEMPTS):
+        delay = policy.get_delay(APIConnectionError(request=REQUEST), attempt, deadline)
+        assert 0 <= delay <= min(llm.BACKOFF_BASE * 2 ** (attempt - 1), llm.BACKOFF_MAX)
+
+def test_gives_up_on_permanent_errors_attempts_deadline_and_budget():
+    policy = RetryPolicy()
+    deadline = llm.time.monotonic() + 100
+    assert policy.get_delay(status_error(400), 1, deadline) is None
+    assert policy.get_delay(status_error(529), llm.MAX_REQUEST_ATTEMPTS, deadline) is None
+    assert policy.get_delay(status_error(429, {"retry-after": "200"}), 1, deadline) is None
+    set_config("retry_budget", 5)
+    assert RetryPolicy().get_delay(status_error(429, {"retry-after": "10"}), 1, deadline) is None
+
+def test_send_with_retries_retries_until_success(sleeps):
+    errors = [status_error(529, {"retry-after": "1"}), APIConnectionError(request=REQUEST)]
+    timeouts = []
+
+    def send(timeout):
+        timeouts.append(timeout)
+        if errors:
+            raise errors.pop(0)
+        return "response"
+
+    assert send_with_retries(send) == "response"
+    assert len(timeouts) == 3
+    assert sleeps[0] == 1
+    assert all(0 < timeout <= llm.DEFAULT_REQUEST_DEADLINE for timeout in timeouts)
+    # A success refills the budget
+    assert get_retry_policy().remaining_budget == llm.DEFAULT_RETRY_BUDGET
+
+def test_send_with_retries_raises_permanent_errors_unchanged(sleeps):
+    def send(timeout):
+        raise status_error(400)
+
+    with pytest.raises(BadRequestError):
+        send_with_retries(send)
+    assert sleeps == []
+
+def test_circuit_opens_after_repeated_failures(sleeps, monkeypatch):
+    attempts = []
+
+    def send(timeout):
+        attempts.append(timeout)
+        raise status_error(529)
+
+    for _ in range(llm.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(LLMUnavailableError, match="529"):
+            send_with_retries(send)
+    assert len(attempts) == llm.CIRCUIT_FAILURE_THRESHOLD * llm.MAX_REQUEST_ATTEMPTS
+
+    # While the circuit is open, requests fail without being sent
+    with pytest.raises(LLMUnavailableError, match="Not sending requests"):
+        send_with_retries(send)
+    assert len(attempts) == llm.CIRCUIT_FAILURE_THRESHOLD * llm.MAX_REQUEST_ATTEMPTS
+
+    # Once the cooldown passed, requests are let through again
+    now = llm.time.monotonic()
+    monkeypatch.setattr(llm.time, "monotonic", lambda: now + llm.CIRCUIT_COOLDOWN + 1)
+    assert send_with_retries(lambda timeout: "response") == "response"
@@ -0,0 +1,33 @@
+import sys
+import time
+
+import pytest
+
+from pinboard import shell
+from pinboard.shell import run_command
+
+def is_running(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # Reparented children may linger as zombies until they are reaped
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except OSError:
+        return False
+
+def test_keeps_only_the_tail():
+    result = run_command("for i in 1 2 3 4 5; do echo $i; done", tail=2)
+    assert result.exit_code == 0
+    assert result.output == "4\n5\n"
+    assert result.truncated
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads process states from /proc")
+def test_timeout_kills_children_that_ignore_sigterm(monkeypatch):
+    monkeypatch.setattr(shell, "KILL_GRACE_PERIOD", 0.2)
+    result = run_command("(trap '' TERM; exec sleep 30) & echo $!; wait", timeout=0.5)
+    assert result.timed_out == "timeout"
+    pid = int(result.output.split()[0])
+    # SIGKILL is delivered asynchronously
+    deadline = time.monotonic() + 2
+    while is_running(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not is_running(pid)
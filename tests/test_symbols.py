@@ -0,0 +1,47 @@
+from typer.testing import CliRunner
+
+from pinboard.cli import app
+from pinboard.pin import get_pinned_items
+from pinboard.symbols import PythonResolver, get_symbol_span, render_symbols
+
+SOURCE = '''import os
+
+LIMIT = 3
+
+class Server:
+    """Serve requests."""
+
+    @staticmethod
+    def start(port):
+        return port
+
+def main():
+    Server.start(LIMIT)
+'''
+
+def test_index_resolves_qualified_names():
+    spans = PythonResolver().index(SOURCE)
+    assert spans["LIMIT"] == (3, 3)
+    assert spans["Server"] == (5, 10)
+    # Decorators belong to the function they decorate
+    assert spans["Server.start"] == (8, 10)
+    assert spans["main"] == (12, 13)
+    assert PythonResolver().index("def broken(:\n") == {}
+
+def test_render_symbols_by_path_and_name(tmp_path):
+    path = tmp_path / "server.py"
+    path.write_text(SOURCE)
+
+    assert get_symbol_span(str(path), "Server.start") == (8, 10)
+    assert render_symbols(str(path), ["LIMIT", "main"]) == "...\n3: LIMIT = 3\n...\n12: def main():\n13:     Server.start(LIMIT)\n"
+    # A symbol that cannot be resolved anymore shows the whole file
+    assert render_symbols(str(path), ["main", "Missing"], numbered=False) == SOURCE
+
+def test_missing_symbols_are_not_pinned(tmp_path):
+    path = tmp_path / "server.py"
+    path.write_text(SOURCE)
+
+    result = CliRunner().invoke(app, ["add", f"{path}::Server.start", f"{path}::Server.stop", f"{tmp_path / 'missing.py'}::main"])
+    assert result.exit_code == 0
+    assert "do not exist" in result.output
+    assert get_pinned_items() == [f"{path}::Server.start"]
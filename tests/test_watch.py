@@ -0,0 +1,11 @@
+from pinboard.watch import get_item_path, get_watch_roots
+
+def test_items_resolve_to_their_paths(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "module.py").write_text("x = 1\n")
+    folder, module = str(tmp_path / "src"), str(tmp_path / "module.py")
+
+    assert get_item_path(folder + "@outline") == folder
+    assert get_item_path(module + "::x") == module
+    assert get_item_path("main@tmux") is None
+    assert get_watch_roots([folder + "@outline", module + "::x", module, "main@tmux"]) == ([folder], [module, module])